@@ -0,0 +1,168 @@
+import asyncio
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import openai
+
+# "6m0s", "1.5s", "250ms", "1h2m3s" 形式（x-ratelimit-reset-* ヘッダ）
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """
+    例外のレスポンスヘッダからサーバー指定の待ち時間（秒）を取り出す。
+    retry-after-ms > retry-after > x-ratelimit-reset-requests/tokens の順に参照する。
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value:
+        seconds = _parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    resets = [
+        _parse_duration(headers[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if headers.get(name)
+    ]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+def is_throttle_error(exc: Exception) -> bool:
+    """デプロイの混雑を示すエラー（429 / 503）か"""
+    if isinstance(exc, openai.RateLimitError):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code == 503
+
+
+def is_transient_error(exc: Exception) -> bool:
+    """再試行で回復し得る一時的なエラーか"""
+    return is_throttle_error(exc) or isinstance(
+        exc,
+        (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError),
+    )
+
+
+class AIMDController:
+    """
+    AIMD（加算増加・乗算減少）で同時実行ウィンドウを調整するコントローラ。
+    成功のたびにウィンドウを 1/window ずつ広げ（1ウィンドウ分の成功で+1）、
+    スロットリングを受けたら decrease 倍に縮め、サーバー指定の時間だけ新規送信を止める。
+    ゲートウェイのイベントループ上でのみ使用する。
+    """
+
+    def __init__(
+        self,
+        initial_window: int = 8,
+        min_window: int = 1,
+        max_window: int = 32,
+        decrease: float = 0.5,
+    ):
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease = decrease
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.transient_errors = 0
+        self.retry_after_seconds = 0.0
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> float:
+        """ウィンドウに空きができ、一時停止が明けるまで待つ。送信開始時刻を返す"""
+        cond = self._condition()
+        async with cond:
+            while True:
+                pause = self._resume_at - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.window):
+                    self.in_flight += 1
+                    return time.monotonic()
+                await cond.wait()
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def on_success(self):
+        self.successes += 1
+        self.window = min(self.max_window, self.window + 1.0 / self.window)
+
+    def on_throttle(self, started_at: float, wait: float):
+        """
+        スロットリングを記録する。同じ混雑で同時に失敗した複数の呼び出しで
+        何度も縮めないよう、直前の縮小より前に送信したものは縮小に数えない。
+        """
+        self.throttles += 1
+        if started_at >= self._last_decrease:
+            self.window = max(self.min_window, self.window * self.decrease)
+            self._last_decrease = time.monotonic()
+        if wait > 0:
+            self.retry_after_seconds += wait
+            self._resume_at = max(self._resume_at, time.monotonic() + wait)
+
+    def on_transient_error(self):
+        self.transient_errors += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "window": round(self.window, 2),
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "throttles": self.throttles,
+            "transient_errors": self.transient_errors,
+            "retry_after_seconds": round(self.retry_after_seconds, 2),
+            "paused_for": round(max(0.0, self._resume_at - time.monotonic()), 2),
+        }
+
+
+def backoff_seconds(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """サーバー指定がない場合の指数バックオフ（フルジッター）"""
+    return random.uniform(0, min(cap, base * (2**attempt)))
@@ -0,0 +1,117 @@
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+# =========================
+# 条項 × ナレッジの割当行列
+# =========================
+# マッチング結果の付与（_apply_step2）や審査のナレッジごとの条項抽出は、
+# 条項の knowledge_id リストに対する `kid in ...` の二重ループで O(K×C×len) かかっていた。
+# clause_number と knowledge_id をそれぞれ行・列番号に割り当て、numpy の bool 行列で持つ。
+# 重複は行列上で自然に除かれ、和集合・ナレッジごとの条項・条項ごとのナレッジはベクトル演算で求める。
+
+
+class AssignmentMatrix:
+    """
+    条項 × ナレッジの割当（行: 条項の並び順、列: knowledge_id の初出順）。
+    同じ clause_number が複数ある場合、clause_number での指定は後ろの行に付与する
+    （従来の _apply_step2 と同じ）。
+    """
+
+    def __init__(
+        self, clause_numbers: Iterable[Any], knowledge_ids: Iterable[str] = ()
+    ):
+        self.clause_numbers = [str(n) for n in clause_numbers]
+        self._row_of = {n: i for i, n in enumerate(self.clause_numbers)}
+        self.knowledge_ids: List[str] = []
+        self._col_of: Dict[str, int] = {}
+        self.matrix = np.zeros((len(self.clause_numbers), 0), dtype=bool)
+        self.intern(knowledge_ids)
+
+    @classmethod
+    def from_clauses(cls, clauses: List[Dict[str, Any]]) -> "AssignmentMatrix":
+        """各条項の "knowledge_id" リストから作る"""
+        lists = [c.get("knowledge_id") or [] for c in clauses]
+        assignment = cls(
+            [c.get("clause_number", "") for c in clauses],
+            (k for ids in lists for k in ids),
+        )
+        rows = [i for i, ids in enumerate(lists) for _ in ids]
+        cols = [assignment._col_of[k] for ids in lists for k in ids]
+        assignment.matrix[
+            np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)
+        ] = True
+        return assignment
+
+    @classmethod
+    def from_response(
+        cls, clause_numbers: Iterable[Any], response: List[Dict[str, Any]]
+    ) -> "AssignmentMatrix":
+        """マッチング結果 [{"knowledge_id", "clause_number": [...]}] から作る"""
+        assignment = cls(clause_numbers)
+        assignment.assign_response(response)
+        return assignment
+
+    def intern(self, knowledge_ids: Iterable[str]) -> np.ndarray:
+        """knowledge_id を列に割り当て（未登録なら列を追加し）、列番号の配列を返す"""
+        ids = list(knowledge_ids)
+        col_of = self._col_of
+        new = [k for k in dict.fromkeys(ids) if k not in col_of]
+        if new:
+            col_of.update(
+                zip(new, range(len(self.knowledge_ids), len(col_of) + len(new)))
+            )
+            self.knowledge_ids.extend(new)
+            grown = np.zeros((self.matrix.shape[0], len(col_of)), dtype=bool)
+            grown[:, : self.matrix.shape[1]] = self.matrix
+            self.matrix = grown
+        return np.fromiter(map(col_of.__getitem__, ids), dtype=np.intp, count=len(ids))
+
+    def assign_response(self, response: List[Dict[str, Any]]):
+        """マッチング結果を付与する（入力にない clause_number は無視する）"""
+        cols = self.intern(item["knowledge_id"] for item in response)
+        numbers = [item.get("clause_number", []) for item in response]
+        row_of = self._row_of
+        rows = np.fromiter(
+            (row_of.get(str(n), -1) for nums in numbers for n in nums), dtype=np.intp
+        )
+        cols = np.repeat(cols, [len(nums) for nums in numbers])
+        found = rows >= 0
+        self.matrix[rows[found], cols[found]] = True
+
+    def union(self, other: "AssignmentMatrix") -> "AssignmentMatrix":
+        """同じ条項の並びを持つ割当との和集合（列は self の順、other にのみある列を後ろに追加）"""
+        if self.clause_numbers != other.clause_numbers:
+            raise ValueError("条項の並びが異なる割当は結合できません")
+        result = AssignmentMatrix(
+            self.clause_numbers, self.knowledge_ids + other.knowledge_ids
+        )
+        result.matrix[:, : len(self.knowledge_ids)] = self.matrix
+        result.matrix[:, result.intern(other.knowledge_ids)] |= other.matrix
+        return result
+
+    def clause_rows(self, knowledge_id: str) -> np.ndarray:
+        """ナレッジが割り当てられた条項の行番号（条項順）"""
+        col = self._col_of.get(knowledge_id)
+        if col is None:
+            return np.zeros(0, dtype=np.intp)
+        return np.flatnonzero(self.matrix[:, col])
+
+    def clauses_for(self, knowledge_id: str) -> List[str]:
+        """ナレッジが割り当てられた clause_number（条項順）"""
+        return [self.clause_numbers[i] for i in self.clause_rows(knowledge_id)]
+
+    def knowledge_lists(self) -> List[List[str]]:
+        """条項ごとに割り当てられた knowledge_id のリスト（列順）"""
+        # np.nonzero より flatnonzero + divmod の方が速い
+        rows, cols = np.divmod(np.flatnonzero(self.matrix), self.matrix.shape[1])
+        bounds = np.searchsorted(rows, np.arange(self.matrix.shape[0] + 1)).tolist()
+        names = np.asarray(self.knowledge_ids, dtype=object)[cols].tolist()
+        return [names[bounds[i] : bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+    def active_knowledge_ids(self) -> List[str]:
+        """1条項以上に割り当てられた knowledge_id（列順）"""
+        return [self.knowledge_ids[j] for j in np.flatnonzero(self.matrix.any(axis=0))]
+
+    def pair_count(self) -> int:
+        return int(self.matrix.sum())
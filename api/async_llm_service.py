@@ -1,124 +1,379 @@
 import asyncio
 import json
-from typing import Sequence, Any, Dict, List
-from azure_.openai_service import AzureOpenAIService
-
-# プロセス内で再利用する共有リソース
-_sem = asyncio.Semaphore(8)  # Azure のデプロイのTPS/TPMに合わせて調整
-_service = AzureOpenAIService()
+import os
+from typing import Sequence, Any, AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+from azure_.response_schemas import parse_structured_response
+from .json_stream import JsonArrayStreamParser
+from .llm_gateway import get_llm_gateway
+from .match_tiling import item_tokens
 
 
 async def ainvoke_with_limit(
-    messages: List[Dict[str, str]], max_retries: int = 2
+    messages: List[Dict[str, str]],
+    max_retries: int = 5,
+    model: Optional[str] = None,
+    stage: Optional[str] = None,
 ) -> str:
     """
-    セマフォとバックオフ付きの非同期LLM呼び出し
+    プロセス共有ゲートウェイ経由の非同期LLM呼び出し
+    （同時実行ウィンドウ・Retry-After に従う再試行はデプロイ単位でゲートウェイが管理する）
+    model 未指定時は stage（matching / review / summary ...）に割り当てられたモデルを使う。
     """
-    delay = 0.5
-    async with _sem:
-        for attempt in range(max_retries):
-            try:
-                return _service.get_openai_response_gpt41(messages)
-            except Exception as e:
-                msg = str(e).lower()
-                if attempt < max_retries - 1 and (
-                    "429" in msg or "timeout" in msg or "temporarily" in msg
-                ):
-                    await asyncio.sleep(delay)
-                    delay = min(delay * 2, 8)
-                else:
-                    raise
+    gateway = get_llm_gateway()
+    if model is None:
+        return await gateway.acomplete(stage, messages, max_retries=max_retries)
+    return await gateway.achat(messages, model=model, max_retries=max_retries)
 
 
-async def run_batch_reviews(reviews: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+async def astream_with_limit(
+    messages: List[Dict[str, str]],
+    max_retries: int = 5,
+    stage: Optional[str] = None,
+) -> AsyncIterator[str]:
     """
-    複数の条項審査を並列実行
-    reviews: [{"clauses": [...], "knowledge": [...]}]の形式
+    ainvoke_with_limit のストリーミング版。stage に割り当てられたモデルの応答テキストの断片を
+    受け取った順に yield する（ゲートウェイのループ外から呼ばれた場合は全文を1回で返す）。
     """
+    async for delta in get_llm_gateway().astream(
+        stage, messages, max_retries=max_retries
+    ):
+        yield delta
 
-    async def review_one(item: Dict[str, Any]) -> List[Dict[str, Any]]:
-        system_prompt = (
-            "あなたは契約審査の専門家です。以下の審査対象データと審査知見をもとに、各条項ごとに懸念点(concern)と修正条文(amendment_clause)を出力してください。\n"
-            "懸念点(concern)は、端的な箇条書きで提供してください。\n"
-            "修正した条文(amendment_clause)は、要変更箇所を明示し、端的に示してください。\n"
-            "審査の根拠とする knowledge_ids を必ず提示し、提供する審査知見以外を利用した審査は絶対にしないでください。\n"
-            '審査の結果懸念がない場合は、"concern" および "amendment_clause" を null で出力してください。\n'
-            "【出力形式】\n"
-            "必ず以下の厳格なJSON配列形式で出力してください。\n"
-            "[\n"
-            "  {\n"
-            '    "clause_number": <条項番号（文字列）>,\n'
-            '    "concern": <懸念点コメント> or null,\n'
-            '    "amendment_clause": <修正条文> or null,\n'
-            '    "knowledge_ids": [<ナレッジIDの配列>]\n'
-            "  }, ...\n"
-            "]\n"
-        )
 
-        prompt = (
-            "【審査対象データ】\n"
-            f"{json.dumps(item['clauses'], ensure_ascii=False)}\n"
-            "【審査知見（knowledge）】\n"
-            f"{json.dumps(item['knowledge'], ensure_ascii=False)}\n\n"
-            "審査は提供する審査知見以外を絶対に利用しないでください。"
-        )
+async def forget_cached_response(messages: List[Dict[str, str]], stage: str):
+    """
+    応答をパースできなかった場合に、その応答を応答キャッシュから消す
+    （キャッシュ済みの壊れた応答を返し続けず、次の呼び出しで取り直させる）
+    """
+    try:
+        await get_llm_gateway().aforget(stage, messages)
+    except Exception as e:
+        print(f"応答キャッシュの削除に失敗しました: {e}")
+
+
+REVIEW_SYSTEM_PROMPT = (
+    "あなたは契約審査の専門家です。以下の審査対象データと審査知見をもとに、各条項ごとに懸念点(concern)と修正条文(amendment_clause)を出力してください。\n"
+    "懸念点(concern)は、端的な箇条書きで提供してください。\n"
+    "修正した条文(amendment_clause)は、要変更箇所を明示し、端的に示してください。\n"
+    "審査の根拠とする knowledge_ids を必ず提示し、提供する審査知見以外を利用した審査は絶対にしないでください。\n"
+    '審査の結果懸念がない場合は、"concern" および "amendment_clause" を null で出力してください。\n'
+    "【出力形式】\n"
+    "必ず以下の厳格なJSON配列形式で出力してください。\n"
+    "[\n"
+    "  {\n"
+    '    "clause_number": <条項番号（文字列）>,\n'
+    '    "concern": <懸念点コメント> or null,\n'
+    '    "amendment_clause": <修正条文> or null,\n'
+    '    "knowledge_ids": [<ナレッジIDの配列>]\n'
+    "  }, ...\n"
+    "]\n"
+)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "あなたは契約審査の専門家です。以下の複数の指摘事項・修正条項案を統合し、重複や類似内容をまとめて簡潔にしてください。\n"
+    "【出力形式】\n"
+    '{"concern": <要約した懸念点>, "amendment_clause": <統合した修正条項案>}'
+)
+
+SUMMARY_BATCH_SYSTEM_PROMPT = (
+    "あなたは契約審査の専門家です。以下の条項ごとの複数の指摘事項・修正条項案を、条項ごとに統合し、重複や類似内容をまとめて簡潔にしてください。\n"
+    "条項をまたいで内容を混ぜないでください。要約対象のすべての条項について、1件ずつ出力してください。\n"
+    "【出力形式】\n"
+    "必ず以下の厳格なJSON配列形式で出力してください。\n"
+    "[\n"
+    '  {"clause_number": <条項番号（文字列）>, "concern": <要約した懸念点>, "amendment_clause": <統合した修正条項案>}, ...\n'
+    "]\n"
+)
+
+# =========================
+# 要約のバッチ化
+# =========================
+# 条項ごとの要約は1件あたりの入出力が小さく、呼び出しごとのオーバーヘッドと
+# 同時実行枠の消費が支配的になるため、複数条項の要約を1回の呼び出しにまとめる。
+# SUMMARY_BATCH_TOKENS      : 1回の呼び出しに載せる要約対象の推定トークン数の上限
+# SUMMARY_BATCH_MAX_CLAUSES : 1回の呼び出しに載せる条項数の上限（1 で条項ごとに要約する）
+DEFAULT_SUMMARY_BATCH_TOKENS = 3000
+DEFAULT_SUMMARY_BATCH_MAX_CLAUSES = 20
+
+
+def summary_batch_settings() -> Dict[str, int]:
+    """環境変数から要約のバッチ化の設定を読む"""
+    load_dotenv()
+    return {
+        "tokens": int(
+            os.getenv("SUMMARY_BATCH_TOKENS", str(DEFAULT_SUMMARY_BATCH_TOKENS))
+        ),
+        "max_clauses": int(
+            os.getenv(
+                "SUMMARY_BATCH_MAX_CLAUSES", str(DEFAULT_SUMMARY_BATCH_MAX_CLAUSES)
+            )
+        ),
+    }
+
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
+JSON_REPAIR_SYSTEM_PROMPT = "あなたはJSON整形の専門家です。"
 
+
+# 審査に失敗した条項の懸念点の接頭辞（審査結果キャッシュには保存しない）
+REVIEW_ERROR_PREFIXES = ("LLMエラー", "LLM応答パースエラー")
+
+
+def is_review_error(item: Dict[str, Any]) -> bool:
+    """review_clauses が失敗時に返した条項の結果か"""
+    return not item.get("knowledge_ids") and str(item.get("concern") or "").startswith(
+        REVIEW_ERROR_PREFIXES
+    )
+
+
+def _review_error_items(
+    clauses: List[Dict[str, Any]], concern: str
+) -> List[Dict[str, Any]]:
+    return [
+        {
+            "clause_number": clause["clause_number"],
+            "concern": concern,
+            "amendment_clause": "",
+            "knowledge_ids": [],
+        }
+        for clause in clauses
+    ]
+
+
+async def _parse_review_or_repair(
+    raw: str, clauses: List[Dict[str, Any]], messages: List[Dict[str, str]]
+) -> List[Dict[str, Any]]:
+    """
+    審査の応答全文をパースする。壊れていれば json_repair 段階で1回だけ修復を試み、
+    それでもパースできなければ各条項にパースエラーを懸念点として返す。
+    パースできなかった応答（審査・修復）は応答キャッシュから消す。
+    """
+    try:
+        return parse_structured_response(raw, "review")
+    except Exception as e:
+        error = e
+        await forget_cached_response(messages, "review")
+    fix_prompt = (
+        "以下のテキストはJSON配列として不正な形式です。絶対に他のテキストや説明を含めず、厳格なJSON配列のみを出力してください。\n"
+        "【期待するJSON配列の出力例】\n"
+        "[\n"
+        '  {"clause_number": "1", "concern": "懸念点例", "amendment_clause": "修正条文例", "knowledge_ids": ["id1", "id2"]},\n'
+        '  {"clause_number": "2", "concern": "", "amendment_clause": "", "knowledge_ids": []}\n'
+        "]\n"
+        "【不正なJSONテキスト】\n"
+        f"{raw}"
+    )
+    fix_messages = [
+        {"role": "system", "content": JSON_REPAIR_SYSTEM_PROMPT},
+        {"role": "user", "content": fix_prompt},
+    ]
+    try:
+        repaired = await ainvoke_with_limit(fix_messages, stage="json_repair")
+    except Exception:
+        repaired = None
+    if repaired is not None:
         try:
-            result = await ainvoke_with_limit(messages)
-            return json.loads(result)
+            return parse_structured_response(repaired, "review")
         except Exception as e:
-            return [
-                {
-                    "clause_number": clause["clause_number"],
-                    "concern": f"LLMエラー: {e}",
-                    "amendment_clause": "",
-                    "knowledge_ids": [],
-                }
-                for clause in item["clauses"]
-            ]
+            error = e
+            await forget_cached_response(fix_messages, "json_repair")
+    return _review_error_items(clauses, f"LLM応答パースエラー: {error}")
 
-    tasks = [review_one(item) for item in reviews]
-    return await asyncio.gather(*tasks)
 
+async def iter_review_clauses(
+    clauses: List[Dict[str, Any]],
+    knowledge: List[Dict[str, Any]],
+    scoped: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    条項の審査（1件以上のナレッジ）を非同期で実行し、応答をストリーミングで受け取って
+    条項ごとの審査結果を配列の要素が閉じた時点で1件ずつ yield する。
+    複数のナレッジは条項ごとに1件の結果に統合させ、根拠を knowledge_ids に挙げさせる。
+    scoped=True のとき、各ナレッジは applies_to_clause_numbers の条項にだけ適用させる。
+    配列を読み切れないか読めない要素があれば、全文をパース・修復して不足分を補う。
+    LLM呼び出しに失敗した場合は、まだ返していない条項にエラー内容を懸念点として返す。
+    """
+    prompt = (
+        "【審査対象データ】\n"
+        f"{json.dumps(clauses, ensure_ascii=False)}\n"
+        "【審査知見（knowledge）】\n"
+        f"{json.dumps(knowledge, ensure_ascii=False)}\n\n"
+        "審査は提供する審査知見以外を絶対に利用しないでください。"
+    )
+    if scoped:
+        prompt += "\n各審査知見は applies_to_clause_numbers に含まれる条項の審査にのみ利用してください。"
 
-async def run_batch_summaries(summaries: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    messages = [
+        {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+    parser = JsonArrayStreamParser()
+    emitted = set()
+    try:
+        async for delta in astream_with_limit(messages, stage="review"):
+            for item in parser.feed(delta):
+                emitted.add(item.get("clause_number"))
+                yield item
+    except Exception as e:
+        for item in _review_error_items(
+            [c for c in clauses if c["clause_number"] not in emitted],
+            f"LLMエラー: {e}",
+        ):
+            yield item
+        return
+    if parser.done and not parser.malformed:
+        return
+    for item in await _parse_review_or_repair(parser.text, clauses, messages):
+        if item.get("clause_number") not in emitted:
+            yield item
+
+
+async def review_clauses(
+    clauses: List[Dict[str, Any]],
+    knowledge: List[Dict[str, Any]],
+    scoped: bool = False,
+) -> List[Dict[str, Any]]:
+    """iter_review_clauses の結果をすべて受け取ってから、条項ごとの審査結果のリストで返す"""
+    return [item async for item in iter_review_clauses(clauses, knowledge, scoped)]
+
+
+async def summarize_clause(
+    clause_number: str, concerns: List[str], amendments: List[str]
+) -> Dict[str, str]:
+    """条項1件分の複数の指摘事項・修正文案を非同期で要約する"""
+    prompt = (
+        f"【条項番号】{clause_number}\n"
+        f"【指摘事項一覧】{json.dumps(concerns, ensure_ascii=False)}\n"
+        f"【修正文案一覧】{json.dumps(amendments, ensure_ascii=False)}\n"
+    )
+
+    messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+    try:
+        result = await ainvoke_with_limit(messages, stage="summary")
+    except Exception as e:
+        return {"concern": "要約エラー: " + str(e), "amendment_clause": ""}
+    try:
+        parsed = parse_structured_response(result, "summary")
+        return {
+            "concern": parsed.get("concern", ""),
+            "amendment_clause": parsed.get("amendment_clause", ""),
+        }
+    except Exception as e:
+        await forget_cached_response(messages, "summary")
+        return {"concern": "要約エラー: " + str(e), "amendment_clause": ""}
+
+
+def plan_summary_batches(
+    summaries: List[Dict[str, Any]], settings: Dict[str, int] = None
+) -> List[List[Dict[str, Any]]]:
     """
-    複数の要約処理を並列実行
-    summaries: [{"clause_number": "...", "concerns": [...], "amendments": [...]}]の形式
+    要約対象 [{"clause_number", "concerns", "amendments"}] を、推定トークン数・条項数の上限に
+    収まるよう先頭から順に詰めて呼び出し単位に分ける（上限を超える1件は単独の呼び出しにする）。
     """
+    settings = settings or summary_batch_settings()
+    max_clauses = max(settings["max_clauses"], 1)
+    batches: List[List[Dict[str, Any]]] = []
+    size = 0
+    for item in summaries:
+        tokens = item_tokens(item)
+        if (
+            not batches
+            or len(batches[-1]) >= max_clauses
+            or size + tokens > settings["tokens"]
+        ):
+            batches.append([])
+            size = 0
+        batches[-1].append(item)
+        size += tokens
+    return batches
 
-    async def summarize_one(item: Dict[str, Any]) -> Dict[str, str]:
-        system_prompt = (
-            "あなたは契約審査の専門家です。以下の複数の指摘事項・修正条項案を統合し、重複や類似内容をまとめて簡潔にしてください。\n"
-            "【出力形式】\n"
-            '{"concern": <要約した懸念点>, "amendment_clause": <統合した修正条項案>}'
-        )
 
-        prompt = (
-            f"【条項番号】{item['clause_number']}\n"
-            f"【指摘事項一覧】{json.dumps(item['concerns'], ensure_ascii=False)}\n"
-            f"【修正文案一覧】{json.dumps(item['amendments'], ensure_ascii=False)}\n"
+async def summarize_clause_batch(
+    summaries: List[Dict[str, Any]],
+) -> Dict[str, Dict[str, str]]:
+    """
+    複数条項の要約を1回の呼び出しで実行し、条項番号 -> {"concern", "amendment_clause"} を返す。
+    応答に含まれない（パースできない・重複した・依頼していない条項番号を含む）条項は、
+    summarize_clause で1件ずつ要約し直す。
+    """
+    if len(summaries) == 1:
+        item = summaries[0]
+        return {
+            str(item["clause_number"]): await summarize_clause(
+                item["clause_number"], item["concerns"], item["amendments"]
+            )
+        }
+    requested = {str(item["clause_number"]): item for item in summaries}
+    prompt = "【要約対象】\n" f"{json.dumps(summaries, ensure_ascii=False)}\n"
+    messages = [
+        {"role": "system", "content": SUMMARY_BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+    answered: Dict[str, Dict[str, str]] = {}
+    result = None
+    try:
+        result = await ainvoke_with_limit(messages, stage="summary_batch")
+        for entry in parse_structured_response(result, "summary_batch"):
+            num = str(entry.get("clause_number", ""))
+            if num in requested and num not in answered:
+                answered[num] = {
+                    "concern": entry.get("concern", ""),
+                    "amendment_clause": entry.get("amendment_clause", ""),
+                }
+    except Exception as e:
+        print(f"要約のバッチ呼び出しに失敗したため条項ごとに要約します: {e}")
+        if result is not None:
+            await forget_cached_response(messages, "summary_batch")
+
+    missing = [num for num in requested if num not in answered]
+    retried = await asyncio.gather(
+        *(
+            summarize_clause(
+                requested[num]["clause_number"],
+                requested[num]["concerns"],
+                requested[num]["amendments"],
+            )
+            for num in missing
         )
+    )
+    answered.update(zip(missing, retried))
+    return {num: answered[num] for num in requested}
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
 
-        try:
-            result = await ainvoke_with_limit(messages)
-            parsed = json.loads(result)
-            return {
-                "concern": parsed.get("concern", ""),
-                "amendment_clause": parsed.get("amendment_clause", ""),
-            }
-        except Exception as e:
-            return {"concern": "要約エラー: " + str(e), "amendment_clause": ""}
+async def summarize_clauses(
+    summaries: List[Dict[str, Any]],
+) -> Dict[str, Dict[str, str]]:
+    """
+    複数条項の要約を plan_summary_batches の単位に分けて並列に実行し、
+    条項番号 -> {"concern", "amendment_clause"} を返す（依頼したすべての条項を含む）。
+    """
+    results: Dict[str, Dict[str, str]] = {}
+    for answered in await asyncio.gather(
+        *(summarize_clause_batch(batch) for batch in plan_summary_batches(summaries))
+    ):
+        results.update(answered)
+    return results
+
 
-    tasks = [summarize_one(item) for item in summaries]
+async def run_batch_reviews(reviews: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    複数の条項審査を並列実行
+    reviews: [{"clauses": [...], "knowledge": [...]}]の形式
+    """
+    tasks = [review_clauses(item["clauses"], item["knowledge"]) for item in reviews]
     return await asyncio.gather(*tasks)
+
+
+async def run_batch_summaries(summaries: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    複数の要約処理を並列実行（複数条項の要約を1回の呼び出しにまとめる）
+    summaries: [{"clause_number": "...", "concerns": [...], "amendments": [...]}]の形式
+    """
+    results = await summarize_clauses(summaries)
+    return [results[str(item["clause_number"])] for item in summaries]
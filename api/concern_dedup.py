@@ -0,0 +1,121 @@
+import os
+import re
+import unicodedata
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+from dotenv import load_dotenv
+
+# =========================
+# 指摘事項・修正文案の重複統合（LLM を使わない）
+# =========================
+# 1つの条項に複数のナレッジの審査結果が集まると、ほぼ同じ内容の指摘
+# （表記・語尾・箇条書き記号だけが違うもの）が並び、そのたびに要約の LLM 呼び出しが発生する。
+# 指摘事項を行（箇条書きの1項目）に分け、正規化した文字 n-gram の Jaccard 係数で
+# ほぼ同じ行を同一とみなし、他の指摘事項の行ですべて言い尽くされている指摘事項を除く。
+# 残った指摘事項・修正文案が1件ずつなら要約を呼ばずにそのまま使う。
+# 1条項あたりの件数は少ないため、MinHash で近似せず Jaccard 係数を直接求める。
+# 修正文案は数値1つの違いでも意味が変わるため、既定では正規化後に一致する行だけを同一とみなす。
+# CONCERN_DEDUP_THRESHOLD           : 指摘事項の行を同一とみなす Jaccard 係数
+# CONCERN_DEDUP_AMENDMENT_THRESHOLD : 修正文案の行を同一とみなす Jaccard 係数
+# CONCERN_DEDUP_NGRAM               : 文字 n-gram の n
+# CONCERN_DEDUP_DISABLED            : 1 で統合しない（従来どおり、2件以上あれば要約する）
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_AMENDMENT_THRESHOLD = 1.0
+DEFAULT_NGRAM = 3
+
+# 行頭の箇条書き記号・番号
+_BULLET_RE = re.compile(r"^(?:[-‐－*•・●○◯■□]|\(?\d+[.)．）]|[①-⑳])\s*")
+# 比較に使わない空白・句読点・括弧
+_IGNORED_RE = re.compile(r"[\s、。，．,.!！?？:：;；「」『』（）()]")
+
+
+def dedup_settings() -> Dict[str, Any]:
+    """環境変数から重複統合の設定を読む"""
+    load_dotenv()
+    return {
+        "enabled": os.getenv("CONCERN_DEDUP_DISABLED", "").lower()
+        not in ("1", "true", "yes"),
+        "threshold": float(
+            os.getenv("CONCERN_DEDUP_THRESHOLD", str(DEFAULT_THRESHOLD))
+        ),
+        "amendment_threshold": float(
+            os.getenv(
+                "CONCERN_DEDUP_AMENDMENT_THRESHOLD", str(DEFAULT_AMENDMENT_THRESHOLD)
+            )
+        ),
+        "ngram": int(os.getenv("CONCERN_DEDUP_NGRAM", str(DEFAULT_NGRAM))),
+    }
+
+
+def normalize_point(line: str) -> str:
+    """比較用に1行を正規化する（NFKC、箇条書き記号・空白・句読点の除去）"""
+    line = unicodedata.normalize("NFKC", line).strip()
+    return _IGNORED_RE.sub("", _BULLET_RE.sub("", line))
+
+
+def _shingles(text: str, n: int) -> FrozenSet[str]:
+    if len(text) <= n:
+        return frozenset([text])
+    return frozenset(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+def _points(text: str, n: int) -> List[FrozenSet[str]]:
+    """テキストを行に分け、正規化した行ごとの文字 n-gram 集合を返す（空行は除く）"""
+    normalized = (normalize_point(line) for line in text.split("\n"))
+    return [_shingles(p, n) for p in normalized if p]
+
+
+def _same(a: FrozenSet[str], b: FrozenSet[str], threshold: float) -> bool:
+    if a == b:
+        return True
+    return len(a & b) / len(a | b) >= threshold
+
+
+def _covers(
+    kept: List[FrozenSet[str]], points: List[FrozenSet[str]], threshold: float
+) -> bool:
+    """points のすべての行が kept のいずれかの行と同一とみなせるか"""
+    return all(any(_same(p, k, threshold) for k in kept) for p in points)
+
+
+def merge_near_duplicates(
+    texts: List[str], threshold: float, ngram: int = DEFAULT_NGRAM
+) -> List[str]:
+    """
+    ほぼ同じ内容のテキストを統合し、残ったテキストを元の順に返す。
+    あるテキストのすべての行が、既に残したテキストの行と同一とみなせる場合は除き、
+    逆に既に残したテキストを言い尽くしている場合はそれと置き換える（行の多い方を残す）。
+    """
+    kept: List[Tuple[str, List[FrozenSet[str]]]] = []
+    for text in texts:
+        points = _points(text, ngram)
+        if not points:
+            continue
+        if any(_covers(k_points, points, threshold) for _, k_points in kept):
+            continue
+        covered = [
+            i
+            for i, (_, k_points) in enumerate(kept)
+            if _covers(points, k_points, threshold)
+        ]
+        if covered:
+            kept[covered[0]] = (text, points)
+            kept = [k for i, k in enumerate(kept) if i not in covered[1:]]
+        else:
+            kept.append((text, points))
+    return [text for text, _ in kept]
+
+
+def merge_review_duplicates(
+    concerns: List[str], amendments: List[str], settings: Dict[str, Any] = None
+) -> Tuple[List[str], List[str]]:
+    """条項1件分の指摘事項・修正文案から、ほぼ同じ内容のものを統合する"""
+    settings = settings or dedup_settings()
+    if not settings["enabled"]:
+        return concerns, amendments
+    return (
+        merge_near_duplicates(concerns, settings["threshold"], settings["ngram"]),
+        merge_near_duplicates(
+            amendments, settings["amendment_threshold"], settings["ngram"]
+        ),
+    )
@@ -18,11 +18,24 @@ class ContractAPI:
         Returns:
             list: 類似度の高い上位条項（id, clause, clause_vector, review_points, action_plan, SimilarityScore）
         """
+        return self.search_similar_clauses_batch([search_clause], top_k=top_k)[0]
+
+    def search_similar_clauses_batch(self, search_clauses: list, top_k: int = 5):
+        """
+        複数条項の類似条項検索。埋め込みは1回のバッチ呼び出し（キャッシュ経由）で取得する。
+
+        Args:
+            search_clauses (list): 検索対象の条項テキストのリスト
+            top_k (int): 各条項について取得する類似条項の数
+
+        Returns:
+            list: search_clauses と同じ順序の検索結果リスト
+        """
         db = self.cosmosdb_client.get_database_client("CONTRACT")
         container = db.get_container_client("clause_entry")
 
-        # 検索テキストをベクトル化
-        query_embedding = self.openai_service.get_emb_3_small(search_clause)
+        # 検索テキストをまとめてベクトル化
+        query_embeddings = self.openai_service.get_emb_3_small_batch(search_clauses)
 
         # コサイン類似度による検索クエリ
         query = f"""
@@ -36,20 +49,23 @@ class ContractAPI:
             WHERE c.clause_vector != null
             ORDER BY VectorDistance(c.clause_vector, @embedding)
         """
-        parameters = [
-            {"name": "@top_k", "value": top_k},
-            {"name": "@embedding", "value": query_embedding},
-        ]
-        try:
-            items = container.query_items(
-                query=query,
-                parameters=parameters,
-                enable_cross_partition_query=True,
-            )
-        except Exception as e:
-            print(f"Error occurred: {e}")
-
-        return list(items)
+        results = []
+        for query_embedding in query_embeddings:
+            parameters = [
+                {"name": "@top_k", "value": top_k},
+                {"name": "@embedding", "value": query_embedding},
+            ]
+            try:
+                items = container.query_items(
+                    query=query,
+                    parameters=parameters,
+                    enable_cross_partition_query=True,
+                )
+                results.append(list(items))
+            except Exception as e:
+                print(f"Error occurred: {e}")
+                results.append([])
+        return results
 
     def get_knowledge_entries(self, contract_type: str):
         """
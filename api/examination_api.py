@@ -17,8 +17,36 @@ def examination_api(
     Returns:
         analyzed_clauses (list): 審査結果リスト
     """
+    analyzed_clauses = []
+    for event in examination_api_stream(
+        contract_type, background_info, partys, title, clauses, knowledge_all
+    ):
+        if event["type"] == "done":
+            analyzed_clauses = event["analyzed_clauses"]
+    return analyzed_clauses
+
+
+def examination_api_stream(
+    contract_type: str,
+    background_info: str,
+    partys: list,
+    title: str,
+    clauses: list,
+    knowledge_all: list,
+):
+    """
+    examination_api のストリーミング版。審査結果を届いた順にイベントとして yield する。
+    Yields:
+        {"type": "review", "knowledge_ids": list, "item": dict}: 1回の審査（ナレッジのパック）分の条項ごとの審査結果（応答のストリーミング中に、要素が閉じた順）
+        {"type": "clause", "clause": dict}: 要約済みの条項ごとの最終結果（要約の完了順）
+        {"type": "done", "analyzed_clauses": list, "review_cache": dict}:
+            全条項の審査結果（examination_api の戻り値と同じ）と審査結果キャッシュのヒット率
+    """
     import os
     import json
+    from api.assignment_matrix import AssignmentMatrix
+    from api.examination_pipeline import iter_review_and_summary
+    from api.llm_gateway import get_llm_gateway
 
     data = {
         "contract_master_id": "",
@@ -41,196 +69,41 @@ def examination_api(
     )
     sample_path = os.path.abspath(sample_path)
 
-    analyzed_clauses = []
     similar_clauses_knowledge = []
 
-    # knowledge_idのユニーク一覧を抽出
-    all_knowledge_ids = set()
-    for c in data["clauses"]:
-        all_knowledge_ids.update(c.get("knowledge_id", []))
-    all_knowledge_ids = list(all_knowledge_ids)
+    # knowledge_idのユニーク一覧を抽出（条項 × ナレッジの割当行列で、初出順）
+    assignment = AssignmentMatrix.from_clauses(data["clauses"])
+    all_knowledge_ids = assignment.active_knowledge_ids()
     print("all_knowledge_ids:")
     print(all_knowledge_ids)
 
-    from collections import defaultdict
-
-    clause_results = defaultdict(list)  # 条項ごとに複数ナレッジの審査結果を格納
-
-    def call_llm_for_review(clauses, knowledge):
-        from azure_.openai_service import AzureOpenAIService
-        import json
-
-        print("Call: call_llm_for_review")
-        service = AzureOpenAIService()
-        system_prompt = (
-            "あなたは契約審査の専門家です。以下の審査対象データと審査知見をもとに、各条項ごとに懸念点(concern)と修正条文(amendment_clause)を出力してください。\n"
-            "懸念点(concern)は、端的な箇条書きで提供してください。\n"
-            "修正した条文(amendment_clause)は、要変更箇所を明示し、端的に示してください。\n"
-            "審査の根拠とする knowledge_ids を必ず提示し、提供する審査知見以外を利用した審査は絶対にしないでください。\n"
-            '審査の結果懸念がない場合は、"concern" および "amendment_clause" を null で出力してください。\n'
-            "【出力形式】\n"
-            "必ず以下の厳格なJSON配列形式で出力してください。\n"
-            "[\n"
-            "  {\n"
-            '    "clause_number": <条項番号（文字列）>,\n'
-            '    "concern": <懸念点コメント> or null,\n'
-            '    "amendment_clause": <修正条文> or null,\n'
-            '    "knowledge_ids": [<ナレッジIDの配列>]\n'
-            "  }, ...\n"
-            "]\n"
-        )
-        prompt = (
-            "【審査対象データ】\n"
-            f"{json.dumps(clauses, ensure_ascii=False)}\n"
-            "【審査知見（knowledge）】\n"
-            f"{json.dumps(knowledge, ensure_ascii=False)}\n\n"
-            "審査は提供する審査知見以外を絶対に利用しないでください。"
-        )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-        try:
-            answer = service.get_openai_response_gpt41(messages)
-            print("LLM応答:")
-        except Exception as e:
-            print(f"LLM呼び出しエラー: {e}")
-            return [
-                {
-                    "clause_number": clause["clause_number"],
-                    "concern": f"LLMエラー: {e}",
-                    "amendment_clause": "",
-                    "knowledge_ids": [],
-                }
-                for clause in clauses
-            ]
-
-        def try_parse_json_llm_response(resp, max_retry=2):
-            for retry in range(max_retry):
-                try:
-                    result = json.loads(resp)
-                    return result
-                except Exception as e:
-                    if retry < max_retry - 1:
-                        from azure_.openai_service import AzureOpenAIService
-
-                        service = AzureOpenAIService()
-                        fix_prompt = (
-                            "以下のテキストはJSON配列として不正な形式です。絶対に他のテキストや説明を含めず、厳格なJSON配列のみを出力してください。\n"
-                            "【期待するJSON配列の出力例】\n"
-                            "[\n"
-                            '  {"clause_number": "1", "concern": "懸念点例", "amendment_clause": "修正条文例", "knowledge_ids": ["id1", "id2"]},\n'
-                            '  {"clause_number": "2", "concern": "", "amendment_clause": "", "knowledge_ids": []}\n'
-                            "]\n"
-                            "【不正なJSONテキスト】\n"
-                            f"{resp}"
-                        )
-                        fix_messages = [
-                            {
-                                "role": "system",
-                                "content": "あなたはJSON整形の専門家です。",
-                            },
-                            {"role": "user", "content": fix_prompt},
-                        ]
-                        try:
-                            resp, _, _ = service.get_openai_response_gpt41mini(
-                                fix_messages, 2000
-                            )
-                        except Exception:
-                            break
-                    else:
-                        break
-            return [
-                {
-                    "clause_number": clause["clause_number"],
-                    "concern": f"LLM応答パースエラー: {e}",
-                    "amendment_clause": "",
-                    "knowledge_ids": [],
-                }
-                for clause in clauses
-            ]
-
-        result = try_parse_json_llm_response(answer, max_retry=2)
-        return result
-
-    # knowledge_idごとに該当条項を抽出し、knowledge_allから該当ナレッジを取得して審査
-    for kid in all_knowledge_ids:
-        # kidに関連する条項のみ抽出
-        target_clauses = [
-            c for c in data["clauses"] if kid in c.get("knowledge_id", [])
-        ]
-        # knowledge_allから該当ナレッジを抽出
-        target_knowledge = [k for k in knowledge_all if k.get("id") == kid]
-        if not target_clauses or not target_knowledge:
-            continue
-        review_result = call_llm_for_review(target_clauses, target_knowledge)
-        for item in review_result:
-            clause_results[item["clause_number"]].append(item)
+    async def assignments():
+        # knowledge_idごとに該当条項を抽出（割当は確定済みのため、すべて先に渡す）
+        for kid in all_knowledge_ids:
+            yield {
+                "type": "knowledge",
+                "knowledge_id": kid,
+                "clause_number": assignment.clauses_for(kid),
+                "rows": assignment.clause_rows(kid),
+            }
+        yield {"type": "done", "clauses_augmented": data["clauses"]}
 
-    # 条項ごとに複数ナレッジの指摘事項があれば要約
+    # ナレッジのパックごとの審査と条項ごとの要約をゲートウェイ上で並列に実行し、届いた順に返す
     summarized_clauses = []
-
-    def call_llm_for_summary(clause_number, concerns, amendments):
-        from azure_.openai_service import AzureOpenAIService
-        import json
-
-        print("Call: call_llm_for_summary")
-        service = AzureOpenAIService()
-        system_prompt = (
-            "あなたは契約審査の専門家です。以下の複数の指摘事項・修正条項案を統合し、重複や類似内容をまとめて簡潔にしてください。\n"
-            "【出力形式】\n"
-            '{"concern": <要約した懸念点>, "amendment_clause": <統合した修正条項案>}'
-        )
-        prompt = (
-            f"【条項番号】{clause_number}\n"
-            f"【指摘事項一覧】{json.dumps(concerns, ensure_ascii=False)}\n"
-            f"【修正文案一覧】{json.dumps(amendments, ensure_ascii=False)}\n"
-        )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-        try:
-            answer = service.get_openai_response_gpt41(messages)
-            result = json.loads(answer)
-            return result.get("concern", ""), result.get("amendment_clause", "")
-        except Exception as e:
-            return "要約エラー: " + str(e), ""
-
-    for clause in data["clauses"]:
-        num = clause["clause_number"]
-        results = clause_results.get(num, [])
-        if not results:
-            summarized_clauses.append(
-                {
-                    "clause_number": num,
-                    "concern": "",
-                    "amendment_clause": "",
-                    "knowledge_ids": [],
-                }
-            )
-            continue
-        concerns = [r["concern"] for r in results if r["concern"]]
-        amendments = [r["amendment_clause"] for r in results if r["amendment_clause"]]
-        knowledge_ids = []
-        for r in results:
-            knowledge_ids.extend(r.get("knowledge_ids", []))
-        # 複数指摘があれば要約
-        if len(concerns) > 1 or len(amendments) > 1:
-            concern_summary, amendment_summary = call_llm_for_summary(
-                num, concerns, amendments
-            )
-        else:
-            concern_summary = concerns[0] if concerns else ""
-            amendment_summary = amendments[0] if amendments else ""
-        summarized_clauses.append(
-            {
-                "clause_number": num,
-                "concern": concern_summary,
-                "amendment_clause": amendment_summary,
-                "knowledge_ids": list(set(knowledge_ids)),
-            }
+    review_cache = None
+    for event in get_llm_gateway().iterate(
+        iter_review_and_summary(
+            data["clauses"],
+            knowledge_all,
+            assignments(),
+            lambda i, kids: data["clauses"][i],
         )
+    ):
+        if event["type"] == "done":
+            summarized_clauses = event["analyzed_clauses"]
+            review_cache = event["review_cache"]
+        elif event["type"] != "matching":
+            yield event
 
     with open(sample_path, "w", encoding="utf-8") as f:
         f.write("Examination_data = ")
@@ -246,21 +119,38 @@ def examination_api(
         json.dump(summarized_clauses, f, ensure_ascii=False, indent=4)
         f.write("\n")
 
-    return summarized_clauses
+    yield {
+        "type": "done",
+        "analyzed_clauses": summarized_clauses,
+        "review_cache": review_cache,
+    }
 
 
 def search_similar_clauses(clauses, contract_api):
     similar_clauses_knowledge = []
-    for clause in clauses:
-        clause_text = clause["clause"]
-        clause_number = clause["clause_number"]
 
-        # 類似条項の検索とナレッジ抽出
-        try:
-            similar_clauses = contract_api.search_similar_clauses(clause_text, top_k=3)
-        except Exception as e:
-            print(f"Error occurred: {e}")
+    # 類似条項の検索とナレッジ抽出（埋め込みは全条項分を1回のバッチで取得）
+    try:
+        similar_clauses_list = contract_api.search_similar_clauses_batch(
+            [clause["clause"] for clause in clauses], top_k=3
+        )
+    except Exception as e:
+        # バッチが失敗した場合は条項ごとに検索し直し、失敗した条項だけを飛ばす
+        print(f"Error occurred: {e}")
+        similar_clauses_list = []
+        for clause in clauses:
+            try:
+                similar_clauses_list.append(
+                    contract_api.search_similar_clauses(clause["clause"], top_k=3)
+                )
+            except Exception as e:
+                print(f"Error occurred: {e}")
+                similar_clauses_list.append(None)
+
+    for clause, similar_clauses in zip(clauses, similar_clauses_list):
+        if similar_clauses is None:
             continue
+        clause_number = clause["clause_number"]
 
         # clause_numberと対応付けて、抽出した similar_clauses のclause_id, c.clause, c.review_points, c.action_plan,を格納する
         similar_clauses_knowledge.append(
@@ -277,3 +167,4 @@ def search_similar_clauses(clauses, contract_api):
                 ],
             }
         )
+    return similar_clauses_knowledge
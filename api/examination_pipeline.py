@@ -0,0 +1,500 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple
+
+from .assignment_matrix import AssignmentMatrix
+from .concern_dedup import dedup_settings, merge_review_duplicates
+from .async_llm_service import (
+    is_review_error,
+    iter_review_clauses,
+    summarize_clauses,
+    summary_batch_settings,
+)
+from .llm_gateway import get_llm_gateway
+from .match_cl_and_kn_async import iter_matching_async
+from .match_tiling import item_tokens
+from .review_cache import (
+    assemble_cached_results,
+    cached_reviews,
+    record_reviews,
+    review_cache_enabled,
+    review_key,
+    review_knowledge_version,
+    review_scope,
+    split_pack_results,
+)
+from .review_packing import is_full_pack, packing_settings, plan_review_packs
+from .trace_sink import get_trace_sink
+
+# =========================
+# 審査・要約の並列実行とマッチングとのパイプライン化
+# =========================
+# 従来は全タイルのマッチングが終わってから審査を始め、ナレッジごとの審査を1件ずつ直列に呼び、
+# 全ナレッジの審査が終わってから条項ごとの要約を1件ずつ直列に呼んでいた。
+# 割当が確定したナレッジから順に審査を投入し、条項の審査がすべてそろった時点で
+# その条項の要約を投入する。各呼び出しはゲートウェイの同時実行ウィンドウ
+# （デプロイ単位、LLM_MAX_CONCURRENCY）の範囲で並列に実行される。
+# 要約に渡す審査結果はナレッジの初出順（examination_api と同じ）に並べるため、
+# 完了順によらず結果は直列に実行した場合と同じになる。
+# ただし、ナレッジの審査結果のうち、そのナレッジを割り当てていない条項についての結果は
+# （その条項の要約を待たせないよう）要約に含めない。
+# 割当条項の重なるナレッジは1回の審査にまとめる（api/review_packing.py）。
+# 条項の結果は各パックで統合済みのため、要約は条項の結果が複数のパックにまたがる場合だけ必要になる。
+# ほぼ同じ内容の指摘事項・修正文案は LLM を使わずに統合し（api/concern_dedup.py）、
+# 異なる指摘が残った条項だけを要約する。
+# 要約は審査がすべて終わるか1回分（SUMMARY_BATCH_MAX_CLAUSES）の条項がたまった時点で、
+# トークン数の上限までまとめて呼び出す（api/async_llm_service.summarize_clauses）。
+# 審査結果キャッシュ（api/review_cache.py）にある (条項, ナレッジ) の組は審査を呼ばずに使う。
+
+
+def collect_review_results(
+    results: List[Dict[str, Any]],
+) -> Tuple[List[str], List[str], List[str]]:
+    """条項1件分の審査結果から、懸念点・修正文案・根拠の knowledge_id を集める"""
+    concerns = [r["concern"] for r in results if r["concern"]]
+    amendments = [r["amendment_clause"] for r in results if r["amendment_clause"]]
+    knowledge_ids = []
+    for r in results:
+        knowledge_ids.extend(r.get("knowledge_ids", []))
+    return concerns, amendments, knowledge_ids
+
+
+def needs_summary(concerns: List[str], amendments: List[str]) -> bool:
+    """複数の指摘事項・修正文案があれば LLM で要約する"""
+    return len(concerns) > 1 or len(amendments) > 1
+
+
+def clause_result(
+    clause_number: Any,
+    concern: str,
+    amendment_clause: str,
+    knowledge_ids: List[str],
+) -> Dict[str, Any]:
+    """要約済みの条項ごとの最終結果（examination_api の戻り値の要素）"""
+    return {
+        "clause_number": clause_number,
+        "concern": concern,
+        "amendment_clause": amendment_clause,
+        "knowledge_ids": list(set(knowledge_ids)),
+    }
+
+
+async def iter_review_and_summary(
+    clauses: List[Dict[str, Any]],
+    knowledge_all: List[Dict[str, Any]],
+    assignments: AsyncIterator[Dict[str, Any]],
+    review_payload: Callable[[int, List[str]], Dict[str, Any]],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    ナレッジの割当が届くたびに審査を投入し、条項の審査がそろったら要約する。
+    割当は届いた分を plan_review_packs でパックに分け、パックごとに1回審査する。
+    マッチングの途中では埋まったパック（is_full_pack）だけを審査し、残りの割当は
+    次に届いた割当と合わせてパックに分け直す（マッチングの完了で残りをすべて審査する）。
+    Args:
+        clauses: 審査する条項（clause_number を含む）
+        assignments: 割当のイベント
+            {"type": "knowledge", "knowledge_id", "clause_number": [...], "rows"(任意): [...]}
+            を確定したナレッジから順に、最後に
+            {"type": "done", "clauses_augmented": 割当済みの条項, ...} を流す
+        review_payload: (条項の行番号, その条項を審査するパック内の knowledge_id)
+            -> 審査対象データに載せる条項
+    Yields:
+        {"type": "review", "knowledge_ids": list, "item": dict}:
+            パック1件分の条項ごとの審査結果（応答のストリーミング中に、要素が閉じた順）
+        {"type": "matching", ...}: 割当の完了（assignments の done イベントの内容）
+        {"type": "clause", "clause": dict}: 要約済みの条項ごとの最終結果（完了順）
+        {"type": "done", "analyzed_clauses": list, "review_cache": dict}:
+            全条項の審査結果（条項順）と審査結果キャッシュの参照件数・ヒット数・ヒット率
+    """
+    clause_numbers = [str(c.get("clause_number", "")) for c in clauses]
+    # 同じ clause_number が複数ある場合は後ろの条項を審査対象にする（_apply_step2 と同じ）
+    row_of = {num: i for i, num in enumerate(clause_numbers)}
+    knowledge_by_id = defaultdict(list)
+    for k in knowledge_all:
+        knowledge_by_id[k.get("id")].append(k)
+
+    inbox: asyncio.Queue = asyncio.Queue()
+    tasks = set()
+
+    def spawn(kind: str, key: Any, coro):
+        async def run():
+            try:
+                await inbox.put((kind, key, await coro))
+            except Exception as e:
+                await inbox.put(("error", key, e))
+
+        tasks.add(asyncio.create_task(run()))
+
+    def spawn_review(pid: int, stream: AsyncIterator[Dict[str, Any]]):
+        """審査結果を条項ごとに届いた順に流し、最後にパック全体の結果を流す"""
+
+        async def run():
+            try:
+                items = []
+                async for item in stream:
+                    items.append(item)
+                    await inbox.put(("review_item", pid, item))
+                await inbox.put(("review", pid, items))
+            except Exception as e:
+                await inbox.put(("error", pid, e))
+
+        tasks.add(asyncio.create_task(run()))
+
+    async def read_assignments():
+        async for event in assignments:
+            await inbox.put(("assignment", None, event))
+
+    waiting: List[Tuple[str, List[int]]] = (
+        []
+    )  # 審査結果キャッシュを未参照の (knowledge_id, 条項の行番号)
+    unpacked: List[Tuple[str, List[int]]] = (
+        []
+    )  # キャッシュ参照済みでパック未割当の (knowledge_id, 条項の行番号)
+    pack_settings = packing_settings()
+    packs: List[Dict[str, Any]] = []
+    reviews: Dict[int, List[Dict[str, Any]]] = {}  # パック番号 -> 審査結果
+    numbers_of: Dict[int, set] = {}  # パック番号 -> 条項番号
+    pending_reviews = defaultdict(int)  # 条項番号ごとの未完了の審査数
+    knowledge_rank: Dict[str, int] = {}
+    assigned = False
+    results: Dict[str, Dict[str, Any]] = {}  # 条項番号 -> 最終結果
+    summarizing = set()
+    summary_waiting: List[Tuple[str, Any, List[str], List[str], List[str]]] = []
+    summary_batch_limit = summary_batch_settings()["max_clauses"]
+    dedup = dedup_settings()
+    use_cache = review_cache_enabled()
+    scope = review_scope() if use_cache else ""
+    versions: Dict[str, str] = (
+        {}
+    )  # knowledge_id -> 審査結果キャッシュのナレッジのバージョン
+    cache_stats = {"lookups": 0, "hits": 0}
+
+    def register_pack(pack: Dict[str, Any]) -> int:
+        pid = len(packs)
+        packs.append(pack)
+        numbers_of[pid] = {clause_numbers[i] for i in pack["rows"]}
+        for num in numbers_of[pid]:
+            pending_reviews[num] += 1
+        return pid
+
+    def version_of(kid: str) -> str:
+        if kid not in versions:
+            versions[kid] = review_knowledge_version(knowledge_by_id[kid])
+        return versions[kid]
+
+    def cache_key(i: int, kid: str):
+        return review_key(clauses[i].get("clause", ""), kid, version_of(kid))
+
+    async def start_reviews(final: bool):
+        """
+        待っている割当のうち審査結果キャッシュにある組はキャッシュの結果を使い、
+        残りをパックに分けて審査を投入する。final=False（マッチングの途中）では
+        埋まったパックだけを投入し、残りは unpacked に戻して次の割当と合わせて分け直す
+        """
+        remaining = list(waiting)
+        waiting.clear()
+        if use_cache:
+            keys = {
+                (i, kid): cache_key(i, kid) for kid, rows in remaining for i in rows
+            }
+            found = await asyncio.to_thread(
+                cached_reviews, scope, list(set(keys.values()))
+            )
+            cache_stats["lookups"] += len(keys)
+            hits_by_row = defaultdict(dict)
+            for (i, kid), key in keys.items():
+                if key in found:
+                    hits_by_row[i][kid] = found[key]
+            served = set()
+            cached_rows = defaultdict(list)  # ナレッジの組 -> [(行番号, 結果)]
+            for i, hits in hits_by_row.items():
+                for owners, result in assemble_cached_results(hits).items():
+                    cached_rows[owners].append((i, result))
+                    served.update((i, kid) for kid in owners)
+            cache_stats["hits"] += len(served)
+            for owners, entries in cached_rows.items():
+                entries.sort(key=lambda entry: entry[0])
+                rows = [i for i, _ in entries]
+                pid = register_pack(
+                    {
+                        "knowledge_ids": list(owners),
+                        "rows": rows,
+                        "rows_of": {kid: rows for kid in owners},
+                        "scoped": False,
+                        "cached": True,
+                    }
+                )
+                items = [
+                    {
+                        "clause_number": clause_numbers[i],
+                        "concern": concern,
+                        "amendment_clause": amendment,
+                        "knowledge_ids": list(owners) if concern or amendment else [],
+                    }
+                    for i, (concern, amendment, _) in entries
+                ]
+                for item in items:
+                    inbox.put_nowait(("review_item", pid, item))
+                inbox.put_nowait(("review", pid, items))
+            remaining = [
+                (kid, [i for i in rows if (i, kid) not in served])
+                for kid, rows in remaining
+            ]
+            remaining = [(kid, rows) for kid, rows in remaining if rows]
+        unpacked.extend(remaining)
+        planned = plan_review_packs(
+            unpacked,
+            lambda i: item_tokens(review_payload(i, [])),
+            lambda kid: sum(item_tokens(k) for k in knowledge_by_id[kid]),
+            pack_settings,
+        )
+        if not final:
+            planned = [pack for pack in planned if is_full_pack(pack, pack_settings)]
+        started = {kid for pack in planned for kid in pack["knowledge_ids"]}
+        unpacked[:] = [(kid, rows) for kid, rows in unpacked if kid not in started]
+        for pack in planned:
+            pid = register_pack(pack)
+            payload = [
+                review_payload(
+                    i,
+                    [kid for kid in pack["knowledge_ids"] if i in pack["rows_of"][kid]],
+                )
+                for i in pack["rows"]
+            ]
+            knowledge = []
+            for kid in pack["knowledge_ids"]:
+                applies = [clause_numbers[i] for i in pack["rows_of"][kid]]
+                for k in knowledge_by_id[kid]:
+                    if pack["scoped"]:
+                        k = {**k, "applies_to_clause_numbers": applies}
+                    knowledge.append(k)
+            spawn_review(
+                pid, iter_review_clauses(payload, knowledge, scoped=pack["scoped"])
+            )
+
+    def record_pack(pack: Dict[str, Any], items: List[Dict[str, Any]]):
+        """パックの審査結果をナレッジごとに分けて審査結果キャッシュに書く"""
+        knowledge_of = {
+            clause_numbers[i]: [
+                kid for kid in pack["knowledge_ids"] if i in pack["rows_of"][kid]
+            ]
+            for i in pack["rows"]
+        }
+        split = split_pack_results(
+            [item for item in items if not is_review_error(item)], knowledge_of
+        )
+        results = {
+            cache_key(row_of[num], kid): result for (num, kid), result in split.items()
+        }
+        if results:
+            spawn(
+                "review_recorded",
+                None,
+                asyncio.to_thread(record_reviews, scope, results),
+            )
+
+    def start_summaries():
+        """待っている条項の要約をまとめて投入する（summarize_clauses が呼び出し単位に分ける）"""
+        keys = [
+            (num, original, knowledge_ids)
+            for num, original, knowledge_ids, _, _ in summary_waiting
+        ]
+        spawn(
+            "summary",
+            keys,
+            summarize_clauses(
+                [
+                    {
+                        "clause_number": num,
+                        "concerns": concerns,
+                        "amendments": amendments,
+                    }
+                    for num, _, _, concerns, amendments in summary_waiting
+                ]
+            ),
+        )
+        summary_waiting.clear()
+
+    def start_summary(num: str):
+        """条項の審査がそろったら、ナレッジの初出順にパックの審査結果を並べて要約する"""
+        summarizing.add(num)
+        pids = sorted(
+            (pid for pid, nums in numbers_of.items() if num in nums),
+            key=lambda pid: min(
+                knowledge_rank[kid] for kid in packs[pid]["knowledge_ids"]
+            ),
+        )
+        items = [
+            r
+            for pid in pids
+            for r in reviews[pid]
+            if str(r.get("clause_number")) == num
+        ]
+        concerns, amendments, knowledge_ids = collect_review_results(items)
+        concerns, amendments = merge_review_duplicates(concerns, amendments, dedup)
+        original = clauses[row_of[num]].get("clause_number", "")
+        if needs_summary(concerns, amendments):
+            summary_waiting.append((num, original, knowledge_ids, concerns, amendments))
+            return None
+        return clause_result(
+            original,
+            concerns[0] if concerns else "",
+            amendments[0] if amendments else "",
+            knowledge_ids,
+        )
+
+    spawn("assignments_read", None, read_assignments())
+    try:
+        while not assigned or len(results) < len(row_of):
+            kind, key, value = await inbox.get()
+            finished = []
+            if kind == "error":
+                raise value
+            elif kind == "assignment" and value["type"] == "knowledge":
+                kid = value["knowledge_id"]
+                rows = value.get("rows")
+                if rows is None:
+                    rows = sorted(
+                        {row_of[n] for n in value["clause_number"] if n in row_of}
+                    )
+                if len(rows) and knowledge_by_id.get(kid):
+                    waiting.append((kid, [int(i) for i in rows]))
+            elif kind == "assignment" and value["type"] == "done":
+                if waiting or unpacked:
+                    await start_reviews(final=True)
+                yield {**value, "type": "matching"}
+                assignment = AssignmentMatrix.from_clauses(value["clauses_augmented"])
+                knowledge_rank = {
+                    kid: i for i, kid in enumerate(assignment.active_knowledge_ids())
+                }
+                assigned = True
+                finished = [num for num in row_of if not pending_reviews[num]]
+            elif kind == "review_item":
+                # 審査結果は応答の配列の要素が閉じた時点で1件ずつ流す
+                yield {
+                    "type": "review",
+                    "knowledge_ids": packs[key]["knowledge_ids"],
+                    "item": value,
+                }
+            elif kind == "review":
+                reviews[key] = value
+                if use_cache and not packs[key].get("cached"):
+                    record_pack(packs[key], value)
+                for num in numbers_of[key]:
+                    pending_reviews[num] -= 1
+                    if assigned and not pending_reviews[num]:
+                        finished.append(num)
+            elif kind == "summary":
+                for num, original, knowledge_ids in key:
+                    results[num] = clause_result(
+                        original,
+                        value[num].get("concern", ""),
+                        value[num].get("amendment_clause", ""),
+                        knowledge_ids,
+                    )
+                    yield {"type": "clause", "clause": results[num]}
+            # 同じタイミングで確定した割当（マッチングの1タイル分）をまとめてからパックに分ける
+            if waiting and inbox.empty():
+                await start_reviews(final=assigned)
+            for num in finished:
+                if num in summarizing:
+                    continue
+                result = start_summary(num)
+                if result is not None:
+                    results[num] = result
+                    yield {"type": "clause", "clause": result}
+            # ほぼ同じ内容の指摘事項・修正文案は LLM を使わずに統合し（api/concern_dedup.py）、
+            # 異なる指摘が残った条項だけを要約する。
+            # 要約は審査がすべて終わるか1回分の条項数がたまるまで待って、まとめて呼び出す
+            reviewing = (
+                not assigned or waiting or unpacked or any(pending_reviews.values())
+            )
+            if (
+                summary_waiting
+                and inbox.empty()
+                and (not reviewing or len(summary_waiting) >= summary_batch_limit)
+            ):
+                start_summaries()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    lookups = cache_stats["lookups"]
+    yield {
+        "type": "done",
+        "analyzed_clauses": [
+            {**results[num], "clause_number": c.get("clause_number", "")}
+            for num, c in zip(clause_numbers, clauses)
+        ],
+        "review_cache": {
+            **cache_stats,
+            "hit_rate": round(cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+        },
+    }
+
+
+async def iter_examination_pipeline(
+    contract_type: str,
+    background_info: str,
+    partys: list,
+    title: str,
+    clauses: list,
+    knowledge_all: list,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    マッチングと審査・要約を重ねて実行し、結果を届いた順にイベントとして yield する
+    （イベントは iter_review_and_summary と同じ。"matching" はマッチングの完了で、
+    response / clauses_augmented / trace を含む）。
+    マッチングで割当が確定した時点では他のナレッジの割当が決まっていないため、
+    審査対象データの knowledge_id には審査するパック内のナレッジだけを載せる。
+    """
+
+    def review_payload(i: int, kids: List[str]) -> Dict[str, Any]:
+        return {
+            "clause_id": clauses[i].get("clause_id", ""),
+            "clause_number": str(clauses[i].get("clause_number", "")),
+            "clause": clauses[i].get("clause", ""),
+            "knowledge_id": kids,
+        }
+
+    done = {}
+    async for event in iter_review_and_summary(
+        clauses,
+        knowledge_all,
+        iter_matching_async(knowledge_all, clauses),
+        review_payload,
+    ):
+        if event["type"] == "done":
+            done = event
+        yield event
+
+    get_trace_sink().emit(
+        "examination",
+        lambda: {
+            "contract_type": contract_type,
+            "background_info": background_info,
+            "partys": partys,
+            "title": title,
+            "analyzed_clauses": done.get("analyzed_clauses", []),
+            "review_cache": done.get("review_cache"),
+        },
+    )
+
+
+def examination_pipeline_stream(
+    contract_type: str,
+    background_info: str,
+    partys: list,
+    title: str,
+    clauses: list,
+    knowledge_all: list,
+) -> Iterator[Dict[str, Any]]:
+    """
+    iter_examination_pipeline をプロセス共有ゲートウェイのループ上で実行し、
+    イベントを呼び出し元スレッド（Streamlit のセッション）で順に yield する同期版。
+    """
+    yield from get_llm_gateway().iterate(
+        iter_examination_pipeline(
+            contract_type, background_info, partys, title, clauses, knowledge_all
+        )
+    )
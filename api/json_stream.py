@@ -0,0 +1,72 @@
+import json
+from typing import Any, List, Optional
+
+
+class JsonArrayStreamParser:
+    """
+    ストリーミング応答の断片を受け取り、最初に現れるJSON配列の要素（オブジェクト/配列）を
+    閉じた時点で1件ずつ取り出すインクリメンタルパーサ。
+    構造化出力の {"items": [...]} でも、素の [...] でも同じように扱える。
+    配列直下のスカラー値（文字列・数値）は対象外。
+    閉じた要素がJSONとして読めない場合（不正なエスケープ等）は例外にせず、その要素を飛ばして
+    malformed を立てる（呼び出し側は done でも malformed なら全文のパース・修復に回す）。
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None  # 対象配列の内側の深さ
+        self._element_start: Optional[int] = None
+        self.done = False  # 対象配列が閉じたか
+        self.malformed = False  # 読めずに飛ばした要素があるか
+
+    def feed(self, chunk: str) -> List[Any]:
+        """断片を追加し、新たに完成した要素のリストを返す"""
+        self._buf += chunk
+        completed = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                if self._array_depth is None and ch == "[":
+                    self._array_depth = self._depth + 1
+                elif self._depth == self._array_depth:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if (
+                        self._depth == self._array_depth
+                        and self._element_start is not None
+                    ):
+                        try:
+                            completed.append(
+                                json.loads(buf[self._element_start : i + 1])
+                            )
+                        except ValueError:
+                            self.malformed = True
+                        self._element_start = None
+                    elif self._depth < self._array_depth:
+                        self.done = True
+            i += 1
+        self._pos = i
+        return completed
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取った全文"""
+        return self._buf
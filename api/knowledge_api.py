@@ -7,6 +7,8 @@ from datetime import datetime, timedelta, timezone
 
 from datetime import datetime, timedelta, timezone
 from api.contract_api import ContractAPI
+from api.match_cache import invalidate_knowledge
+from api.review_cache import invalidate_knowledge_reviews
 
 
 JST = timezone(timedelta(hours=9))
@@ -108,11 +110,15 @@ class KnowledgeAPI:
             knowledge_data["created_at"] = now_jst.isoformat()
         knowledge_data["updated_at"] = now_jst.isoformat()
 
-        return self.cosmosdb.upsert_to_container(
+        result = self.cosmosdb.upsert_to_container(
             container_name="knowledge_entry",
             data=knowledge_data,
             database_name="CONTRACT",
         )
+        # 更新されたナレッジのマッチング判定・審査結果のキャッシュを破棄する
+        invalidate_knowledge(knowledge_data["id"])
+        invalidate_knowledge_reviews(knowledge_data["id"])
+        return result
 
     def delete_knowledge(self, knowledge_data: Dict) -> Dict:
         """
@@ -121,13 +127,16 @@ class KnowledgeAPI:
         if "id" not in knowledge_data:
             raise ValueError("ID is required to delete knowledge.")
 
-        return self.cosmosdb.delete_data_from_container_by_column(
+        result = self.cosmosdb.delete_data_from_container_by_column(
             container_name="knowledge_entry",
             column_name="knowledge_number",
             column_value=knowledge_data["knowledge_number"],
             partition_key_column_name="knowledge_number",
             database_name="CONTRACT",
         )
+        invalidate_knowledge(knowledge_data["id"])
+        invalidate_knowledge_reviews(knowledge_data["id"])
+        return result
 
     # def save_knowledge_draft(self, knowledge_data: Dict) -> Dict:
     #     """
@@ -0,0 +1,130 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+import numpy as np
+
+# =========================
+# 埋め込みによるナレッジ候補の事前絞り込み
+# =========================
+# マッチングの各チャンクに knowledge_all 全件を載せる代わりに、
+# 条項とナレッジ（target_clause）のコサイン類似度が高い候補だけを送る。
+# どのチャンクの候補にも入らなかったナレッジは、契約中に対象条項がないものとして審査対象から外す。
+# MATCH_PREFILTER_TOP_K     : 条項ごとに候補にするナレッジ数（類似度上位）
+# MATCH_PREFILTER_MIN_SCORE : この類似度以上のナレッジは上位件数を超えても必ず送る（再現率の下限）
+# MATCH_PREFILTER_DISABLED  : 1 で絞り込みを行わない
+DEFAULT_TOP_K = 10
+DEFAULT_MIN_SCORE = 0.45
+
+
+def prefilter_settings() -> Dict[str, Any]:
+    """環境変数から絞り込みの設定を読む"""
+    load_dotenv()
+    return {
+        "enabled": os.getenv("MATCH_PREFILTER_DISABLED", "").lower()
+        not in ("1", "true", "yes"),
+        "top_k": int(os.getenv("MATCH_PREFILTER_TOP_K", str(DEFAULT_TOP_K))),
+        "min_score": float(
+            os.getenv("MATCH_PREFILTER_MIN_SCORE", str(DEFAULT_MIN_SCORE))
+        ),
+    }
+
+
+def _normalize(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similarity_matrix(
+    clauses: List[Dict[str, Any]], knowledge: List[Dict[str, Any]], service=None
+) -> np.ndarray:
+    """
+    条項 × ナレッジのコサイン類似度行列（行: clauses、列: knowledge）。
+    条文と target_clause は重複を除いて1回のバッチで埋め込む（埋め込みキャッシュ経由）。
+    service を省略した場合はプロセス共有のゲートウェイ経由で埋め込み、チャットと同じく
+    デプロイ単位の同時実行ウィンドウ・RPM/TPM予算に従わせる（ゲートウェイのループ外から呼ぶ）。
+    """
+    clause_texts = [c.get("clause", "") or " " for c in clauses]
+    knowledge_texts = [k.get("target_clause", "") or " " for k in knowledge]
+    unique = list(dict.fromkeys(clause_texts + knowledge_texts))
+    if service is None:
+        from .llm_gateway import get_llm_gateway
+
+        vectors = _normalize(get_llm_gateway().embed(unique))
+    else:
+        vectors = _normalize(service.get_emb_3_small_batch(unique))
+    row_of = {text: i for i, text in enumerate(unique)}
+    clause_vecs = vectors[[row_of[t] for t in clause_texts]]
+    knowledge_vecs = vectors[[row_of[t] for t in knowledge_texts]]
+    return clause_vecs @ knowledge_vecs.T
+
+
+def select_candidates(
+    scores: np.ndarray,
+    chunk_rows: List[List[int]],
+    top_k: int = DEFAULT_TOP_K,
+    min_score: float = DEFAULT_MIN_SCORE,
+) -> List[List[int]]:
+    """
+    チャンクごとに送るナレッジの列番号を返す（元の knowledge の順序を保つ）。
+    チャンク内の各条項について
+      - 類似度上位 top_k 件（同点を含む）
+      - 類似度が min_score 以上のもの
+    を集めた和集合を、そのチャンクの候補にする。
+    """
+    threshold = np.full(scores.shape[0], min_score, dtype=scores.dtype)
+    k = min(top_k, scores.shape[1])
+    if k > 0:
+        # k 番目の類似度と同点のものも含める（target_clause が同じナレッジを取りこぼさない）
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        threshold = np.minimum(threshold, kth)
+    clause_mask = scores >= threshold[:, None]
+    return [
+        np.flatnonzero(clause_mask[rows].any(axis=0)).tolist() if rows else []
+        for rows in chunk_rows
+    ]
+
+
+def prefilter_knowledge(
+    knowledge: List[Dict[str, Any]],
+    clause_chunks: List[List[Dict[str, Any]]],
+    service=None,
+) -> Tuple[List[List[Dict[str, Any]]], Dict[str, Any]]:
+    """
+    チャンクごとの候補ナレッジのリストと、トレース用の統計を返す。
+    どのチャンクにも送られなかったナレッジ（契約中に類似する条項がない）の id は
+    stats["pruned_ids"] に入る。呼び出し側はこれらを「該当条項なし」として扱う。
+    絞り込みが無効、ナレッジが top_k 件以下、または埋め込みに失敗した場合は全件を返す。
+    """
+    settings = prefilter_settings()
+    full = [list(knowledge) for _ in clause_chunks]
+    stats = {
+        "enabled": False,
+        "knowledge": len(knowledge),
+        "pruned_ids": [],
+        **settings,
+    }
+    if not settings["enabled"] or len(knowledge) <= settings["top_k"]:
+        return full, stats
+
+    clauses = [c for chunk in clause_chunks for c in chunk]
+    chunk_rows, start = [], 0
+    for chunk in clause_chunks:
+        chunk_rows.append(list(range(start, start + len(chunk))))
+        start += len(chunk)
+    try:
+        scores = similarity_matrix(clauses, knowledge, service)
+    except Exception as e:
+        print(f"ナレッジ絞り込みの埋め込みに失敗したため全件を送ります: {e}")
+        return full, stats
+
+    columns = select_candidates(
+        scores, chunk_rows, settings["top_k"], settings["min_score"]
+    )
+    stats["enabled"] = True
+    stats["candidates_per_chunk"] = [len(cols) for cols in columns]
+    sent = set(i for cols in columns for i in cols)
+    stats["pruned_ids"] = [k["id"] for i, k in enumerate(knowledge) if i not in sent]
+    return [[knowledge[i] for i in cols] for cols in columns], stats
@@ -0,0 +1,215 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+import streamlit as st
+
+# =========================
+# 字句マッチ（SudachiPy の分かち書き + BM25）
+# =========================
+# 条文を文書、ナレッジの target_clause をクエリとして BM25 のスコアを求め、
+# クエリの語の IDF の合計で割った 0〜1 の正規化スコアで該当／非該当を決める。
+# LLM を呼ばずに数ミリ秒で判定できるため、単独のマッチングモード（lexical）としても、
+# 確信度の低い組だけを LLM に送るゲート（hybrid）としても使う。
+# SudachiPy（sudachidict_core）がなければ文字バイグラムで分かち書きする。
+# MATCH_MODE              : llm（既定）| lexical | hybrid
+# MATCH_LEXICAL_THRESHOLD : lexical モードで該当とする正規化スコア
+# MATCH_LEXICAL_ACCEPT    : hybrid モードで LLM に送らず該当とする正規化スコア
+# MATCH_LEXICAL_REJECT    : hybrid モードで LLM に送らず非該当とする正規化スコア（未満）
+MATCH_MODES = ("llm", "lexical", "hybrid")
+DEFAULT_THRESHOLD = 0.35
+DEFAULT_ACCEPT = 0.5
+DEFAULT_REJECT = 0.1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CONTENT_POS = ("名詞", "動詞", "形容詞")
+# target_clause の定型表現（「〜を定める条項」）や形式的な語は手がかりにならないため除く
+_STOPWORDS = {
+    "条項",
+    "規定",
+    "定める",
+    "関する",
+    "条",
+    "場合",
+    "事",
+    "物",
+    "為る",
+    "有る",
+    "居る",
+    "成る",
+}
+
+
+def match_mode() -> str:
+    """環境変数 MATCH_MODE からマッチングモードを読む"""
+    load_dotenv()
+    mode = (os.getenv("MATCH_MODE") or "llm").lower()
+    if mode not in MATCH_MODES:
+        raise ValueError(f"未定義のマッチングモードです: {mode}")
+    return mode
+
+
+def lexical_settings() -> Dict[str, float]:
+    """環境変数から字句マッチのしきい値を読む"""
+    load_dotenv()
+    return {
+        "threshold": float(
+            os.getenv("MATCH_LEXICAL_THRESHOLD", str(DEFAULT_THRESHOLD))
+        ),
+        "accept": float(os.getenv("MATCH_LEXICAL_ACCEPT", str(DEFAULT_ACCEPT))),
+        "reject": float(os.getenv("MATCH_LEXICAL_REJECT", str(DEFAULT_REJECT))),
+    }
+
+
+@st.cache_resource
+def _sudachi_dictionary():
+    """SudachiPy の辞書（利用できなければ None）"""
+    try:
+        from sudachipy import Dictionary
+
+        return Dictionary()
+    except Exception as e:
+        print(f"SudachiPy を利用できないため文字バイグラムで分かち書きします: {e}")
+        return None
+
+
+_local = threading.local()
+
+
+def _sudachi_tokenizer():
+    """スレッドごとの SudachiPy トークナイザ（辞書はプロセスで共有）"""
+    dictionary = _sudachi_dictionary()
+    if dictionary is None:
+        return None
+    tokenizer = getattr(_local, "tokenizer", None)
+    if tokenizer is None:
+        from sudachipy import SplitMode
+
+        # 0.6.8 以降は tokenizer()、それ以前は create()
+        create = getattr(dictionary, "tokenizer", None) or dictionary.create
+        tokenizer = create(mode=SplitMode.B)
+        _local.tokenizer = tokenizer
+    return tokenizer
+
+
+@lru_cache(maxsize=50000)
+def tokenize(text: str) -> Tuple[str, ...]:
+    """
+    内容語（名詞・動詞・形容詞の正規化形、数詞と定型語を除く）に分かち書きする。
+    SudachiPy がなければ空白を除いた文字バイグラムを返す。
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    tokenizer = _sudachi_tokenizer()
+    if tokenizer is None:
+        compact = re.sub(r"\s+", "", text)
+        return tuple(compact[i : i + 2] for i in range(len(compact) - 1))
+    tokens = []
+    for m in tokenizer.tokenize(text):
+        pos = m.part_of_speech()
+        if pos[0] not in _CONTENT_POS or pos[1] == "数詞":
+            continue
+        word = m.normalized_form()
+        if word not in _STOPWORDS:
+            tokens.append(word)
+    return tuple(tokens)
+
+
+def lexical_scores(
+    clauses: List[Dict[str, Any]], knowledge: List[Dict[str, Any]]
+) -> np.ndarray:
+    """
+    条項 × ナレッジの正規化 BM25 スコア（0〜1、行: clauses、列: knowledge）。
+    IDF は条項側の文書頻度で求め、クエリの語の IDF の合計（平均長の条文に各語が1回ずつ
+    現れたときの BM25）で割る。条項に現れない語も IDF 最大として分母に含める。
+    """
+    scores = np.zeros((len(clauses), len(knowledge)), dtype=np.float32)
+    if not clauses or not knowledge:
+        return scores
+    clause_texts = [c.get("clause", "") for c in clauses]
+    query_texts = [k.get("target_clause", "") for k in knowledge]
+    vectorizer = CountVectorizer(analyzer=tokenize)
+    try:
+        vectorizer.fit(clause_texts + query_texts)
+    except ValueError:
+        # 内容語が1つもない
+        return scores
+    tf = vectorizer.transform(clause_texts).astype(np.float32).tocsr()
+    queries = (vectorizer.transform(query_texts) > 0).astype(np.float32).tocsr()
+
+    n_docs = tf.shape[0]
+    df = np.asarray((tf > 0).sum(axis=0)).ravel()
+    idf = np.log((n_docs - df + 0.5) / (df + 0.5) + 1.0).astype(np.float32)
+    doc_len = np.asarray(tf.sum(axis=1)).ravel()
+    avg_len = doc_len.mean() or 1.0
+    rows = np.repeat(np.arange(n_docs), np.diff(tf.indptr))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[rows] / avg_len)
+    weights = tf.copy()
+    weights.data = idf[tf.indices] * tf.data * (BM25_K1 + 1) / (tf.data + norm)
+
+    raw = (weights @ queries.T).toarray()
+    ideal = queries @ idf
+    ideal[ideal == 0] = 1.0
+    return np.minimum(raw / ideal[None, :], 1.0).astype(np.float32)
+
+
+def lexical_decisions(
+    clause_chunks: List[List[Dict[str, Any]]],
+    knowledge_per_chunk: List[List[Dict[str, Any]]],
+    decided: Dict[Tuple[str, str], bool],
+    mode: str,
+) -> Tuple[Dict[Tuple[str, str], bool], Dict[str, Any]]:
+    """
+    候補の (条項, ナレッジ) の組のうち、判定済み（decided）でないものを字句マッチで判定する。
+    lexical モードではしきい値ですべての組を判定し、hybrid モードでは
+    reject 以上 accept 未満の確信度の低い組を判定せずに残す（LLM に送る）。
+    Returns:
+      decisions: {(clause_number, knowledge_id): 該当するか}
+      stats    : トレース用の件数と所要時間
+    """
+    start = time.perf_counter()
+    settings = lexical_settings()
+    if mode == "lexical":
+        accept = reject = settings["threshold"]
+    else:
+        accept, reject = settings["accept"], settings["reject"]
+
+    clauses = [c for chunk in clause_chunks for c in chunk]
+    knowledge = list({k["id"]: k for kn in knowledge_per_chunk for k in kn}.values())
+    scores = lexical_scores(clauses, knowledge)
+    col_of = {k["id"]: j for j, k in enumerate(knowledge)}
+
+    decisions: Dict[Tuple[str, str], bool] = {}
+    uncertain = 0
+    row = 0
+    for chunk, kn in zip(clause_chunks, knowledge_per_chunk):
+        for c in chunk:
+            for k in kn:
+                pair = (c["clause_number"], k["id"])
+                if pair in decided:
+                    continue
+                score = scores[row, col_of[k["id"]]]
+                if score >= accept:
+                    decisions[pair] = True
+                elif score < reject:
+                    decisions[pair] = False
+                else:
+                    uncertain += 1
+            row += 1
+    accepted = sum(decisions.values())
+    return decisions, {
+        "mode": mode,
+        "accept": accept,
+        "reject": reject,
+        "accepted": accepted,
+        "rejected": len(decisions) - accepted,
+        "uncertain": uncertain,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
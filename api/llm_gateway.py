@@ -0,0 +1,366 @@
+import asyncio
+import concurrent.futures
+import os
+import queue
+import threading
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+import streamlit as st
+
+from azure_.model_registry import get_model_spec, resolve_stage_model
+from azure_.model_registry import MODEL_REGISTRY
+from azure_.openai_service import (
+    EMBEDDING_MODEL,
+    AsyncAzureOpenAIService,
+    plan_embedding_batches,
+)
+from azure_.response_schemas import response_format_for_stage
+from .adaptive_concurrency import (
+    AIMDController,
+    backoff_seconds,
+    is_throttle_error,
+    is_transient_error,
+    retry_after_seconds,
+)
+from .rate_limiter import (
+    FALLBACK_LIMITS,
+    DeploymentRateLimiter,
+    load_deployment_limits,
+)
+from .tokens import estimate_message_tokens
+
+
+class _DeploymentBudget:
+    """デプロイごとの同時実行ウィンドウ・RPM/TPMの予算（ゲートウェイのループ上でのみ使用）"""
+
+    def __init__(self, controller: AIMDController, limiter: DeploymentRateLimiter):
+        self.controller = controller
+        self.limiter = limiter
+
+
+class LLMGateway:
+    """
+    プロセス全体で共有するLLM呼び出しゲートウェイ。
+    専用スレッドで1つのイベントループを常駐させ、どのStreamlitセッション（スレッド）からの
+    リクエストも Future 経由で受け付ける。同時実行数はAzureのデプロイ単位で全体に適用される。
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_window: int = 32):
+        self.max_concurrency = max_concurrency
+        self.max_window = max(max_window, max_concurrency)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name="llm-gateway", daemon=True
+        )
+        self._service: Optional[AsyncAzureOpenAIService] = None
+        self._budgets: Dict[str, _DeploymentBudget] = {}
+        self._limits = load_deployment_limits()
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def in_gateway_loop(self) -> bool:
+        """現在のスレッドがゲートウェイのループ上かどうか"""
+        return threading.current_thread() is self._thread
+
+    # -------------------------
+    # Future ベースの受付API
+    # -------------------------
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """コルーチンをゲートウェイのループに投入し、concurrent.futures.Future を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """コルーチンをゲートウェイで実行し、完了まで呼び出し元スレッドで待つ"""
+        if self.in_gateway_loop():
+            raise RuntimeError("ゲートウェイのループ内から run() は呼び出せません")
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen: AsyncIterator[Any]) -> Iterator[Any]:
+        """
+        非同期イテレータをゲートウェイで実行し、要素を呼び出し元スレッドで順に yield する。
+        呼び出し側が途中で読むのをやめた場合は残りの処理を取り消す。
+        """
+        if self.in_gateway_loop():
+            raise RuntimeError("ゲートウェイのループ内から iterate() は呼び出せません")
+        items: queue.Queue = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(("item", item))
+            except Exception as e:
+                items.put(("error", e))
+            finally:
+                items.put(("end", None))
+
+        future = self.submit(pump())
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "end":
+                    break
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    def submit_chat(
+        self, messages: List[Dict[str, str]], model: str = "gpt-4.1"
+    ) -> concurrent.futures.Future:
+        """チャット補完を1件投入する"""
+        return self.submit(self._invoke(messages, model))
+
+    async def achat(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gpt-4.1",
+        max_retries: int = 5,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """任意のイベントループから await できるチャット補完"""
+        coro = self._invoke(messages, model, max_retries, response_format)
+        if self.in_gateway_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def acomplete(
+        self, stage: str, messages: List[Dict[str, str]], max_retries: int = 5
+    ) -> str:
+        """パイプライン段階に割り当てられたモデル・応答スキーマでのチャット補完"""
+        return await self.achat(
+            messages,
+            resolve_stage_model(stage),
+            max_retries,
+            response_format_for_stage(stage),
+        )
+
+    async def astream(
+        self, stage: str, messages: List[Dict[str, str]], max_retries: int = 5
+    ) -> AsyncIterator[str]:
+        """
+        acomplete のストリーミング版。応答テキストの断片を受け取った順に yield する。
+        同時実行ウィンドウ・RPM/TPM予算は最後の断片を受け取るまで保持し、
+        再試行は最初の断片を受け取る前の 429/503 等に限る（途中で切れた場合は例外）。
+        キャッシュヒット時、およびゲートウェイのループ外から呼ばれた場合は全文を1回で返す。
+        """
+        model = resolve_stage_model(stage)
+        response_format = response_format_for_stage(stage)
+        if not self.in_gateway_loop():
+            yield await self.achat(messages, model, max_retries, response_format)
+            return
+        service = self._get_service()
+        cached = await asyncio.to_thread(
+            service.get_cached_response, model, messages, response_format
+        )
+        if cached is not None:
+            yield cached
+            return
+        prompt_tokens = estimate_message_tokens(messages)
+        budget = self._get_budget(model)
+        controller = budget.controller
+        for attempt in range(max_retries + 1):
+            started_at = await controller.acquire()
+            received = False
+            try:
+                await budget.limiter.acquire(prompt_tokens)
+                async for delta in service.create_chat_stream(
+                    model, messages, response_format
+                ):
+                    received = True
+                    yield delta
+            except Exception as e:
+                if received or not is_transient_error(e) or attempt == max_retries:
+                    raise
+                wait = self._on_retryable_error(controller, started_at, attempt, e)
+            else:
+                controller.on_success()
+                return
+            finally:
+                await controller.release()
+            await asyncio.sleep(wait)
+
+    async def aembed(self, texts: List[str], max_retries: int = 5) -> List[List[float]]:
+        """
+        任意のイベントループから await できる埋め込み（埋め込みキャッシュ経由）。
+        キャッシュにないテキストは、チャットと同じく埋め込みデプロイの同時実行ウィンドウと
+        RPM/TPM予算のもとでバッチごとに送る。
+        """
+        coro = self._embed(texts, max_retries)
+        if self.in_gateway_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """aembed を呼び出し元スレッドで待つ（ゲートウェイのループ外から呼ぶ）"""
+        return self.run(self._embed(texts))
+
+    async def aforget(self, stage: str, messages: List[Dict[str, str]]):
+        """
+        下流でパースできなかった段階の応答を応答キャッシュから消す
+        （任意のイベントループから await できる）
+        """
+        coro = self._forget(
+            resolve_stage_model(stage), messages, response_format_for_stage(stage)
+        )
+        if self.in_gateway_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    # -------------------------
+    # ループ内部
+    # -------------------------
+    def _get_service(self) -> AsyncAzureOpenAIService:
+        if self._service is None:
+            self._service = AsyncAzureOpenAIService()
+        return self._service
+
+    def _get_budget(self, model: str) -> _DeploymentBudget:
+        # 埋め込みモデルはチャットのモデル定義にないため、モデル名をそのままデプロイ名にする
+        deployment = (
+            get_model_spec(model)["deployment"] if model in MODEL_REGISTRY else model
+        )
+        budget = self._budgets.get(deployment)
+        if budget is None:
+            limits = self._limits.get(
+                deployment, self._limits.get(model, FALLBACK_LIMITS)
+            )
+            budget = _DeploymentBudget(
+                AIMDController(
+                    initial_window=self.max_concurrency, max_window=self.max_window
+                ),
+                DeploymentRateLimiter(**limits),
+            )
+            self._budgets[deployment] = budget
+        return budget
+
+    async def _invoke(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_retries: int = 5,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        デプロイ単位の適応的な同時実行ウィンドウとRPM/TPM予算のもとでLLMを呼び出す
+        （ゲートウェイのループ上で実行）。応答キャッシュにあれば即座に返す。429/503 ではウィンドウを縮め、
+        Retry-After / x-ratelimit-reset-* で指定された時間だけ待ってから再試行する。
+        """
+        service = self._get_service()
+        # キャッシュヒットは同時実行ウィンドウ・レート予算を消費せずに返す
+        # （SQLite の読み書きは別スレッドで行い、ゲートウェイのループ上の他の呼び出しを止めない）
+        cached = await asyncio.to_thread(
+            service.get_cached_response, model, messages, response_format
+        )
+        if cached is not None:
+            return cached
+        return await self._call_with_budget(
+            model,
+            estimate_message_tokens(messages),
+            lambda: service.create_chat(model, messages, response_format),
+            max_retries,
+        )
+
+    async def _embed(self, texts: List[str], max_retries: int = 5) -> List[List[float]]:
+        """埋め込み（ゲートウェイのループ上で実行）。キャッシュにないバッチだけ予算のもとで送る"""
+        service = self._get_service()
+
+        async def embed_batch(inputs: List[str]) -> List[List[float]]:
+            # plan_embedding_batches と同じく1文字≒1トークンで見積もる
+            tokens = sum(max(1, len(t)) for t in inputs)
+            return await self._call_with_budget(
+                EMBEDDING_MODEL,
+                tokens,
+                lambda: service.create_embeddings(inputs),
+                max_retries,
+            )
+
+        return await service.get_emb_3_small_batch(texts, embed_batch=embed_batch)
+
+    async def _call_with_budget(
+        self,
+        model: str,
+        prompt_tokens: int,
+        call: Callable[[], Awaitable[Any]],
+        max_retries: int = 5,
+    ) -> Any:
+        """
+        デプロイ単位の同時実行ウィンドウとRPM/TPM予算のもとで call() を実行し、
+        429/503 等ではウィンドウを縮めて再試行する
+        """
+        budget = self._get_budget(model)
+        controller = budget.controller
+        for attempt in range(max_retries + 1):
+            started_at = await controller.acquire()
+            try:
+                await budget.limiter.acquire(prompt_tokens)
+                result = await call()
+            except Exception as e:
+                if not is_transient_error(e) or attempt == max_retries:
+                    raise
+                wait = self._on_retryable_error(controller, started_at, attempt, e)
+            else:
+                controller.on_success()
+                return result
+            finally:
+                await controller.release()
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _on_retryable_error(
+        controller: AIMDController, started_at: float, attempt: int, e: Exception
+    ) -> float:
+        """429/503 ではウィンドウを縮め、再試行までの待ち時間を返す"""
+        wait = retry_after_seconds(e)
+        if wait is None:
+            wait = backoff_seconds(attempt)
+        if is_throttle_error(e):
+            controller.on_throttle(started_at, wait)
+        else:
+            controller.on_transient_error()
+        return wait
+
+    async def _forget(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, Any]] = None,
+    ):
+        await asyncio.to_thread(
+            self._get_service().forget_cached_response,
+            model,
+            messages,
+            response_format,
+        )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """デプロイごとの同時実行ウィンドウ・スロットリング回数・レート予算（監視用）"""
+        return {
+            name: {**b.controller.stats(), **b.limiter.stats()}
+            for name, b in list(self._budgets.items())
+        }
+
+
+@st.cache_resource
+def get_llm_gateway() -> LLMGateway:
+    """プロセス共有のLLMゲートウェイを返す"""
+    return LLMGateway(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        max_window=int(os.getenv("LLM_MAX_CONCURRENCY_CEILING", "32")),
+    )
@@ -0,0 +1,345 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+import streamlit as st
+
+# =========================
+# マッチング判定の永続キャッシュ
+# =========================
+# 条項を1か所修正して再審査すると、従来は全タイルをLLMに送り直していた。
+# (正規化した条文のハッシュ, knowledge_id, ナレッジのバージョン) ごとに「該当する／しない」を保存し、
+# 判定済みでない組だけを差分のタイルとして送る（api/match_tiling.pack_undecided）。
+# ナレッジのバージョンは version に target_clause のハッシュを加えたもの（画面からの保存では
+# version が更新されないため）。KnowledgeAPI.save_knowledge / delete_knowledge でも該当ナレッジを消す。
+# MATCH_CACHE_PATH        : SQLite ファイルのパス
+# MATCH_CACHE_MAX_ENTRIES : 保存する組の上限（超えた分は最終アクセスが古い順に削除。
+#                           件数の確認は書き込みごとには行わない）
+# MATCH_CACHE_DISABLED    : 1 でキャッシュを使わない（LLM_CACHE_DISABLED=1 でも無効）
+
+Pair = Tuple[str, str, str]  # (clause_hash, knowledge_id, knowledge_version)
+
+
+def normalize_clause_text(text: str) -> str:
+    """
+    条文を正規化する（NFKC、空白の除去）。
+    本文が同じ定型条項を区別するため、先頭の「第N条（見出し）」は残す。
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", "", text)
+
+
+def clause_hash(text: str) -> str:
+    return hashlib.sha256(normalize_clause_text(text).encode("utf-8")).hexdigest()
+
+
+def knowledge_version(knowledge: Dict[str, Any]) -> str:
+    """ナレッジのバージョン（version と target_clause のハッシュ）"""
+    target = hashlib.sha256(
+        (knowledge.get("target_clause") or "").encode("utf-8")
+    ).hexdigest()
+    return f"{knowledge.get('version', '')}:{target[:16]}"
+
+
+def matching_scope(system_prompt: str) -> str:
+    """マッチングのモデルとプロンプトが変わったら別のキャッシュとして扱うためのキー"""
+    from azure_.model_registry import resolve_stage_model
+
+    payload = f"{resolve_stage_model('matching')}\x00{system_prompt}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class MatchDecisionCache:
+    """
+    (条文ハッシュ, knowledge_id, ナレッジのバージョン) -> 該当するか の永続キャッシュ（SQLite）。
+    複数スレッドから共有するため内部でロックする。
+    上限の確認（全件の集計）は書き込みごとには行わず、evict_interval 組を書くごとか、
+    見積もりの件数が上限を超えた時点で行い、上限の evict_ratio まで減らす。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1000000,
+        evict_interval: int = 5000,
+        evict_ratio: float = 0.9,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_interval = max(evict_interval, 1)
+        self.evict_ratio = evict_ratio
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS match_cache (
+                scope TEXT NOT NULL,
+                clause_hash TEXT NOT NULL,
+                knowledge_id TEXT NOT NULL,
+                knowledge_version TEXT NOT NULL,
+                matched INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (scope, clause_hash, knowledge_id, knowledge_version)
+            )
+            """)
+        # 判定の履歴から分類器（api/match_classifier.py）を学習するため条文も保存する
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS clause_text (
+                clause_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_cache_knowledge ON match_cache(knowledge_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_cache_last_access ON match_cache(last_access)"
+        )
+        self._conn.commit()
+        # 書き込みごとに COUNT しないよう、件数は見積もりで追う（置き換えも1件と数えるので多めになる）
+        self._writes_since_evict = 0
+        (self._approx_entries,) = self._conn.execute(
+            "SELECT COUNT(*) FROM match_cache"
+        ).fetchone()
+
+    def get_many(self, scope: str, pairs: List[Pair]) -> Dict[Pair, bool]:
+        """判定済みの組だけ {pair: matched} で返す"""
+        wanted = set(pairs)
+        found: Dict[Pair, bool] = {}
+        hashes = list(dict.fromkeys(p[0] for p in wanted))
+        now = time.time()
+        with self._lock:
+            # SQLite のプレースホルダ上限を避けて分割
+            for i in range(0, len(hashes), 500):
+                part = hashes[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT clause_hash, knowledge_id, knowledge_version, matched "
+                    f"FROM match_cache WHERE scope = ? AND clause_hash IN ({','.join('?' * len(part))})",
+                    [scope] + part,
+                ).fetchall()
+                for h, kid, version, matched in rows:
+                    if (h, kid, version) in wanted:
+                        found[(h, kid, version)] = bool(matched)
+            if found:
+                self._conn.executemany(
+                    "UPDATE match_cache SET last_access = ? WHERE scope = ? AND clause_hash = ? "
+                    "AND knowledge_id = ? AND knowledge_version = ?",
+                    [(now, scope, *p) for p in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(
+        self,
+        scope: str,
+        decisions: Dict[Pair, bool],
+        texts: Dict[str, str] = None,
+    ):
+        """判定を保存する。texts（条文ハッシュ -> 条文）があれば学習用に条文も保存する"""
+        if not decisions:
+            return
+        now = time.time()
+        with self._lock:
+            if texts:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO clause_text VALUES (?, ?)", texts.items()
+                )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO match_cache VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (scope, h, kid, version, int(matched), now)
+                    for (h, kid, version), matched in decisions.items()
+                ],
+            )
+            self._writes_since_evict += len(decisions)
+            self._approx_entries += len(decisions)
+            if (
+                self._writes_since_evict >= self.evict_interval
+                or self._approx_entries > self.max_entries
+            ):
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        件数が上限を超えていれば上限の evict_ratio まで最終アクセスの古い順に削除し、
+        参照されなくなった条文も消す（ロック内で呼ぶ）
+        """
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM match_cache").fetchone()
+        self._writes_since_evict = 0
+        self._approx_entries = count
+        if count <= self.max_entries:
+            return
+        # 上限ちょうどで止めると次の書き込みでまた集計することになるため、少し余裕を空ける
+        removed = count - int(self.max_entries * self.evict_ratio)
+        self._conn.execute(
+            "DELETE FROM match_cache WHERE rowid IN ("
+            "SELECT rowid FROM match_cache ORDER BY last_access ASC LIMIT ?)",
+            (removed,),
+        )
+        self._conn.execute(
+            "DELETE FROM clause_text WHERE clause_hash NOT IN "
+            "(SELECT clause_hash FROM match_cache)"
+        )
+        self._approx_entries = count - removed
+
+    def invalidate_knowledge(self, knowledge_id: str):
+        """ナレッジの更新・削除時に、そのナレッジの判定をすべて消す"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM match_cache WHERE knowledge_id = ?", (knowledge_id,)
+            )
+            self._conn.commit()
+
+    def history(self, scope: str) -> List[Tuple[str, str, str, bool]]:
+        """学習用の判定履歴 [(条文, knowledge_id, ナレッジのバージョン, 該当するか)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.text, m.knowledge_id, m.knowledge_version, m.matched "
+                "FROM match_cache m JOIN clause_text t ON m.clause_hash = t.clause_hash "
+                "WHERE m.scope = ?",
+                (scope,),
+            ).fetchall()
+        return [
+            (text, kid, version, bool(matched)) for text, kid, version, matched in rows
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM match_cache")
+            self._conn.execute("DELETE FROM clause_text")
+            self._conn.commit()
+            self._writes_since_evict = 0
+            self._approx_entries = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM match_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": count,
+        }
+
+
+def match_cache_enabled() -> bool:
+    from azure_.llm_cache import llm_cache_enabled
+
+    load_dotenv()
+    return llm_cache_enabled() and os.getenv(
+        "MATCH_CACHE_DISABLED", ""
+    ).lower() not in ("1", "true", "yes")
+
+
+@st.cache_resource
+def get_match_cache() -> MatchDecisionCache:
+    """プロセス共有のマッチング判定キャッシュを返す"""
+    load_dotenv()
+    return MatchDecisionCache(
+        path=os.getenv(
+            "MATCH_CACHE_PATH", os.path.join(".cache", "match_cache.sqlite3")
+        ),
+        max_entries=int(os.getenv("MATCH_CACHE_MAX_ENTRIES", "1000000")),
+    )
+
+
+def invalidate_knowledge(knowledge_id: str):
+    """ナレッジ保存・削除時のフック（キャッシュが使えない場合は何もしない）"""
+    try:
+        get_match_cache().invalidate_knowledge(knowledge_id)
+    except Exception as e:
+        print(f"マッチング判定キャッシュの無効化に失敗しました: {e}")
+
+
+def cached_decisions(
+    clause_chunks: List[List[Dict[str, Any]]],
+    knowledge_per_chunk: List[List[Dict[str, Any]]],
+    versions: Dict[str, str],
+    scope: str,
+) -> Tuple[Dict[Tuple[str, str], bool], Dict[str, Any]]:
+    """
+    候補の (条項, ナレッジ) の組のうちキャッシュで判定済みのものを
+    {(clause_number, knowledge_id): 該当するか} で返す（トレース用の件数も返す）。
+    キャッシュが無効な場合や参照に失敗した場合は空。
+    """
+    pairs_total = sum(
+        len(chunk) * len(kn) for chunk, kn in zip(clause_chunks, knowledge_per_chunk)
+    )
+    stats = {"enabled": False, "pairs": pairs_total, "cached": 0, "matched": 0}
+    if not match_cache_enabled():
+        return {}, stats
+    keys = {
+        (c["clause_number"], k["id"]): (
+            clause_hash(c["clause"]),
+            k["id"],
+            versions.get(k["id"], ""),
+        )
+        for chunk, kn in zip(clause_chunks, knowledge_per_chunk)
+        for c in chunk
+        for k in kn
+    }
+    try:
+        found = get_match_cache().get_many(scope, list(keys.values()))
+    except Exception as e:
+        print(f"マッチング判定キャッシュを参照できないため全件を送ります: {e}")
+        return {}, stats
+    decided = {pair: found[key] for pair, key in keys.items() if key in found}
+    stats.update(
+        {
+            "enabled": True,
+            "cached": len(decided),
+            "matched": sum(decided.values()),
+        }
+    )
+    return decided, stats
+
+
+def record_tile(
+    tile: Dict[str, Any],
+    parsed: List[Dict[str, Any]],
+    versions: Dict[str, str],
+    scope: str,
+    decided: Dict[Tuple[str, str], bool] = None,
+):
+    """
+    タイル1件の判定をキャッシュに書く。応答に含まれなかったナレッジは判定不明として書かない。
+    タイルに相乗りした判定済みの組（decided）は書かない。
+    """
+    decided = decided or {}
+    if not match_cache_enabled():
+        return
+    returned = {
+        item["knowledge_id"]: {str(n) for n in item.get("clause_number", [])}
+        for item in parsed
+        if isinstance(item, dict) and "knowledge_id" in item
+    }
+    decisions: Dict[Pair, bool] = {}
+    texts: Dict[str, str] = {}
+    for c in tile["clauses"]:
+        h = clause_hash(c["clause"])
+        texts[h] = c["clause"]
+        for k in tile["knowledge"]:
+            if k["id"] in returned and (c["clause_number"], k["id"]) not in decided:
+                key = (h, k["id"], versions.get(k["id"], ""))
+                # 同じ条文が複数ある場合はいずれかで該当すれば該当とする
+                decisions[key] = decisions.get(key, False) or (
+                    c["clause_number"] in returned[k["id"]]
+                )
+    try:
+        get_match_cache().put_many(scope, decisions, texts)
+    except Exception as e:
+        print(f"マッチング判定キャッシュへの書き込みに失敗しました: {e}")
@@ -1,8 +1,30 @@
 import json
-import re
-from typing import List, Dict, Any, Tuple
+from collections import Counter, defaultdict
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from azure_.response_schemas import parse_structured_response
 import asyncio
-from .async_llm_service import ainvoke_with_limit
+from .assignment_matrix import AssignmentMatrix
+from .async_llm_service import ainvoke_with_limit, forget_cached_response
+from .knowledge_prefilter import prefilter_knowledge
+from .lexical_matcher import lexical_decisions, match_mode
+from .match_classifier import classifier_decisions
+from .match_cache import (
+    cached_decisions,
+    knowledge_version,
+    matching_scope,
+    record_tile,
+)
+from .match_fallback import fallback_clause_numbers, fallback_top_k, fan_out
+from .match_tiling import (
+    balanced_partition,
+    describe_tiles,
+    effective_budgets,
+    merge_tile_mappings,
+    pack_undecided,
+    plan_tiles,
+)
+from .tokens import estimate_message_tokens
+from .trace_sink import dedupe_message_contents, get_trace_sink
 
 # =========================
 # プロンプト部品
@@ -38,18 +60,6 @@ clauses（契約条項の本文）:
 # =========================
 # ユーティリティ
 # =========================
-def _force_json(s: str) -> Any:
-    """応答から最初のJSON配列を強制抽出→ロード。失敗時は例外"""
-    try:
-        return json.loads(s)
-    except Exception:
-        # フェンスや前後説明を誤って付けた場合の救済
-        m = re.search(r"(\[.*\])", s, flags=re.DOTALL)
-        if not m:
-            raise
-        return json.loads(m.group(1))
-
-
 def _dedup(seq):
     """リスト内の重複を排除する"""
     seen = set()
@@ -65,159 +75,270 @@ def _apply_step2(
     clauses: List[Dict[str, Any]], response: List[Dict[str, Any]]
 ) -> List[Dict[str, Any]]:
     """Step2: responseに基づき、各clauseへknowledge_idを付与する（重複排除）"""
-    # 準備：clause_number -> index
-    idx_by_num = {c["clause_number"]: i for i, c in enumerate(clauses)}
-
-    # 初期化：knowledge_idキーを整備
-    for c in clauses:
-        if "knowledge_id" not in c or c["knowledge_id"] is None:
-            c["knowledge_id"] = []
-
-    # 1) clause_numberが空の知見 → 全条項に付与
-    for item in response:
-        k_id = item["knowledge_id"]
-        targets = item.get("clause_number", [])
-        if not targets:  # 全付与
-            for c in clauses:
-                c["knowledge_id"].append(k_id)
-
-    # 2) 指定条項への付与
-    for item in response:
-        k_id = item["knowledge_id"]
-        for num in item.get("clause_number", []):
-            i = idx_by_num.get(num)
-            if i is not None:
-                clauses[i]["knowledge_id"].append(k_id)
-
-    # 重複排除・整形
-    for c in clauses:
-        c["knowledge_id"] = _dedup(c["knowledge_id"])
+    # 既存の knowledge_id に、指定条項への付与を割当行列上で重ねる（重複は行列上で除かれる）。
+    # clause_number が空の知見は付与しない。条項が特定できない知見は
+    # Step1 で類似度上位の条項に限定して割り当て済み
+    assignment = AssignmentMatrix.from_clauses(clauses)
+    assignment.assign_response(response)
+    for c, knowledge_ids in zip(clauses, assignment.knowledge_lists()):
+        c["knowledge_id"] = knowledge_ids
 
     return clauses
 
 
-def _chunk_if_needed(
-    clauses: List[Dict[str, Any]], max_chars: int = 18000
-) -> List[List[Dict[str, Any]]]:
-    """
-    文字数ベースの簡易チャンク。超巨大契約を安全に分割。
-    LLMは各チャンクで knowledge_all 全体と照合し、最後に AND マージ。
-    """
-    chunks = []
-    current = []
-    size = 0
-    for c in clauses:
-        block = json.dumps(c, ensure_ascii=False)
-        if size + len(block) > max_chars and current:
-            chunks.append(current)
-            current = []
-            size = 0
-        current.append(c)
-        size += len(block)
-    if current:
-        chunks.append(current)
-    return chunks
+# 応答をパースできなかったタイルを送る回数の上限（従来の同期版と同じ2回）
+MATCHING_PARSE_ATTEMPTS = 2
 
 
 # =========================
 # メイン実装案
 # =========================
-async def _process_chunk(
-    chunk: List[Dict[str, Any]], knowledge_all: List[Dict[str, Any]], chunk_idx: int
-) -> Tuple[Any, List[Dict]]:
-    """チャンク単位の処理を非同期で実行"""
-    # knowledge_all から id, target_clause のみ抽出
-    knowledge_min = [
-        {"id": k["id"], "target_clause": k["target_clause"]}
-        for k in knowledge_all
-        if "id" in k and "target_clause" in k
-    ]
-    # chunk から clause_number, clause のみ抽出
-    chunk_min = [
-        {"clause_number": c["clause_number"], "clause": c["clause"]}
-        for c in chunk
-        if "clause_number" in c and "clause" in c
-    ]
+async def _process_tile(
+    tile: Dict[str, Any],
+) -> Tuple[Optional[List[Dict[str, Any]]], Dict, Dict]:
+    """
+    タイル（条項ブロック × ナレッジブロック）単位の処理を非同期で実行。
+    応答をパースできない場合（構造化出力に対応しないモデルの自由形式の応答、出力の打ち切り）は
+    応答キャッシュから消して MATCHING_PARSE_ATTEMPTS 回まで送り直し、それでも失敗したタイルは
+    parsed=None（タイルの組は判定不明）として返す。
+    """
     user_prompt = USER_PROMPT_TEMPLATE.format(
-        knowledge_json=json.dumps(knowledge_min, ensure_ascii=False),
-        clauses_json=json.dumps(chunk_min, ensure_ascii=False),
+        knowledge_json=json.dumps(tile["knowledge"], ensure_ascii=False),
+        clauses_json=json.dumps(tile["clauses"], ensure_ascii=False),
     )
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt},
     ]
 
-    raw = await ainvoke_with_limit(messages)
-    parsed = _force_json(raw)
-
-    return parsed, [{"chunk": chunk_idx, "messages": messages}]
+    tile_key = {"chunk": tile["chunk"], "knowledge_block": tile["knowledge_block"]}
+    for attempt in range(MATCHING_PARSE_ATTEMPTS):
+        raw = await ainvoke_with_limit(messages, stage="matching")
+        try:
+            parsed = parse_structured_response(raw, "matching")
+            if not isinstance(parsed, list):
+                raise ValueError("応答が配列ではありません")
+            return parsed, {**tile_key, "messages": messages}, {**tile_key, "raw": raw}
+        except Exception as e:
+            # 壊れた応答をキャッシュから返さないよう消してから送り直す
+            await forget_cached_response(messages, "matching")
+            error = e
+    print(
+        f"マッチングの応答をパースできないため、タイル {tile_key} の組は判定不明として扱います: {error}"
+    )
+    return (
+        None,
+        {**tile_key, "messages": messages},
+        {**tile_key, "raw": raw, "error": str(error)},
+    )
 
 
-async def matching_clause_and_knowledge_async(
+async def iter_matching_async(
     knowledge_all: List[Dict[str, Any]], clauses: List[Dict[str, Any]]
-) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Returns:
-      response        : Step1のマッピング [{"knowledge_id":..., "clause_number":[...]}...]
-      clauses_augmented: Step2適用後の clauses
-      trace           : デバッグ用（送信プロンプト、LLM生応答 など）
+    マッチングを実行し、割当が確定したナレッジから順にイベントとして yield する。
+    ナレッジの割当は、そのナレッジを含むタイルがすべて完了した時点で確定する
+    （どのタイルにも含まれない判定済みのナレッジはタイルの実行前に確定する）。
+    Yields:
+      {"type": "knowledge", "knowledge_id": str, "clause_number": [...]}: 確定したナレッジの割当
+        （事前絞り込みで除外したナレッジは yield しない）
+      {"type": "done", "response", "clauses_augmented", "trace"}:
+        matching_clause_and_knowledge_async の戻り値と同じ
+    確定後に別のタイルの応答が同じナレッジに言及しても、その割当は変えない。
     """
     # --- 1) 入力の正規化（clause_numberは文字列化）
     for c in clauses:
         if not isinstance(c.get("clause_number"), str):
             c["clause_number"] = str(c["clause_number"])
 
-    # --- 2) チャンク戦略（超長文対策）
-    clause_chunks = _chunk_if_needed(clauses)
+    # --- 2) タイル分割（条項ブロック × ナレッジブロック、いずれもトークン予算で均等に分割）
+    prompt_overhead = estimate_message_tokens(
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": USER_PROMPT_TEMPLATE.format(
+                    knowledge_json="", clauses_json=""
+                ),
+            },
+        ]
+    )
+    settings = effective_budgets(prompt_overhead)
+    # clauses から clause_number, clause のみ抽出
+    clauses_min = [
+        {"clause_number": c["clause_number"], "clause": c["clause"]}
+        for c in clauses
+        if "clause_number" in c and "clause" in c
+    ]
+    clause_chunks = balanced_partition(clauses_min, settings["clause_tokens"])
 
     aggregate_map: Dict[str, List[str]] = {k["id"]: [] for k in knowledge_all}
     trace = {"prompts": [], "raw_responses": []}
 
-    # --- 3) 並列でチャンク処理
-    tasks = []
-    for chunk_idx, chunk in enumerate(clause_chunks):
-        tasks.append(_process_chunk(chunk, knowledge_all, chunk_idx))
-
-    results = await asyncio.gather(*tasks)
-
-    # --- 4) 結果を集約
-    for parsed, prompts in results:
-        trace["prompts"].extend(prompts)
-        for item in parsed:
-            k = item["knowledge_id"]
-            nums = [str(n) for n in item.get("clause_number", [])]
-            aggregate_map.setdefault(k, [])
-            aggregate_map[k].extend(nums)
+    # knowledge_all から id, target_clause のみ抽出
+    knowledge_min = [
+        {"id": k["id"], "target_clause": k["target_clause"]}
+        for k in knowledge_all
+        if "id" in k and "target_clause" in k
+    ]
+    # 判定済みの組（判定キャッシュ、字句マッチ）を除き、未判定の組を含む条項・ナレッジだけをタイルにする
+    mode = match_mode()
+    versions = {k["id"]: knowledge_version(k) for k in knowledge_all if "id" in k}
+    scope = matching_scope(SYSTEM_PROMPT)
+    if mode == "lexical":
+        # 字句マッチのみ: 埋め込み・LLM を使わず全ナレッジを全条項と照合する
+        knowledge_per_chunk = [list(knowledge_min) for _ in clause_chunks]
+        trace["prefilter"] = {"enabled": False, "pruned_ids": []}
+        decided, trace["match_cache"] = {}, {"enabled": False}
+    else:
+        # 埋め込みの類似度でチャンクごとに送るナレッジを絞り込む
+        knowledge_per_chunk, trace["prefilter"] = await asyncio.to_thread(
+            prefilter_knowledge, knowledge_min, clause_chunks
+        )
+        decided, trace["match_cache"] = await asyncio.to_thread(
+            cached_decisions, clause_chunks, knowledge_per_chunk, versions, scope
+        )
+        # 履歴から学習した分類器で確信度の高い組を判定する
+        classified, trace["classifier"] = await asyncio.to_thread(
+            classifier_decisions, clause_chunks, knowledge_per_chunk, decided, versions
+        )
+        decided.update(classified)
+    if mode != "llm":
+        lexical, trace["lexical"] = await asyncio.to_thread(
+            lexical_decisions, clause_chunks, knowledge_per_chunk, decided, mode
+        )
+        decided.update(lexical)
+    decided_matches, delta_chunks, delta_knowledge = pack_undecided(
+        clause_chunks, knowledge_per_chunk, decided, settings["clause_tokens"]
+    )
+    for num, k_id in decided_matches:
+        aggregate_map.setdefault(k_id, []).append(num)
+    tiles = plan_tiles(delta_chunks, delta_knowledge, settings["knowledge_tokens"])
+    trace["tiles"] = describe_tiles(tiles)
 
-    # --- 5) knowledge_idごとに重複除去
-    response: List[Dict[str, Any]] = []
+    # --- 3) 全タイルを並列処理し、完了したタイルから集約する
     all_clause_numbers = [str(c["clause_number"]) for c in clauses]
+    clause_order = {num: i for i, num in enumerate(all_clause_numbers)}
+    pruned = set(trace["prefilter"]["pruned_ids"])
+    entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
     for k in knowledge_all:
-        k_id = k["id"]
-        mapped = _dedup(aggregate_map.get(k_id, []))
-        # もし全チャンクで一切マッピングされなければ、全条項を指定
-        if not mapped:
-            mapped = all_clause_numbers.copy()
-        response.append({"knowledge_id": k_id, "clause_number": mapped})
+        # 事前絞り込みで類似条項がないと判定されたナレッジは割り当てない
+        if k["id"] not in pruned:
+            entries[k["id"]].append(k)
+    pending = Counter(k["id"] for tile in tiles for k in tile["knowledge"])
+    top_k = fallback_top_k()
+    fallback: Dict[str, List[str]] = {}
+    clause_numbers_of: Dict[str, List[str]] = {}
+
+    async def finalize(k_ids: List[str]) -> List[Dict[str, Any]]:
+        """割当が確定したナレッジの clause_number を決め、イベントを返す"""
+        ready = [k_id for k_id in k_ids if k_id in entries]
+        unmatched: List[Dict[str, Any]] = []
+        for k_id in ready:
+            # タイルの完了順・LLMの出力順によらず契約書の条項順に並べる
+            clause_numbers_of[k_id] = sorted(
+                _dedup(aggregate_map.get(k_id, [])),
+                key=lambda num: clause_order.get(num, len(clause_order)),
+            )
+            if not clause_numbers_of[k_id]:
+                unmatched.extend(entries[k_id])
+        # 全タイルで一切マッピングされなかったナレッジは、類似度上位k条項に限定して割り当てる
+        # （ナレッジごとに独立に決まるため、確定したものから順に求めてよい）
+        if unmatched:
+            fallback.update(
+                await asyncio.to_thread(
+                    fallback_clause_numbers,
+                    unmatched,
+                    clauses_min,
+                    top_k,
+                    use_embeddings=mode != "lexical",
+                )
+            )
+        for k_id in ready:
+            clause_numbers_of[k_id] = clause_numbers_of[k_id] or fallback.get(k_id, [])
+        return [
+            {
+                "type": "knowledge",
+                "knowledge_id": k_id,
+                "clause_number": clause_numbers_of[k_id],
+            }
+            for k_id in ready
+        ]
+
+    for event in await finalize([k_id for k_id in entries if not pending[k_id]]):
+        yield event
+
+    async def run_tile(i: int, tile: Dict[str, Any]):
+        return i, await _process_tile(tile)
+
+    results = [None] * len(tiles)
+    for next_done in asyncio.as_completed(
+        [run_tile(i, tile) for i, tile in enumerate(tiles)]
+    ):
+        i, (parsed, prompt, raw) = await next_done
+        results[i] = (prompt, raw)
+        # パースできなかったタイルの組は判定不明とし、割当・判定キャッシュに加えない
+        # （他のタイルでも割り当たらなければ類似度上位k条項へのフォールバックになる）
+        if parsed is not None:
+            merge_tile_mappings(aggregate_map, parsed, decided)
+            await asyncio.to_thread(
+                record_tile, tiles[i], parsed, versions, scope, decided
+            )
+        ready = []
+        for k in tiles[i]["knowledge"]:
+            pending[k["id"]] -= 1
+            if not pending[k["id"]]:
+                ready.append(k["id"])
+        for event in await finalize(ready):
+            yield event
+
+    # --- 4) トレースはタイル順に並べる
+    for prompt, raw in results:
+        trace["prompts"].append(prompt)
+        trace["raw_responses"].append(raw)
+    trace["undecided_tiles"] = [
+        {"chunk": raw["chunk"], "knowledge_block": raw["knowledge_block"]}
+        for _, raw in results
+        if "error" in raw
+    ]
+
+    # --- 5) knowledge_all の順に結果を並べる
+    response: List[Dict[str, Any]] = [
+        {"knowledge_id": k_id, "clause_number": clause_numbers_of[k_id]}
+        for k_id in entries
+    ]
+    trace["fan_out"] = fan_out(response, len(clauses), list(fallback), top_k)
 
     # --- 6) Step2: 付与
     clauses_augmented = _apply_step2([dict(c) for c in clauses], response)
-    # 本番では以下を削除する
-    with open("match_cl_and_kn.json", "w", encoding="utf-8") as f:
-        json.dump(
-            {"response": response, "clauses_out": clauses_augmented, "trace": trace},
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
-    # 本番では以上を削除する
-    return response, clauses_augmented, trace
+    # デバッグ用トレース（サンプリングして別スレッドで書き出す。処理は待たない）
+    get_trace_sink().emit(
+        "matching",
+        lambda: {
+            "response": response,
+            "clauses_out": clauses_augmented,
+            "trace": dedupe_message_contents(trace),
+        },
+    )
+    yield {
+        "type": "done",
+        "response": response,
+        "clauses_augmented": clauses_augmented,
+        "trace": trace,
+    }
 
 
-def matching_clause_and_knowledge(
+async def matching_clause_and_knowledge_async(
     knowledge_all: List[Dict[str, Any]], clauses: List[Dict[str, Any]]
 ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
     """
-    同期版のラッパー関数
+    Returns:
+      response        : Step1のマッピング [{"knowledge_id":..., "clause_number":[...]}...]
+      clauses_augmented: Step2適用後の clauses
+      trace           : デバッグ用（送信プロンプト、LLM生応答 など）
     """
-    return asyncio.run(matching_clause_and_knowledge_async(knowledge_all, clauses))
+    async for event in iter_matching_async(knowledge_all, clauses):
+        if event["type"] == "done":
+            result = event
+    return result["response"], result["clauses_augmented"], result["trace"]
@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+import numpy as np
+
+from api.lexical_matcher import tokenize
+
+# =========================
+# マッチング履歴から学習する条項分類器
+# =========================
+# 同じナレッジは審査のたびに同じ種類の条項（秘密保持、契約期間、準拠法 など）へ割り当てられる。
+# マッチング判定キャッシュ（api/match_cache.py）に溜まった LLM の判定を教師データとして、
+# 条文の TF-IDF（字句マッチと同じ分かち書き）を特徴量にナレッジごとのロジスティック回帰を学習し、
+# 確信度が高い組だけを LLM に送らずに判定する（低い組は従来どおり LLM へ）。
+# 学習・評価は CLI で行う:
+#     python -m api.match_classifier train    # 履歴から学習して保存
+#     python -m api.match_classifier report   # 履歴の一部を取り置いた精度・速度の評価
+# MATCH_CLASSIFIER_PATH     : 学習済みモデルのパス（なければ分類器は使わない）
+# MATCH_CLASSIFIER_ACCEPT   : この確率以上なら LLM に送らず該当とする
+# MATCH_CLASSIFIER_REJECT   : この確率以下なら LLM に送らず非該当とする
+# MATCH_CLASSIFIER_DISABLED : 1 で分類器を使わない
+DEFAULT_ACCEPT = 0.9
+DEFAULT_REJECT = 0.05
+# ナレッジごとの学習に必要な最小件数（正例・負例それぞれ）
+MIN_EXAMPLES_PER_CLASS = 2
+
+
+def classifier_settings() -> Dict[str, Any]:
+    """環境変数から分類器の設定を読む"""
+    load_dotenv()
+    return {
+        "enabled": os.getenv("MATCH_CLASSIFIER_DISABLED", "").lower()
+        not in ("1", "true", "yes"),
+        "path": os.getenv(
+            "MATCH_CLASSIFIER_PATH", os.path.join(".cache", "match_classifier.joblib")
+        ),
+        "accept": float(os.getenv("MATCH_CLASSIFIER_ACCEPT", str(DEFAULT_ACCEPT))),
+        "reject": float(os.getenv("MATCH_CLASSIFIER_REJECT", str(DEFAULT_REJECT))),
+    }
+
+
+def train_classifier(history: List[Tuple[str, str, str, bool]]) -> Dict[str, Any]:
+    """
+    判定履歴 [(条文, knowledge_id, ナレッジのバージョン, 該当するか)] から分類器を学習する。
+    ナレッジごとに最も履歴の多いバージョンだけを使い、正例・負例が
+    MIN_EXAMPLES_PER_CLASS 件に満たないナレッジはモデルを作らない（常に LLM へ）。
+    Returns:
+      {"vectorizer", "knowledge_ids", "versions", "coef"(語彙×ナレッジ), "intercept", "examples"}
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    by_version = defaultdict(Counter)
+    for _, kid, version, _ in history:
+        by_version[kid][version] += 1
+    versions = {kid: counts.most_common(1)[0][0] for kid, counts in by_version.items()}
+
+    texts = list(dict.fromkeys(text for text, *_ in history))
+    row_of = {text: i for i, text in enumerate(texts)}
+    vectorizer = TfidfVectorizer(analyzer=tokenize, sublinear_tf=True)
+    try:
+        features = vectorizer.fit_transform(texts)
+    except ValueError:
+        # 履歴がない、または内容語が1つもない
+        return {
+            "vectorizer": None,
+            "knowledge_ids": [],
+            "versions": {},
+            "coef": np.zeros((0, 0), dtype=np.float32),
+            "intercept": np.zeros(0, dtype=np.float32),
+            "examples": len(history),
+        }
+
+    examples = defaultdict(dict)
+    for text, kid, version, matched in history:
+        if version == versions[kid]:
+            # 同じ条文に複数の判定があればいずれかで該当すれば該当とする
+            row = row_of[text]
+            examples[kid][row] = examples[kid].get(row, False) or matched
+
+    knowledge_ids, coefs, intercepts = [], [], []
+    for kid, labels in examples.items():
+        y = np.fromiter(labels.values(), dtype=bool)
+        if min(y.sum(), (~y).sum()) < MIN_EXAMPLES_PER_CLASS:
+            continue
+        model = LogisticRegression(C=10.0, class_weight="balanced", max_iter=1000)
+        model.fit(features[list(labels.keys())], y)
+        knowledge_ids.append(kid)
+        coefs.append(model.coef_[0])
+        intercepts.append(model.intercept_[0])
+
+    n_terms = len(vectorizer.vocabulary_)
+    return {
+        "vectorizer": vectorizer,
+        "knowledge_ids": knowledge_ids,
+        "versions": {kid: versions[kid] for kid in knowledge_ids},
+        "coef": (
+            np.stack(coefs, axis=1).astype(np.float32)
+            if coefs
+            else np.zeros((n_terms, 0), dtype=np.float32)
+        ),
+        "intercept": np.asarray(intercepts, dtype=np.float32),
+        "examples": len(history),
+    }
+
+
+def predict_proba(model: Dict[str, Any], texts: List[str]) -> np.ndarray:
+    """条文 × 学習済みナレッジの該当確率（行: texts、列: model["knowledge_ids"]）"""
+    features = model["vectorizer"].transform(texts)
+    logits = features @ model["coef"] + model["intercept"]
+    return 1.0 / (1.0 + np.exp(-np.asarray(logits)))
+
+
+_loaded: Dict[str, Any] = {}
+
+
+def load_classifier(path: str):
+    """学習済みモデルを読む（ファイルの更新時刻が変わったら読み直す。なければ None）"""
+    import joblib
+
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _loaded.get("key") != (path, mtime):
+        _loaded["model"] = joblib.load(path)
+        _loaded["key"] = (path, mtime)
+    return _loaded["model"]
+
+
+def classifier_decisions(
+    clause_chunks: List[List[Dict[str, Any]]],
+    knowledge_per_chunk: List[List[Dict[str, Any]]],
+    decided: Dict[Tuple[str, str], bool],
+    versions: Dict[str, str],
+) -> Tuple[Dict[Tuple[str, str], bool], Dict[str, Any]]:
+    """
+    候補の (条項, ナレッジ) の組のうち判定済みでないものを分類器で判定する。
+    確率が accept 以上なら該当、reject 以下なら非該当とし、その間と、
+    モデルがない・学習時からバージョンが変わったナレッジの組は判定せずに残す（LLM に送る）。
+    """
+    settings = classifier_settings()
+    stats = {"enabled": False, "accepted": 0, "rejected": 0}
+    if not settings["enabled"]:
+        return {}, stats
+    try:
+        model = load_classifier(settings["path"])
+    except Exception as e:
+        print(f"マッチング分類器を読み込めないため使いません: {e}")
+        return {}, stats
+    if model is None or not model["knowledge_ids"]:
+        return {}, stats
+
+    start = time.perf_counter()
+    col_of = {
+        kid: j
+        for j, kid in enumerate(model["knowledge_ids"])
+        if model["versions"][kid] == versions.get(kid)
+    }
+    clauses = [c for chunk in clause_chunks for c in chunk]
+    proba = predict_proba(model, [c["clause"] for c in clauses])
+
+    decisions: Dict[Tuple[str, str], bool] = {}
+    row = 0
+    for chunk, kn in zip(clause_chunks, knowledge_per_chunk):
+        for c in chunk:
+            for k in kn:
+                pair = (c["clause_number"], k["id"])
+                col = col_of.get(k["id"])
+                if col is None or pair in decided:
+                    continue
+                p = proba[row, col]
+                if p >= settings["accept"]:
+                    decisions[pair] = True
+                elif p <= settings["reject"]:
+                    decisions[pair] = False
+            row += 1
+    accepted = sum(decisions.values())
+    stats.update(
+        {
+            "enabled": True,
+            "knowledge": len(col_of),
+            "accepted": accepted,
+            "rejected": len(decisions) - accepted,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+    )
+    return decisions, stats
+
+
+def evaluate_classifier(
+    history: List[Tuple[str, str, str, bool]],
+    holdout: float = 0.2,
+    accept: float = DEFAULT_ACCEPT,
+    reject: float = DEFAULT_REJECT,
+) -> Dict[str, Any]:
+    """
+    条文単位で履歴の一部（holdout）を取り置き、残りで学習して取り置き分を評価する。
+    確率 0.5 で二値化したときの精度と、確信度ゲート（accept/reject）で
+    LLM に送らずに済む組の割合（coverage）・その組の正解率を返す。
+    """
+
+    def is_holdout(text: str) -> bool:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return digest[0] / 256 < holdout
+
+    train = [row for row in history if not is_holdout(row[0])]
+    test = [row for row in history if is_holdout(row[0])]
+    start = time.perf_counter()
+    model = train_classifier(train)
+    train_seconds = time.perf_counter() - start
+
+    col_of = {kid: j for j, kid in enumerate(model["knowledge_ids"])}
+    test = [
+        row for row in test if row[1] in col_of and model["versions"][row[1]] == row[2]
+    ]
+    result = {
+        "train_pairs": len(train),
+        "test_pairs": len(test),
+        "knowledge_models": len(col_of),
+        "train_seconds": round(train_seconds, 3),
+    }
+    if not test:
+        return result
+    texts = list(dict.fromkeys(row[0] for row in test))
+    row_of = {text: i for i, text in enumerate(texts)}
+    start = time.perf_counter()
+    proba = predict_proba(model, texts)
+    predict_seconds = time.perf_counter() - start
+
+    p = np.array([proba[row_of[text], col_of[kid]] for text, kid, _, _ in test])
+    y = np.array([matched for *_, matched in test], dtype=bool)
+    pred = p >= 0.5
+    tp = int((pred & y).sum())
+    confident = (p >= accept) | (p <= reject)
+    result.update(
+        {
+            "accuracy": round(float((pred == y).mean()), 4),
+            "precision": round(tp / max(int(pred.sum()), 1), 4),
+            "recall": round(tp / max(int(y.sum()), 1), 4),
+            "coverage": round(float(confident.mean()), 4),
+            "confident_accuracy": (
+                round(float(((p >= accept) == y)[confident].mean()), 4)
+                if confident.any()
+                else None
+            ),
+            "predict_us_per_pair": round(predict_seconds / len(test) * 1e6, 2),
+        }
+    )
+    return result
+
+
+def _load_history():
+    from api.match_cache import get_match_cache, matching_scope
+    from api.match_cl_and_kn_async import SYSTEM_PROMPT
+
+    return get_match_cache().history(matching_scope(SYSTEM_PROMPT))
+
+
+def main():
+    import joblib
+
+    parser = argparse.ArgumentParser(description="マッチング分類器の学習・評価")
+    parser.add_argument("command", choices=("train", "report"))
+    parser.add_argument(
+        "--holdout", type=float, default=0.2, help="report で取り置く条文の割合"
+    )
+    args = parser.parse_args()
+    settings = classifier_settings()
+
+    history = _load_history()
+    print(f"判定履歴: {len(history)} 組")
+    if args.command == "train":
+        model = train_classifier(history)
+        if os.path.dirname(settings["path"]):
+            os.makedirs(os.path.dirname(settings["path"]), exist_ok=True)
+        joblib.dump(model, settings["path"])
+        print(
+            f"{len(model['knowledge_ids'])} 件のナレッジのモデルを {settings['path']} に保存しました"
+        )
+    else:
+        report = evaluate_classifier(
+            history, args.holdout, settings["accept"], settings["reject"]
+        )
+        for key, value in report.items():
+            print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
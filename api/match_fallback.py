@@ -0,0 +1,100 @@
+import os
+import re
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+import numpy as np
+
+from api.knowledge_prefilter import similarity_matrix
+
+# =========================
+# マッチングで条項が特定できなかったナレッジのフォールバック
+# =========================
+# 従来は全条項を割り当てていたため、target_clause が曖昧なナレッジ1件が
+# 契約書全体を対象とする審査呼び出しに膨らんでいた。
+# 代わりに、条文との類似度（埋め込み、失敗時は文字バイグラムの重なり）が高い上位k条項に限定する。
+# MATCH_FALLBACK_TOP_K : フォールバックで割り当てる条項数（0 で割り当てない）
+DEFAULT_FALLBACK_TOP_K = 3
+
+
+def fallback_top_k() -> int:
+    load_dotenv()
+    return int(os.getenv("MATCH_FALLBACK_TOP_K", str(DEFAULT_FALLBACK_TOP_K)))
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text or "")
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def lexical_similarity_matrix(
+    clauses: List[Dict[str, Any]], knowledge: List[Dict[str, Any]]
+) -> np.ndarray:
+    """条項 × ナレッジの文字バイグラムの重なり（target_clause 側の集合に対する割合）"""
+    clause_grams = [_bigrams(c.get("clause", "")) for c in clauses]
+    scores = np.zeros((len(clauses), len(knowledge)), dtype=np.float32)
+    for j, k in enumerate(knowledge):
+        target = _bigrams(k.get("target_clause", ""))
+        if not target:
+            continue
+        for i, grams in enumerate(clause_grams):
+            scores[i, j] = len(target & grams) / len(target)
+    return scores
+
+
+def fallback_clause_numbers(
+    knowledge: List[Dict[str, Any]],
+    clauses: List[Dict[str, Any]],
+    top_k: int = None,
+    service=None,
+    use_embeddings: bool = True,
+) -> Dict[str, List[str]]:
+    """
+    条項が特定できなかったナレッジごとに、類似度上位 top_k 件の clause_number を返す
+    （契約書の条項順）。埋め込みはマッチングの事前絞り込みで取得済みのためキャッシュから引ける。
+    use_embeddings=False（字句マッチのみのモード）では外部呼び出しをせず文字列の類似度を使う。
+    """
+    if top_k is None:
+        top_k = fallback_top_k()
+    if not knowledge or not clauses or top_k <= 0:
+        return {k["id"]: [] for k in knowledge}
+    if not use_embeddings:
+        scores = lexical_similarity_matrix(clauses, knowledge)
+    else:
+        try:
+            scores = similarity_matrix(clauses, knowledge, service)
+        except Exception as e:
+            print(
+                f"フォールバックの埋め込みに失敗したため文字列の類似度を使います: {e}"
+            )
+            scores = lexical_similarity_matrix(clauses, knowledge)
+    k = min(top_k, len(clauses))
+    result = {}
+    for j, item in enumerate(knowledge):
+        rows = np.sort(np.argpartition(-scores[:, j], k - 1)[:k])
+        result[item["id"]] = [str(clauses[i]["clause_number"]) for i in rows]
+    return result
+
+
+def fan_out(
+    response: List[Dict[str, Any]],
+    n_clauses: int,
+    fallback_ids: List[str],
+    top_k: int,
+) -> Dict[str, int]:
+    """
+    審査で発生する (条項, ナレッジ) の組の総数。
+    before はフォールバックしたナレッジに全条項を割り当てていた従来方式の場合の値。
+    """
+    fallback = set(fallback_ids)
+    after = sum(len(item["clause_number"]) for item in response)
+    before = sum(
+        n_clauses if item["knowledge_id"] in fallback else len(item["clause_number"])
+        for item in response
+    )
+    return {
+        "before": before,
+        "after": after,
+        "fallback_knowledge": len(fallback),
+        "fallback_top_k": top_k,
+    }
@@ -0,0 +1,258 @@
+import json
+import os
+from typing import Any, Dict, List, Set, Tuple
+
+from dotenv import load_dotenv
+
+from api.tokens import estimate_tokens
+
+# =========================
+# マッチングの2次元タイル分割（条項ブロック × ナレッジブロック）
+# =========================
+# 条項だけを分割してナレッジ全件を各チャンクに繰り返すと、ナレッジが多いときに
+# 全チャンクが巨大になり、最大のプロンプトで律速される。
+# 条項・ナレッジの双方をトークン予算でブロックに分け、各 (条項ブロック, ナレッジブロック) を
+# 1回のLLM呼び出し（タイル）として並列に実行する。
+# ブロックはトークン数を概算（api/tokens.py）して、コンテキスト長に収まる範囲で大きさをそろえる。
+# MATCH_TILE_CLAUSE_TOKENS    : 1タイルに載せる条項の推定トークン数の上限
+# MATCH_TILE_KNOWLEDGE_TOKENS : 1タイルに載せるナレッジの推定トークン数の上限
+DEFAULT_CLAUSE_BLOCK_TOKENS = 6000
+DEFAULT_KNOWLEDGE_BLOCK_TOKENS = 4000
+# マッチング応答（knowledge_id と条項番号の配列）のために空けておく出力トークン数
+MATCH_OUTPUT_RESERVE_TOKENS = 4000
+
+
+def tile_settings() -> Dict[str, int]:
+    """環境変数からタイルのトークン予算を読む"""
+    load_dotenv()
+    return {
+        "clause_tokens": int(
+            os.getenv("MATCH_TILE_CLAUSE_TOKENS", str(DEFAULT_CLAUSE_BLOCK_TOKENS))
+        ),
+        "knowledge_tokens": int(
+            os.getenv(
+                "MATCH_TILE_KNOWLEDGE_TOKENS", str(DEFAULT_KNOWLEDGE_BLOCK_TOKENS)
+            )
+        ),
+    }
+
+
+def item_tokens(item: Dict[str, Any]) -> int:
+    """プロンプトに JSON で載せたときの推定トークン数"""
+    return estimate_tokens(json.dumps(item, ensure_ascii=False))
+
+
+def _greedy_cuts(tokens: List[int], budget: int) -> List[int]:
+    """先頭から詰めたときのブロック境界（各ブロックの開始位置、先頭の0を除く）"""
+    cuts = []
+    size = 0
+    for i, t in enumerate(tokens):
+        if i > 0 and size + t > budget:
+            cuts.append(i)
+            size = 0
+        size += t
+    return cuts
+
+
+def _split(items: List[Any], cuts: List[int]) -> List[List[Any]]:
+    bounds = [0] + cuts + [len(items)]
+    return [items[bounds[i] : bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def partition_by_tokens(items: List[Any], budget: int) -> List[List[Any]]:
+    """
+    順序を保ったまま、推定トークン数の合計が budget を超えないブロックに先頭から詰める。
+    1件で budget を超えるものは単独のブロックにする。
+    """
+    if not items:
+        return []
+    return _split(items, _greedy_cuts([item_tokens(x) for x in items], budget))
+
+
+def balanced_partition(items: List[Any], budget: int) -> List[List[Any]]:
+    """
+    partition_by_tokens と同じブロック数のまま、各ブロックの推定トークン数をそろえる。
+    先頭から詰めると最後のブロックだけが極端に小さくなり、並列実行したときに
+    ブロック間で所要時間がばらつくため、
+      1. 最大ブロックのトークン数を最小にする上限を二分探索で求め、
+      2. その上限の範囲で、各境界を累積トークン数が均等割りの位置に最も近いところに置く。
+    順序は保つ。
+    """
+    if not items:
+        return []
+    tokens = [item_tokens(x) for x in items]
+    n_blocks = len(_greedy_cuts(tokens, budget)) + 1
+    if n_blocks == 1:
+        return [list(items)]
+
+    lo, hi = max(tokens), max(max(tokens), budget)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if len(_greedy_cuts(tokens, mid)) + 1 <= n_blocks:
+            hi = mid
+        else:
+            lo = mid + 1
+    limit = lo
+
+    prefix = [0]
+    for t in tokens:
+        prefix.append(prefix[-1] + t)
+    total = prefix[-1]
+    cuts = []
+    prev = 0
+    for k in range(1, n_blocks):
+        target = total * k / n_blocks
+        remaining_blocks = n_blocks - k
+        candidates = [
+            j
+            for j in range(prev + 1, len(items) - remaining_blocks + 1)
+            if prefix[j] - prefix[prev] <= limit
+            and total - prefix[j] <= remaining_blocks * limit
+        ]
+        if not candidates:
+            break
+        prev = min(candidates, key=lambda j: abs(prefix[j] - target))
+        cuts.append(prev)
+    bounds = [0] + cuts + [len(items)]
+    if len(cuts) != n_blocks - 1 or any(
+        prefix[bounds[i + 1]] - prefix[bounds[i]] > limit
+        for i in range(len(bounds) - 1)
+    ):
+        # 均等割りで上限を守れない場合は、上限で先頭から詰める（ブロック数は同じ）
+        cuts = _greedy_cuts(tokens, limit)
+    return _split(items, cuts)
+
+
+def effective_budgets(prompt_overhead: int) -> Dict[str, int]:
+    """
+    タイルのトークン予算を、マッチング段階のモデルのコンテキスト長に収まるよう丸める。
+    コンテキスト長から固定プロンプト分（prompt_overhead）と出力の予約分を引いた残りを
+    条項・ナレッジの予算の比で配分し、設定値より小さければそちらを使う。
+    """
+    from azure_.model_registry import get_model_spec, resolve_stage_model
+
+    settings = tile_settings()
+    spec = get_model_spec(resolve_stage_model("matching"))
+    output_reserve = min(spec["max_output_tokens"], MATCH_OUTPUT_RESERVE_TOKENS)
+    available = max(spec["context_window"] - prompt_overhead - output_reserve, 2)
+    requested = settings["clause_tokens"] + settings["knowledge_tokens"]
+    if requested <= available:
+        return settings
+    return {
+        "clause_tokens": max(1, available * settings["clause_tokens"] // requested),
+        "knowledge_tokens": max(
+            1, available * settings["knowledge_tokens"] // requested
+        ),
+    }
+
+
+def plan_tiles(
+    clause_blocks: List[List[Dict[str, Any]]],
+    knowledge_per_block: List[List[Dict[str, Any]]],
+    knowledge_budget: int,
+) -> List[Dict[str, Any]]:
+    """
+    条項ブロックごとの候補ナレッジをトークン予算で分割し、タイルの一覧を返す。
+    各タイルは {"chunk", "knowledge_block", "clauses", "knowledge"}。
+    候補ナレッジが空の条項ブロックはタイルを作らない。
+    """
+    tiles = []
+    for chunk_idx, (clauses, knowledge) in enumerate(
+        zip(clause_blocks, knowledge_per_block)
+    ):
+        for block_idx, block in enumerate(
+            balanced_partition(knowledge, knowledge_budget)
+        ):
+            tiles.append(
+                {
+                    "chunk": chunk_idx,
+                    "knowledge_block": block_idx,
+                    "clauses": clauses,
+                    "knowledge": block,
+                }
+            )
+    return tiles
+
+
+def pack_undecided(
+    clause_chunks: List[List[Dict[str, Any]]],
+    knowledge_per_chunk: List[List[Dict[str, Any]]],
+    decided: Dict[Tuple[str, str], bool],
+    clause_budget: int,
+) -> Tuple[
+    Set[Tuple[str, str]], List[List[Dict[str, Any]]], List[List[Dict[str, Any]]]
+]:
+    """
+    判定済みの組（判定キャッシュ、字句マッチの確信度ゲート）を除き、LLMに送るブロックを作り直す。
+    Args:
+      decided: {(clause_number, knowledge_id): 該当するか}
+    Returns:
+      matched        : 判定済みで「該当する」組 (clause_number, knowledge_id)
+      delta_chunks   : 未判定の組を含む条項だけを詰め直した条項ブロック
+      delta_knowledge: 各ブロックの条項について未判定のナレッジ（元の順序）
+    判定済みの組がなければ入力のブロックをそのまま返す。
+    """
+    if not decided:
+        return set(), clause_chunks, knowledge_per_chunk
+
+    matched: Set[Tuple[str, str]] = set()
+    undecided: Dict[str, Set[str]] = {}
+    delta_clauses = []
+    order: Dict[str, int] = {}
+    knowledge_by_id: Dict[str, Dict[str, Any]] = {}
+    for chunk, knowledge in zip(clause_chunks, knowledge_per_chunk):
+        for k in knowledge:
+            order.setdefault(k["id"], len(order))
+            knowledge_by_id[k["id"]] = k
+        for c in chunk:
+            missing = undecided.setdefault(c["clause_number"], set())
+            for k in knowledge:
+                result = decided.get((c["clause_number"], k["id"]))
+                if result is None:
+                    missing.add(k["id"])
+                elif result:
+                    matched.add((c["clause_number"], k["id"]))
+            if missing:
+                delta_clauses.append(c)
+
+    delta_chunks = balanced_partition(delta_clauses, clause_budget)
+    delta_knowledge = []
+    for block in delta_chunks:
+        ids = set().union(*(undecided[c["clause_number"]] for c in block))
+        delta_knowledge.append(
+            [knowledge_by_id[k_id] for k_id in sorted(ids, key=order.get)]
+        )
+    return matched, delta_chunks, delta_knowledge
+
+
+def describe_tiles(tiles: List[Dict[str, Any]]) -> List[Dict[str, int]]:
+    """トレース用のタイル概要（件数と推定トークン数）"""
+    return [
+        {
+            "chunk": t["chunk"],
+            "knowledge_block": t["knowledge_block"],
+            "clauses": len(t["clauses"]),
+            "knowledge": len(t["knowledge"]),
+            "tokens": sum(item_tokens(x) for x in t["clauses"] + t["knowledge"]),
+        }
+        for t in tiles
+    ]
+
+
+def merge_tile_mappings(
+    aggregate_map: Dict[str, List[str]],
+    parsed: List[Dict[str, Any]],
+    decided: Dict[Tuple[str, str], bool] = None,
+) -> None:
+    """
+    タイル1件分のマッピングを knowledge_id -> clause_number のリストに追加する。
+    判定済みの組（decided）は判定済みの結果を優先し、タイルの応答では上書きしない。
+    """
+    decided = decided or {}
+    for item in parsed:
+        k = item["knowledge_id"]
+        nums = [
+            str(n) for n in item.get("clause_number", []) if (str(n), k) not in decided
+        ]
+        aggregate_map.setdefault(k, [])
+        aggregate_map[k].extend(nums)
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional
+
+# デプロイごとの既定クォータ（Azure ポータルの「1分あたりのトークン/要求」に合わせて調整）
+# output_reserve: 1回の呼び出しで見込む出力トークン数（Azure は max_tokens 分も TPM に計上する）
+DEFAULT_DEPLOYMENT_LIMITS: Dict[str, Dict[str, int]] = {
+    "gpt-4.1": {"rpm": 300, "tpm": 50000, "output_reserve": 2000},
+    "gpt-4.1-mini": {"rpm": 300, "tpm": 50000, "output_reserve": 2000},
+    "gpt-4.1-nano": {"rpm": 300, "tpm": 50000, "output_reserve": 2000},
+    "gpt-5": {"rpm": 100, "tpm": 100000, "output_reserve": 4000},
+    "gpt-5-mini": {"rpm": 100, "tpm": 100000, "output_reserve": 4000},
+    "gpt-5-nano": {"rpm": 100, "tpm": 100000, "output_reserve": 4000},
+    "gpt-5-chat": {"rpm": 100, "tpm": 100000, "output_reserve": 2000},
+    "o1": {"rpm": 100, "tpm": 100000, "output_reserve": 8000},
+    "o1-mini": {"rpm": 100, "tpm": 100000, "output_reserve": 8000},
+    "o3": {"rpm": 100, "tpm": 100000, "output_reserve": 8000},
+    "o3-mini": {"rpm": 100, "tpm": 100000, "output_reserve": 8000},
+    "o4-mini": {"rpm": 100, "tpm": 100000, "output_reserve": 8000},
+    # 埋め込み（出力トークンはないため予約しない）
+    "text-embedding-3-small": {"rpm": 2100, "tpm": 350000, "output_reserve": 0},
+}
+FALLBACK_LIMITS = {"rpm": 60, "tpm": 30000, "output_reserve": 2000}
+
+
+def load_deployment_limits() -> Dict[str, Dict[str, int]]:
+    """
+    既定クォータに環境変数 LLM_DEPLOYMENT_LIMITS（JSON）の上書きを適用して返す。
+    例: LLM_DEPLOYMENT_LIMITS='{"gpt-4.1": {"rpm": 600, "tpm": 150000}}'
+    """
+    limits = {name: dict(v) for name, v in DEFAULT_DEPLOYMENT_LIMITS.items()}
+    raw = os.getenv("LLM_DEPLOYMENT_LIMITS")
+    if raw:
+        for name, override in json.loads(raw).items():
+            limits.setdefault(name, dict(FALLBACK_LIMITS)).update(override)
+    return limits
+
+
+class TokenBucket:
+    """容量 capacity、毎秒 refill_rate で補充されるトークンバケット"""
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.available = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self._updated) * self.refill_rate
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount を取り出せるまでの待ち秒数（0なら即時）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.refill_rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class DeploymentRateLimiter:
+    """
+    1デプロイ分の RPM / TPM 予算。両方のバケットに余裕があるときだけ呼び出しを通す。
+    待機は到着順（FIFO）で、ゲートウェイのイベントループ上でのみ使用する。
+    """
+
+    def __init__(self, rpm: int, tpm: int, output_reserve: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.output_reserve = output_reserve
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.waited_seconds = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, prompt_tokens: int):
+        """推定トークン（入力＋出力見込み）分の予算が空くまで待ってから消費する"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        cost = prompt_tokens + self.output_reserve
+        async with self._lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(cost))
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(cost)
+                    return
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests_available": round(self.requests.available, 1),
+            "tokens_available": round(self.tokens.available, 1),
+            "waited_seconds": round(self.waited_seconds, 2),
+        }
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+import streamlit as st
+
+from .match_cache import clause_hash
+
+# =========================
+# 審査結果の永続キャッシュ
+# =========================
+# 準拠法・分離可能性・契約期間などの定型条項は契約をまたいでほぼ同じ文言で現れるが、
+# 従来は契約ごと・利用者ごとに同じナレッジで審査し直していた。
+# (正規化した条文のハッシュ, knowledge_id, ナレッジのバージョン) ごとに、そのナレッジによる
+# 懸念点・修正条文（懸念なしは null）を保存し、審査を呼ぶ前に参照する。
+# 条文のハッシュはマッチング判定キャッシュと同じ（先頭の「第N条（見出し）」を含む）。
+# ナレッジのバージョンは version に審査プロンプトへ載せるナレッジ全体のハッシュを加えたもの。
+# 複数ナレッジをまとめた審査（api/review_packing.py）で根拠に複数のナレッジを挙げた結果は
+# ナレッジごとに分けられないため、根拠のナレッジの組（knowledge_group）とともに各ナレッジの行に保存し、
+# 組のナレッジがすべて同じ条項に割り当てられ、すべてヒットした場合だけ1件の結果として使う。
+# 保存するのは根拠に挙がったナレッジの結果と、懸念なしが明示された結果（ナレッジ1件だけの審査、
+# または条項に懸念・修正条文・根拠がひとつもない結果）に限る。複数ナレッジの審査で
+# 他のナレッジの指摘だけが返った条項では、根拠に挙がらなかったナレッジが懸念なしと判断されたのか
+# 見落とされたのかを区別できないため保存しない（次回はそのナレッジだけ審査し直す）。
+# LLM 呼び出し・パースに失敗した結果は保存しない。
+# KnowledgeAPI.save_knowledge / delete_knowledge で該当ナレッジのエントリを消す。
+# REVIEW_CACHE_PATH        : SQLite ファイルのパス
+# REVIEW_CACHE_MAX_ENTRIES : 保存する組の上限（超えた分は最終アクセスが古い順に削除。
+#                            件数の確認は書き込みごとには行わない）
+# REVIEW_CACHE_DISABLED    : 1 でキャッシュを使わない（LLM_CACHE_DISABLED=1 でも無効）
+
+Key = Tuple[str, str, str]  # (clause_hash, knowledge_id, knowledge_version)
+# (concern, amendment_clause, knowledge_group)。knowledge_group はナレッジ単独の結果なら空
+Result = Tuple[Optional[str], Optional[str], Tuple[str, ...]]
+
+
+def review_knowledge_version(entries: List[Dict[str, Any]]) -> str:
+    """審査に使うナレッジのバージョン（version と、プロンプトに載せる内容全体のハッシュ）"""
+    payload = json.dumps(entries, ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return f"{entries[0].get('version', '') if entries else ''}:{digest[:16]}"
+
+
+def review_scope() -> str:
+    """審査のモデルとプロンプトが変わったら別のキャッシュとして扱うためのキー"""
+    from azure_.model_registry import resolve_stage_model
+
+    from .async_llm_service import REVIEW_SYSTEM_PROMPT
+
+    payload = f"{resolve_stage_model('review')}\x00{REVIEW_SYSTEM_PROMPT}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class ReviewResultCache:
+    """
+    (条文ハッシュ, knowledge_id, ナレッジのバージョン) -> (懸念点, 修正条文, 根拠のナレッジの組)
+    の永続キャッシュ（SQLite）。
+    複数スレッドから共有するため内部でロックする。
+    上限の確認（全件の集計）は書き込みごとには行わず、evict_interval 組を書くごとか、
+    見積もりの件数が上限を超えた時点で行い、上限の evict_ratio まで減らす。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1000000,
+        evict_interval: int = 5000,
+        evict_ratio: float = 0.9,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_interval = max(evict_interval, 1)
+        self.evict_ratio = evict_ratio
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS review_cache (
+                scope TEXT NOT NULL,
+                clause_hash TEXT NOT NULL,
+                knowledge_id TEXT NOT NULL,
+                knowledge_version TEXT NOT NULL,
+                concern TEXT,
+                amendment_clause TEXT,
+                knowledge_group TEXT NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (scope, clause_hash, knowledge_id, knowledge_version)
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_review_cache_knowledge ON review_cache(knowledge_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_review_cache_last_access ON review_cache(last_access)"
+        )
+        self._conn.commit()
+        # 書き込みごとに COUNT しないよう、件数は見積もりで追う（置き換えも1件と数えるので多めになる）
+        self._writes_since_evict = 0
+        (self._approx_entries,) = self._conn.execute(
+            "SELECT COUNT(*) FROM review_cache"
+        ).fetchone()
+
+    def get_many(self, scope: str, keys: List[Key]) -> Dict[Key, Result]:
+        """審査済みの組だけ {key: (concern, amendment_clause, knowledge_group)} で返す"""
+        wanted = set(keys)
+        found: Dict[Key, Result] = {}
+        hashes = list(dict.fromkeys(k[0] for k in wanted))
+        now = time.time()
+        with self._lock:
+            # SQLite のプレースホルダ上限を避けて分割
+            for i in range(0, len(hashes), 500):
+                part = hashes[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT clause_hash, knowledge_id, knowledge_version, concern, amendment_clause, "
+                    "knowledge_group "
+                    f"FROM review_cache WHERE scope = ? AND clause_hash IN ({','.join('?' * len(part))})",
+                    [scope] + part,
+                ).fetchall()
+                for h, kid, version, concern, amendment, group in rows:
+                    if (h, kid, version) in wanted:
+                        found[(h, kid, version)] = (
+                            concern,
+                            amendment,
+                            tuple(json.loads(group)),
+                        )
+            if found:
+                self._conn.executemany(
+                    "UPDATE review_cache SET last_access = ? WHERE scope = ? AND clause_hash = ? "
+                    "AND knowledge_id = ? AND knowledge_version = ?",
+                    [(now, scope, *k) for k in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(self, scope: str, results: Dict[Key, Result]):
+        """審査結果を保存する"""
+        if not results:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO review_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (scope, h, kid, version, concern, amendment, json.dumps(group), now)
+                    for (h, kid, version), (
+                        concern,
+                        amendment,
+                        group,
+                    ) in results.items()
+                ],
+            )
+            self._writes_since_evict += len(results)
+            self._approx_entries += len(results)
+            if (
+                self._writes_since_evict >= self.evict_interval
+                or self._approx_entries > self.max_entries
+            ):
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """件数が上限を超えていれば上限の evict_ratio まで最終アクセスの古い順に削除する（ロック内で呼ぶ）"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM review_cache").fetchone()
+        self._writes_since_evict = 0
+        self._approx_entries = count
+        if count <= self.max_entries:
+            return
+        # 上限ちょうどで止めると次の書き込みでまた集計することになるため、少し余裕を空ける
+        removed = count - int(self.max_entries * self.evict_ratio)
+        self._conn.execute(
+            "DELETE FROM review_cache WHERE rowid IN ("
+            "SELECT rowid FROM review_cache ORDER BY last_access ASC LIMIT ?)",
+            (removed,),
+        )
+        self._approx_entries = count - removed
+
+    def invalidate_knowledge(self, knowledge_id: str):
+        """ナレッジの更新・削除時に、そのナレッジの審査結果をすべて消す"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM review_cache WHERE knowledge_id = ?", (knowledge_id,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM review_cache")
+            self._conn.commit()
+            self._writes_since_evict = 0
+            self._approx_entries = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM review_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": count,
+        }
+
+
+def review_cache_enabled() -> bool:
+    from azure_.llm_cache import llm_cache_enabled
+
+    load_dotenv()
+    return llm_cache_enabled() and os.getenv(
+        "REVIEW_CACHE_DISABLED", ""
+    ).lower() not in ("1", "true", "yes")
+
+
+@st.cache_resource
+def get_review_cache() -> ReviewResultCache:
+    """プロセス共有の審査結果キャッシュを返す"""
+    load_dotenv()
+    return ReviewResultCache(
+        path=os.getenv(
+            "REVIEW_CACHE_PATH", os.path.join(".cache", "review_cache.sqlite3")
+        ),
+        max_entries=int(os.getenv("REVIEW_CACHE_MAX_ENTRIES", "1000000")),
+    )
+
+
+def invalidate_knowledge_reviews(knowledge_id: str):
+    """ナレッジ保存・削除時のフック（キャッシュが使えない場合は何もしない）"""
+    try:
+        get_review_cache().invalidate_knowledge(knowledge_id)
+    except Exception as e:
+        print(f"審査結果キャッシュの無効化に失敗しました: {e}")
+
+
+def review_key(clause_text: str, knowledge_id: str, version: str) -> Key:
+    return (clause_hash(clause_text), knowledge_id, version)
+
+
+def cached_reviews(scope: str, keys: List[Key]) -> Dict[Key, Result]:
+    """審査済みの組を返す（参照に失敗した場合は空）"""
+    if not keys:
+        return {}
+    try:
+        return get_review_cache().get_many(scope, keys)
+    except Exception as e:
+        print(f"審査結果キャッシュを参照できないため全件を審査します: {e}")
+        return {}
+
+
+def record_reviews(scope: str, results: Dict[Key, Result]):
+    """審査結果をキャッシュに書く（失敗しても審査は続ける）"""
+    try:
+        get_review_cache().put_many(scope, results)
+    except Exception as e:
+        print(f"審査結果キャッシュへの書き込みに失敗しました: {e}")
+
+
+def split_pack_results(
+    items: List[Dict[str, Any]], knowledge_of: Dict[str, List[str]]
+) -> Dict[Tuple[str, str], Result]:
+    """
+    1回の審査の結果を {(clause_number, knowledge_id): (concern, amendment_clause, knowledge_group)}
+    に分ける。knowledge_of は条項番号 -> その条項を審査したナレッジ。
+    根拠の knowledge_ids が1件ならそのナレッジ単独の結果、2件以上なら根拠のナレッジの組の結果とする。
+    根拠なしで懸念を挙げた場合は審査したナレッジ全体の組の結果とする。
+    根拠に挙がらなかったナレッジは、その条項をナレッジ1件だけで審査した場合と、条項に懸念・修正条文・
+    根拠がひとつもない場合に限って懸念なしとし、他のナレッジの指摘だけが返った場合は
+    （見落としと区別できないため）含めない。
+    審査していないナレッジを根拠に挙げた条項は除く。
+    """
+    results: Dict[Tuple[str, str], Result] = {}
+    for item in items:
+        num = str(item.get("clause_number", ""))
+        kids = knowledge_of.get(num)
+        if not kids:
+            continue
+        cited = sorted({str(k) for k in item.get("knowledge_ids") or []})
+        concern = item.get("concern") or None
+        amendment = item.get("amendment_clause") or None
+        if not set(cited) <= set(kids):
+            continue
+        if not cited and (concern or amendment):
+            cited = sorted(set(kids))
+        group = tuple(cited) if len(cited) > 1 else ()
+        for kid in kids:
+            if kid in cited:
+                results[(num, kid)] = (concern, amendment, group)
+            elif len(kids) == 1 or not (cited or concern or amendment):
+                results[(num, kid)] = (None, None, ())
+    return results
+
+
+def assemble_cached_results(hits: Dict[str, Result]) -> Dict[Tuple[str, ...], Result]:
+    """
+    1条項分のヒット {knowledge_id: 結果} から、使える結果を {ナレッジの組: 結果} で返す。
+    組の結果は、組のナレッジがすべて同じ結果でヒットした場合だけ使う。
+    """
+    usable: Dict[Tuple[str, ...], Result] = {}
+    for kid, result in hits.items():
+        group = result[2]
+        if not group:
+            usable[(kid,)] = result
+        elif all(hits.get(k) == result for k in group):
+            usable[group] = result
+    return usable
@@ -0,0 +1,148 @@
+import os
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+# =========================
+# 審査呼び出しのまとめ方（条項を軸にナレッジを詰める）
+# =========================
+# ナレッジ1件ごとに審査を呼ぶと、同じ条項に複数のナレッジが割り当てられている場合に
+# 同じ条文が何度も送られ、さらに条項ごとに指摘をまとめる要約呼び出しが必要になる。
+# 割当条項の集合が同じ・重なりの大きいナレッジを1回の審査にまとめ（パック）、
+# 条項ごとに複数ナレッジの観点を統合した結果を返させる。
+# 条項の結果が複数のパックにまたがる場合だけ要約が必要になる。
+# 条項集合が異なるナレッジをまとめたパックでは、各ナレッジに適用条項
+# （applies_to_clause_numbers）を付けて、その条項にだけ適用させる。
+# REVIEW_PACK_TOKENS        : 1パックに載せる条項・ナレッジの推定トークン数の上限
+# REVIEW_PACK_MAX_KNOWLEDGE : 1パックに載せるナレッジの上限（0 で上限なし）
+# REVIEW_PACK_MIN_OVERLAP   : 条項集合の重なり（Jaccard）がこれ以上のナレッジだけを同じパックにする
+# REVIEW_PACK_MIN_FILL      : 割当がまだ届く途中では、推定トークン数がこの割合（REVIEW_PACK_TOKENS 比）
+#                             以上になったパック（またはナレッジ数が上限のパック）だけを先に審査する
+# REVIEW_PACKING_DISABLED   : 1 でナレッジごとに審査する（従来どおり）
+DEFAULT_PACK_TOKENS = 6000
+DEFAULT_PACK_MAX_KNOWLEDGE = 8
+DEFAULT_PACK_MIN_OVERLAP = 0.5
+DEFAULT_PACK_MIN_FILL = 0.8
+
+
+def packing_settings() -> Dict[str, Any]:
+    """環境変数からパックの設定を読む"""
+    load_dotenv()
+    return {
+        "enabled": os.getenv("REVIEW_PACKING_DISABLED", "").lower()
+        not in ("1", "true", "yes"),
+        "tokens": int(os.getenv("REVIEW_PACK_TOKENS", str(DEFAULT_PACK_TOKENS))),
+        "max_knowledge": int(
+            os.getenv("REVIEW_PACK_MAX_KNOWLEDGE", str(DEFAULT_PACK_MAX_KNOWLEDGE))
+        ),
+        "min_overlap": float(
+            os.getenv("REVIEW_PACK_MIN_OVERLAP", str(DEFAULT_PACK_MIN_OVERLAP))
+        ),
+        "min_fill": float(
+            os.getenv("REVIEW_PACK_MIN_FILL", str(DEFAULT_PACK_MIN_FILL))
+        ),
+    }
+
+
+def plan_review_packs(
+    assignments: Sequence[Tuple[str, Sequence[int]]],
+    clause_tokens: Callable[[int], int],
+    knowledge_tokens: Callable[[str], int],
+    settings: Dict[str, Any] = None,
+) -> List[Dict[str, Any]]:
+    """
+    ナレッジの割当 [(knowledge_id, 条項の行番号)] を審査呼び出しのパックに分ける。
+      1. 条項集合が同じナレッジを1つのグループにまとめ（初出順）、
+      2. 各グループを、条項集合の重なりが最も大きく、まとめても推定トークン数・ナレッジ数が
+         上限に収まる既存のパックに加える（なければ新しいパックにする）。
+    1グループで上限を超える場合は、同じ条項集合のまま複数のパックに分ける。
+    Returns:
+      [{"knowledge_ids": [...], "rows": [条項の行番号（昇順）], "rows_of": {knowledge_id: [...]},
+        "scoped": 条項集合の異なるナレッジを含むか, "tokens": 推定トークン数}]
+    """
+    settings = settings or packing_settings()
+    if not settings["enabled"]:
+        return [
+            {
+                "knowledge_ids": [kid],
+                "rows": sorted(rows),
+                "rows_of": {kid: sorted(rows)},
+                "scoped": False,
+                "tokens": knowledge_tokens(kid)
+                + sum(clause_tokens(int(i)) for i in set(rows)),
+            }
+            for kid, rows in assignments
+        ]
+    budget = settings["tokens"]
+    max_knowledge = settings["max_knowledge"] or len(assignments)
+
+    groups: Dict[frozenset, List[str]] = {}
+    for kid, rows in assignments:
+        groups.setdefault(frozenset(int(i) for i in rows), []).append(kid)
+
+    packs: List[Dict[str, Any]] = []
+
+    def new_pack() -> Dict[str, Any]:
+        pack = {"knowledge_ids": [], "rows": set(), "rows_of": {}, "tokens": 0}
+        packs.append(pack)
+        return pack
+
+    def add(pack: Dict[str, Any], kid: str, rows: frozenset):
+        pack["tokens"] += knowledge_tokens(kid) + sum(
+            clause_tokens(i) for i in rows - pack["rows"]
+        )
+        pack["knowledge_ids"].append(kid)
+        pack["rows"] |= rows
+        pack["rows_of"][kid] = sorted(rows)
+
+    for rows, kids in groups.items():
+        group_tokens = sum(knowledge_tokens(kid) for kid in kids)
+        best, best_overlap = None, settings["min_overlap"]
+        for pack in packs:
+            union = pack["rows"] | rows
+            overlap = len(pack["rows"] & rows) / len(union) if union else 1.0
+            extra = sum(clause_tokens(i) for i in rows - pack["rows"])
+            if (
+                overlap >= best_overlap
+                and len(pack["knowledge_ids"]) + len(kids) <= max_knowledge
+                and pack["tokens"] + extra + group_tokens <= budget
+            ):
+                best, best_overlap = pack, overlap
+        if best is not None:
+            for kid in kids:
+                add(best, kid, rows)
+            continue
+        # 単独で上限を超えるグループは同じ条項集合のまま分ける
+        pack = new_pack()
+        for kid in kids:
+            if pack["knowledge_ids"] and (
+                len(pack["knowledge_ids"]) >= max_knowledge
+                or pack["tokens"] + knowledge_tokens(kid) > budget
+            ):
+                pack = new_pack()
+            add(pack, kid, rows)
+
+    return [
+        {
+            "knowledge_ids": pack["knowledge_ids"],
+            "rows": sorted(pack["rows"]),
+            "rows_of": pack["rows_of"],
+            "scoped": len({tuple(r) for r in pack["rows_of"].values()}) > 1,
+            "tokens": pack["tokens"],
+        }
+        for pack in packs
+    ]
+
+
+def is_full_pack(pack: Dict[str, Any], settings: Dict[str, Any] = None) -> bool:
+    """
+    plan_review_packs のパックがこれ以上ナレッジを加えても大きくならないか
+    （パックしない設定では常に True）。割当が届く途中で審査を始めてよいかの判定に使う。
+    """
+    settings = settings or packing_settings()
+    if not settings["enabled"]:
+        return True
+    max_knowledge = settings["max_knowledge"]
+    if max_knowledge and len(pack["knowledge_ids"]) >= max_knowledge:
+        return True
+    return pack["tokens"] >= settings["tokens"] * settings["min_fill"]
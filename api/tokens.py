@@ -0,0 +1,27 @@
+import re
+from typing import Dict, List
+
+# ひらがな・カタカナ・漢字・全角記号（おおむね1文字≒1トークン）
+_CJK_RE = re.compile(r"[　-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+
+# チャットメッセージ1件あたりの書式オーバーヘッド
+_MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数を概算する（tiktoken を使わないローカル近似）。
+    日本語は1文字≒1トークン、それ以外は4文字≒1トークンとして数える。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """チャットメッセージ列の入力トークン数を概算する"""
+    return sum(
+        estimate_tokens(m.get("content") or "") + _MESSAGE_OVERHEAD for m in messages
+    )
@@ -0,0 +1,225 @@
+import atexit
+import gzip
+import importlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Union
+
+from dotenv import load_dotenv
+import streamlit as st
+
+# =========================
+# デバッグ用トレースの出力
+# =========================
+# マッチングのトレース（プロンプト・LLM生応答など）を、リクエストの処理中に同期で
+# JSON ファイルへ書き出すのをやめ、サンプリングしたものだけをバックグラウンドのスレッドで
+# gzip 圧縮した JSONL に追記する。レコードの組み立て・JSON への変換も書き込みスレッドで行い、
+# 呼び出し側（非同期マッチングではゲートウェイのループ）ではキューに積むだけにする。ファイルは上限サイズでローテーションし、
+# ディレクトリ全体の上限を超えたら古いファイルから削除する。書き込み待ちが溢れたら捨てる
+# （処理側はディスク I/O を待たない）。ファイル名にプロセス ID を含めるため、
+# 複数のプロセス・セッションが互いの出力を上書きすることもない。
+# TRACE_SINK         : jsonl（既定）| none | <module>:<callable>（独自のシンクを返すファクトリ）
+# TRACE_SAMPLE_RATE  : 書き出す割合（0〜1。既定は 0.05）
+# TRACE_DIR          : 出力先ディレクトリ
+# TRACE_MAX_FILE_MB  : 1ファイルの上限（圧縮前のサイズ。超えたら次のファイルへ）
+# TRACE_MAX_TOTAL_MB : ディレクトリ全体の上限（圧縮後のサイズ）
+# TRACE_QUEUE_SIZE   : 書き込み待ちの上限（件数）
+
+Record = Union[Dict[str, Any], Callable[[], Dict[str, Any]]]
+
+DEFAULT_SAMPLE_RATE = 0.05
+
+
+class TraceSink:
+    """トレースの出力先（基底クラス。何も書かない）"""
+
+    def emit(self, name: str, record: Record) -> bool:
+        """
+        トレース1件を出力する。record は dict か、dict を返す関数
+        （サンプリングで捨てる場合に組み立てを省くため）。書き出し対象になれば True。
+        record は書き込み時に組み立て・変換されることがあるため、emit した後に変更しないこと。
+        """
+        return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """書き込み待ちがなくなるまで待つ（テスト・ベンチマーク用）"""
+        return True
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class JsonlTraceSink(TraceSink):
+    """サンプリング・非同期書き込み・ローテーション付きの gzip JSONL 出力"""
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: float = DEFAULT_SAMPLE_RATE,
+        max_file_bytes: int = 20 * 1024 * 1024,
+        max_total_bytes: int = 200 * 1024 * 1024,
+        queue_size: int = 256,
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._counts = {"emitted": 0, "sampled_out": 0, "dropped": 0, "written": 0}
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_bytes = 0
+        self._seq = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="trace-sink", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, name: str, record: Record) -> bool:
+        if self._closed or random.random() >= self.sample_rate:
+            self._count("sampled_out")
+            return False
+        # 組み立て・JSON への変換は書き込みスレッドで行う（呼び出し側のループを止めない）
+        try:
+            self._queue.put_nowait((name, uuid.uuid4().hex, time.time(), record))
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("emitted")
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counts, "pending": self._queue.qsize()}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                self._write(self._serialize(*item))
+            except Exception as e:
+                print(f"トレースの書き込みに失敗しました: {e}")
+            finally:
+                self._queue.task_done()
+        if self._file is not None:
+            self._file.close()
+
+    @staticmethod
+    def _serialize(name: str, run_id: str, timestamp: float, record: Record) -> bytes:
+        if callable(record):
+            record = record()
+        line = json.dumps(
+            {"name": name, "run_id": run_id, "timestamp": timestamp, **record},
+            ensure_ascii=False,
+            default=str,
+        )
+        return line.encode("utf-8") + b"\n"
+
+    def _write(self, line: bytes):
+        if self._file is None or self._file_bytes + len(line) > self.max_file_bytes:
+            self._rotate()
+        self._file.write(line)
+        # 異常終了しても直近の行までは読めるよう、1件ごとに圧縮ブロックを区切る
+        self._file.flush()
+        self._file_bytes += len(line)
+        self._count("written")
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._seq += 1
+        name = f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq:04d}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), "ab")
+        self._file_bytes = 0
+        self._enforce_total_size()
+
+    def _enforce_total_size(self):
+        """ディレクトリ全体の上限を超えた分を、更新時刻の古いファイルから削除する"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("trace-") and entry.name.endswith(".jsonl.gz"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        current = getattr(self._file, "name", None)
+        for _, size, path in sorted(files):
+            if total <= self.max_total_bytes:
+                break
+            if path == current:
+                continue
+            os.remove(path)
+            total -= size
+
+
+def dedupe_message_contents(trace: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    トレースのプロンプトで繰り返されるメッセージ本文（システムプロンプトなど）を
+    trace["contents"] に一度だけ置き、各メッセージは {"role", "ref": 番号} で参照する。
+    元の trace は変更しない。
+    """
+    contents: Dict[str, int] = {}
+    prompts = []
+    for prompt in trace.get("prompts", []):
+        messages = []
+        for m in prompt.get("messages", []):
+            ref = contents.setdefault(m.get("content") or "", len(contents))
+            messages.append({"role": m.get("role"), "ref": ref})
+        prompts.append({**prompt, "messages": messages})
+    return {**trace, "prompts": prompts, "contents": list(contents)}
+
+
+def _load_factory(spec: str) -> Callable[[], TraceSink]:
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+@st.cache_resource
+def get_trace_sink() -> TraceSink:
+    """プロセス共有のトレース出力先を返す"""
+    load_dotenv()
+    kind = os.getenv("TRACE_SINK", "jsonl")
+    if kind == "none":
+        return TraceSink()
+    if kind != "jsonl":
+        return _load_factory(kind)()
+    return JsonlTraceSink(
+        directory=os.getenv("TRACE_DIR", os.path.join(".cache", "traces")),
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", str(DEFAULT_SAMPLE_RATE))),
+        max_file_bytes=int(float(os.getenv("TRACE_MAX_FILE_MB", "20")) * 1024 * 1024),
+        max_total_bytes=int(
+            float(os.getenv("TRACE_MAX_TOTAL_MB", "200")) * 1024 * 1024
+        ),
+        queue_size=int(os.getenv("TRACE_QUEUE_SIZE", "256")),
+    )
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+import numpy as np
+import streamlit as st
+
+
+def make_cache_key(params: Dict[str, Any], messages: List[Dict[str, str]]) -> str:
+    """モデル名・パラメータ・メッセージから内容アドレスのキー（SHA-256）を作る"""
+    payload = json.dumps(
+        {"params": params, "messages": messages},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite に永続化するLLM応答キャッシュ。
+    件数・合計サイズ・TTL の上限を超えたものは最終アクセスが古い順（LRU）に削除する。
+    上限の確認（全件の集計）は書き込みごとには行わず、evict_interval 件ごとか、
+    見積もりの件数・サイズが上限を超えた時点で行い、上限の evict_ratio まで減らす。
+    複数スレッド（Streamlitセッション、ゲートウェイ）から共有するため内部でロックする。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 20000,
+        max_bytes: int = 200 * 1024 * 1024,
+        ttl_seconds: float = 30 * 24 * 3600,
+        evict_interval: int = 200,
+        evict_ratio: float = 0.9,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = max(evict_interval, 1)
+        self.evict_ratio = evict_ratio
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)"
+        )
+        self._conn.commit()
+        # 前回の集計からの書き込み件数と、件数・合計サイズの見積もり（置き換えも加算するため多めになる）
+        self._puts_since_evict = 0
+        self._approx_entries, self._approx_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        if response is None:
+            return
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self._puts_since_evict += 1
+            self._approx_entries += 1
+            self._approx_bytes += size
+            if (
+                self._puts_since_evict >= self.evict_interval
+                or self._approx_entries > self.max_entries
+                or self._approx_bytes > self.max_bytes
+            ):
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """
+        TTL切れを削除し、件数・サイズ上限を超えていれば上限の evict_ratio まで
+        LRUで削除する（ロック内で呼ぶ）
+        """
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+        self._puts_since_evict = 0
+        self._approx_entries, self._approx_bytes = count, total
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 上限ちょうどで止めると次の書き込みでまた集計することになるため、少し余裕を空ける
+        max_entries = int(self.max_entries * self.evict_ratio)
+        max_bytes = int(self.max_bytes * self.evict_ratio)
+        removed = 0
+        rows = self._conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY last_access ASC"
+        ).fetchall()
+        doomed = []
+        for key, size in rows:
+            if count - removed <= max_entries and total <= max_bytes:
+                break
+            doomed.append((key,))
+            removed += 1
+            total -= size
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+        self._approx_entries, self._approx_bytes = count - removed, total
+
+    def delete(self, key: str):
+        """下流でパースできなかった応答などを消す"""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self._approx_entries, self._approx_bytes = 0, 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+def make_embedding_key(model: str, text: str) -> str:
+    """埋め込みキャッシュのキー（モデル名＋テキストの SHA-256）"""
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    テキストハッシュ -> float32 ベクトルの永続キャッシュ（SQLite）。
+    定型条項など同一テキストを再度埋め込まないために使う。
+    件数上限を超えたものは最終アクセスが古い順に削除する。
+    上限の確認（全件の集計）は書き込みごとには行わず、evict_interval 件を書くごとか、
+    見積もりの件数が上限を超えた時点で行い、上限の evict_ratio まで減らす。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 200000,
+        evict_interval: int = 2000,
+        evict_ratio: float = 0.9,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_interval = max(evict_interval, 1)
+        self.evict_ratio = evict_ratio
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache(last_access)"
+        )
+        self._conn.commit()
+        # 書き込みごとに COUNT しないよう、件数は見積もりで追う（置き換えも1件と数えるので多めになる）
+        self._writes_since_evict = 0
+        (self._approx_entries,) = self._conn.execute(
+            "SELECT COUNT(*) FROM embedding_cache"
+        ).fetchone()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """キャッシュ済みのものだけ {key: vector} で返す"""
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            # SQLite のプレースホルダ上限を避けて分割
+            for i in range(0, len(unique), 500):
+                part = unique[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_access = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?)",
+                [
+                    (key, model, np.asarray(vec, dtype=np.float32).tobytes(), now)
+                    for key, vec in items.items()
+                ],
+            )
+            self._writes_since_evict += len(items)
+            self._approx_entries += len(items)
+            if (
+                self._writes_since_evict >= self.evict_interval
+                or self._approx_entries > self.max_entries
+            ):
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """件数が上限を超えていれば上限の evict_ratio まで最終アクセスの古い順に削除する（ロック内で呼ぶ）"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()
+        self._writes_since_evict = 0
+        self._approx_entries = count
+        if count <= self.max_entries:
+            return
+        # 上限ちょうどで止めると次の書き込みでまた集計することになるため、少し余裕を空ける
+        removed = count - int(self.max_entries * self.evict_ratio)
+        self._conn.execute(
+            "DELETE FROM embedding_cache WHERE key IN ("
+            "SELECT key FROM embedding_cache ORDER BY last_access ASC LIMIT ?)",
+            (removed,),
+        )
+        self._approx_entries = count - removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embedding_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": count,
+        }
+
+
+def llm_cache_enabled() -> bool:
+    """環境変数 LLM_CACHE_DISABLED=1 でキャッシュ全体をバイパスする"""
+    load_dotenv()
+    return os.getenv("LLM_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+
+
+@st.cache_resource
+def get_llm_cache() -> LLMResponseCache:
+    """プロセス共有のLLM応答キャッシュを返す"""
+    load_dotenv()
+    return LLMResponseCache(
+        path=os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite3")),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000")),
+        max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024),
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_DAYS", "30")) * 24 * 3600,
+    )
+
+
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    """プロセス共有の埋め込みキャッシュを返す"""
+    load_dotenv()
+    return EmbeddingCache(
+        path=os.getenv(
+            "EMBEDDING_CACHE_PATH", os.path.join(".cache", "embedding_cache.sqlite3")
+        ),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+    )
@@ -0,0 +1,248 @@
+import json
+import os
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+# =========================
+# モデル定義
+# =========================
+# deployment          : Azure 上のデプロイ名（LLM_DEPLOYMENTS で上書き可）
+# params              : chat.completions.create に渡す固定パラメータ
+# context_window      : 入力＋出力の最大トークン数
+# max_output_tokens   : 出力トークンの上限
+# price_per_1m_input  : 入力100万トークンあたりの価格（USD）
+# price_per_1m_output : 出力100万トークンあたりの価格（USD）
+# structured_output   : response_format の json_schema（Structured Outputs）に対応するか
+MODEL_REGISTRY: Dict[str, Dict[str, Any]] = {
+    "o1": {
+        "deployment": "o1",
+        "structured_output": True,
+        "params": {},
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "price_per_1m_input": 15.00,
+        "price_per_1m_output": 60.00,
+    },
+    "o1-mini": {
+        "deployment": "o1-mini",
+        "structured_output": False,
+        "params": {},
+        "context_window": 128000,
+        "max_output_tokens": 65536,
+        "price_per_1m_input": 1.10,
+        "price_per_1m_output": 4.40,
+    },
+    "o3-mini": {
+        "deployment": "o3-mini",
+        "structured_output": True,
+        "params": {},
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "price_per_1m_input": 1.10,
+        "price_per_1m_output": 4.40,
+    },
+    "o3": {
+        "deployment": "o3",
+        "structured_output": True,
+        "params": {},
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "price_per_1m_input": 2.00,
+        "price_per_1m_output": 8.00,
+    },
+    "o4-mini": {
+        "deployment": "o4-mini",
+        "structured_output": True,
+        "params": {"frequency_penalty": 0.0, "presence_penalty": 0.0},
+        "context_window": 200000,
+        "max_output_tokens": 100000,
+        "price_per_1m_input": 1.10,
+        "price_per_1m_output": 4.40,
+    },
+    "gpt-4.1": {
+        "deployment": "gpt-4.1",
+        "structured_output": True,
+        "params": {
+            "temperature": 0.0,
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+        },
+        "context_window": 1047576,
+        "max_output_tokens": 32768,
+        "price_per_1m_input": 2.00,
+        "price_per_1m_output": 8.00,
+    },
+    "gpt-4.1-mini": {
+        "deployment": "gpt-4.1-mini",
+        "structured_output": True,
+        "params": {
+            "temperature": 0.0,
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+        },
+        "context_window": 1047576,
+        "max_output_tokens": 32768,
+        "price_per_1m_input": 0.40,
+        "price_per_1m_output": 1.60,
+    },
+    "gpt-4.1-nano": {
+        "deployment": "gpt-4.1-nano",
+        "structured_output": True,
+        "params": {
+            "temperature": 0.0,
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+        },
+        "context_window": 1047576,
+        "max_output_tokens": 32768,
+        "price_per_1m_input": 0.10,
+        "price_per_1m_output": 0.40,
+    },
+    "gpt-5": {
+        "deployment": "gpt-5",
+        "structured_output": True,
+        "params": {
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+            "reasoning_effort": "minimal",  # 応答にどれだけ「深く考えるか」を制御: ["minimal", "low", "medium", "high"]
+            "verbosity": "low",  # 応答の長さを制御: ["low", "medium", "high"]
+        },
+        "context_window": 400000,
+        "max_output_tokens": 128000,
+        "price_per_1m_input": 1.25,
+        "price_per_1m_output": 10.00,
+    },
+    "gpt-5-mini": {
+        "deployment": "gpt-5-mini",
+        "structured_output": True,
+        "params": {
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+            "reasoning_effort": "minimal",
+            "verbosity": "low",
+        },
+        "context_window": 400000,
+        "max_output_tokens": 128000,
+        "price_per_1m_input": 0.25,
+        "price_per_1m_output": 2.00,
+    },
+    "gpt-5-nano": {
+        "deployment": "gpt-5-nano",
+        "structured_output": True,
+        "params": {
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+            "reasoning_effort": "minimal",
+            "verbosity": "low",
+        },
+        "context_window": 400000,
+        "max_output_tokens": 128000,
+        "price_per_1m_input": 0.05,
+        "price_per_1m_output": 0.40,
+    },
+    "gpt-5-chat": {
+        "deployment": "gpt-5-chat",
+        "structured_output": False,
+        "params": {"temperature": 0.0},
+        "context_window": 128000,
+        "max_output_tokens": 16384,
+        "price_per_1m_input": 1.25,
+        "price_per_1m_output": 10.00,
+    },
+}
+
+# =========================
+# パイプライン段階 -> モデル
+# =========================
+# LLM_STAGE_MODELS='{"summary": "gpt-4.1-mini"}' または LLM_MODEL_SUMMARY=gpt-4.1-mini で上書き
+# 上書き（LLM_DEPLOYMENTS を含む）は毎リクエストで読み直さないよう、最初の参照時に1回だけ読む。
+# 環境変数を変えた後に反映させるには reset_model_overrides() を呼ぶ。
+STAGES: List[str] = [
+    "matching",
+    "review",
+    "summary",
+    "summary_batch",
+    "json_repair",
+    "clause_merge",
+]
+DEFAULT_MODEL = "gpt-4.1"
+DEFAULT_STAGE_MODELS: Dict[str, str] = {
+    "matching": "gpt-4.1",
+    "review": "gpt-4.1",
+    "summary": "gpt-4.1",
+    "summary_batch": "gpt-4.1",
+    "json_repair": "gpt-4.1-mini",
+    "clause_merge": "gpt-4.1",
+}
+
+
+def _env_json(name: str) -> Dict[str, str]:
+    load_dotenv()
+    raw = os.getenv(name)
+    return json.loads(raw) if raw else {}
+
+
+@lru_cache(maxsize=None)
+def _model_overrides() -> Dict[str, Dict[str, str]]:
+    """環境変数によるデプロイ名・段階ごとのモデルの上書き（LLM_MODEL_<段階> が優先）"""
+    stage_models = _env_json("LLM_STAGE_MODELS")
+    for stage in STAGES:
+        model = os.getenv(f"LLM_MODEL_{stage.upper()}")
+        if model:
+            stage_models[stage] = model
+    return {
+        "deployments": _env_json("LLM_DEPLOYMENTS"),
+        "stage_models": stage_models,
+    }
+
+
+def reset_model_overrides():
+    """環境変数の上書きを次の参照時に読み直させる（テスト・ベンチマークで環境変数を変えた後に呼ぶ）"""
+    _model_overrides.cache_clear()
+
+
+def get_model_spec(model: str) -> Dict[str, Any]:
+    """モデル定義を返す（デプロイ名は LLM_DEPLOYMENTS の上書きを反映）"""
+    if model not in MODEL_REGISTRY:
+        raise ValueError(f"未登録のモデルです: {model}")
+    spec = dict(MODEL_REGISTRY[model])
+    spec["deployment"] = _model_overrides()["deployments"].get(
+        model, spec["deployment"]
+    )
+    return spec
+
+
+def resolve_stage_model(stage: str = None) -> str:
+    """パイプライン段階に割り当てられたモデル名を返す（未指定時は既定モデル）"""
+    if stage is None:
+        return DEFAULT_MODEL
+    if stage not in DEFAULT_STAGE_MODELS:
+        raise ValueError(f"未定義のパイプライン段階です: {stage}")
+    model = _model_overrides()["stage_models"].get(stage) or DEFAULT_STAGE_MODELS[stage]
+    get_model_spec(model)
+    return model
+
+
+def build_chat_params(
+    model: str, response_format: Dict[str, Any] = None
+) -> Dict[str, Any]:
+    """
+    chat.completions.create に渡すパラメータ（model にはデプロイ名を入れる）。
+    response_format は構造化出力に対応するモデルの場合のみ付与する。
+    """
+    spec = get_model_spec(model)
+    params = {**spec["params"], "model": spec["deployment"]}
+    if response_format is not None and spec["structured_output"]:
+        params["response_format"] = response_format
+    return params
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """トークン数から概算コスト（USD）を計算する"""
+    spec = get_model_spec(model)
+    return (
+        input_tokens * spec["price_per_1m_input"]
+        + output_tokens * spec["price_per_1m_output"]
+    ) / 1_000_000
@@ -1,10 +1,24 @@
 # pip install openai
 # pip install python-dotenv
 
+import asyncio
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 import os
 import streamlit as st
+from azure_.llm_cache import (
+    get_embedding_cache,
+    get_llm_cache,
+    llm_cache_enabled,
+    make_cache_key,
+    make_embedding_key,
+)
+from azure_.model_registry import build_chat_params, resolve_stage_model
+from azure_.response_schemas import (
+    is_valid_structured_response,
+    response_format_for_stage,
+    schema_name_of,
+)
 
 
 @st.cache_resource
@@ -18,162 +32,408 @@ def get_openai_client():
     )
 
 
-class AzureOpenAIService:
+def get_async_openai_client():
+    """非同期OpenAIクライアントを生成して返す
+
+    AsyncAzureOpenAI は内部の接続プールがイベントループに紐づくため、
+    st.cache_resource でプロセス共有せず、呼び出し側でループごとに保持すること。
+    再試行は呼び出し側（api.llm_gateway）が 429 を観測して制御するため、SDK 側では行わない。
+    """
+    load_dotenv()
+    return AsyncAzureOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        api_version=os.getenv("OPENAI_API_VERSION"),
+        azure_endpoint=os.getenv("OPENAI_API_BASE"),
+        max_retries=0,
+    )
+
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# embeddings API の1リクエストあたりの上限（入力件数・合計トークン）
+EMBEDDING_MAX_INPUTS = 2048
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 300000
+
+
+def plan_embedding_batches(texts):
+    """
+    埋め込み対象をAPI上限内のバッチ（インデックスのリスト）に分ける。
+    トークン数は文字数で上から見積もる（日本語は1文字≒1トークン、英語はそれ以下）。
+    """
+    batches = []
+    current = []
+    tokens = 0
+    for i, text in enumerate(texts):
+        cost = max(1, len(text))
+        if current and (
+            len(current) >= EMBEDDING_MAX_INPUTS
+            or tokens + cost > EMBEDDING_MAX_TOKENS_PER_REQUEST
+        ):
+            batches.append(current)
+            current = []
+            tokens = 0
+        current.append(i)
+        tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+class _ResponseCacheMixin:
+    """
+    get_openai_response_* の前段に置く永続応答キャッシュと、
+    埋め込みのテキストハッシュ -> ベクトルキャッシュ（同期・非同期サービス共通）
+    """
+
+    def _init_cache(self, use_cache):
+        if use_cache is None:
+            use_cache = llm_cache_enabled()
+        self.cache = get_llm_cache() if use_cache else None
+        self.embedding_cache = get_embedding_cache() if use_cache else None
+
+    def _lookup_embeddings(self, docs):
+        """キャッシュ済みベクトルを埋めたリストと、未取得テキストのユニーク一覧を返す"""
+        # 空文字はAPIがエラーにするため空白1文字として扱う
+        texts = [d if d else " " for d in docs]
+        keys = [make_embedding_key(EMBEDDING_MODEL, t) for t in texts]
+        found = self.embedding_cache.get_many(keys) if self.embedding_cache else {}
+        vectors = [found[k].tolist() if k in found else None for k in keys]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        return texts, vectors, missing
+
+    def _fill_embeddings(self, texts, vectors, fetched):
+        """API から取得した {text: vector} をキャッシュに格納し、結果リストを埋める"""
+        if self.embedding_cache is not None and fetched:
+            self.embedding_cache.put_many(
+                EMBEDDING_MODEL,
+                {make_embedding_key(EMBEDDING_MODEL, t): v for t, v in fetched.items()},
+            )
+        return [v if v is not None else fetched[t] for t, v in zip(texts, vectors)]
+
+    def get_cached_response(self, model, messages, response_format=None):
+        """キャッシュ済みの応答を返す（未キャッシュ・バイパス時は None）"""
+        if self.cache is None:
+            return None
+        return self.cache.get(
+            make_cache_key(build_chat_params(model, response_format), messages)
+        )
+
+    def _store_response(
+        self, model, messages, answer, finish_reason, response_format=None
+    ):
+        """
+        最後まで生成された応答（finish_reason == "stop"）のうち、構造化出力の段階では
+        スキーマの形にパースできるものだけを格納する
+        （出力上限での打ち切りや壊れたJSONを TTL の間ずっと返し続けないため）
+        """
+        if self.cache is None or finish_reason != "stop":
+            return
+        schema_name = schema_name_of(response_format)
+        if schema_name and not is_valid_structured_response(answer, schema_name):
+            return
+        self.cache.put(
+            make_cache_key(build_chat_params(model, response_format), messages),
+            model,
+            answer,
+        )
+
+    def forget_cached_response(self, model, messages, response_format=None):
+        """下流でパースできなかった応答をキャッシュから消す（次の呼び出しで取り直す）"""
+        if self.cache is not None:
+            self.cache.delete(
+                make_cache_key(build_chat_params(model, response_format), messages)
+            )
+
+
+class AzureOpenAIService(_ResponseCacheMixin):
     """
     Azure OpenAI サービスへの接続・応答取得を管理するクラス。
     通常用とSwedenCentral用の2種類のクライアントを内部で保持。
+    モデルのパラメータ・デプロイ名は azure_.model_registry で管理し、
+    get_openai_response_* は chat() の薄いラッパーとして残している。
+    use_cache=False で応答キャッシュをバイパスする（未指定時は LLM_CACHE_DISABLED に従う）。
     """
 
-    def __init__(self):
+    def __init__(self, use_cache=None):
         self.client = get_openai_client()
+        self._init_cache(use_cache)
 
     def get_emb_3_small(self, doc):
-        response = (
-            self.client.embeddings.create(input=doc, model="text-embedding-3-small")
-            .data[0]
-            .embedding
-        )
-        return response
+        return self.get_emb_3_small_batch([doc])[0]
 
-    def get_openai_response_o1(self, messages):
+    def get_emb_3_small_batch(self, docs):
+        """
+        複数テキストをまとめて埋め込む。キャッシュ済みのものはAPIに送らず、
+        残りを API 上限内のバッチで送信する。入力と同じ順序でベクトルのリストを返す。
+        """
+        texts, vectors, missing = self._lookup_embeddings(docs)
+        fetched = {}
+        for batch in plan_embedding_batches(missing):
+            inputs = [missing[i] for i in batch]
+            response = self.client.embeddings.create(
+                input=inputs, model=EMBEDDING_MODEL
+            )
+            for item in response.data:
+                fetched[inputs[item.index]] = item.embedding
+        return self._fill_embeddings(texts, vectors, fetched)
+
+    def chat(self, model, messages, response_format=None):
+        """モデル名を指定してチャット応答を取得する（応答キャッシュ経由）"""
+        cached = self.get_cached_response(model, messages, response_format)
+        if cached is not None:
+            return cached
         response = self.client.chat.completions.create(
-            model="o1",
-            messages=messages,
+            messages=messages, **build_chat_params(model, response_format)
+        )
+        choice = response.choices[0]
+        answer = choice.message.content
+        self._store_response(
+            model, messages, answer, choice.finish_reason, response_format
         )
-        answer = response.choices[0].message.content
         return answer
 
-    def get_openai_response_o1_mini(self, messages):
-        response = self.client.chat.completions.create(
-            model="o1-mini",
-            messages=messages,
+    def complete(self, stage, messages):
+        """
+        パイプライン段階（matching / review / summary / summary_batch / json_repair / clause_merge）を指定して
+        チャット応答を取得する。使用モデルは azure_.model_registry の設定で決まる。
+        段階にスキーマがあり、モデルが対応していれば構造化出力（json_schema）で応答させる。
+        応答のパースは azure_.response_schemas.parse_structured_response を使う。
+        """
+        return self.chat(
+            resolve_stage_model(stage), messages, response_format_for_stage(stage)
         )
-        answer = response.choices[0].message.content
-        return answer
 
-    def get_openai_response_o3_mini(self, messages):
-        response = self.client.chat.completions.create(
-            model="o3-mini",
-            messages=messages,
+    def stream_chat(self, model, messages, response_format=None):
+        """
+        chat() のストリーミング版。応答テキストの断片を順に yield する。
+        キャッシュヒット時は全文を1回で返し、ストリーム完了後に全文をキャッシュへ格納する。
+        """
+        cached = self.get_cached_response(model, messages, response_format)
+        if cached is not None:
+            yield cached
+            return
+        stream = self.client.chat.completions.create(
+            messages=messages, stream=True, **build_chat_params(model, response_format)
+        )
+        parts = []
+        finish_reason = None
+        for chunk in stream:
+            # Azure はコンテンツフィルタ結果のみのチャンク（choices が空）を送ることがある
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        self._store_response(
+            model, messages, "".join(parts), finish_reason, response_format
         )
-        answer = response.choices[0].message.content
-        return answer
 
-    def get_openai_response_o3(self, messages):
-        response = self.client.chat.completions.create(
-            model="o3",
-            messages=messages,
+    def stream_complete(self, stage, messages):
+        """complete() のストリーミング版"""
+        yield from self.stream_chat(
+            resolve_stage_model(stage), messages, response_format_for_stage(stage)
         )
-        answer = response.choices[0].message.content
-        return answer
+
+    def get_openai_response_o1(self, messages):
+        return self.chat("o1", messages)
+
+    def get_openai_response_o1_mini(self, messages):
+        return self.chat("o1-mini", messages)
+
+    def get_openai_response_o3_mini(self, messages):
+        return self.chat("o3-mini", messages)
+
+    def get_openai_response_o3(self, messages):
+        return self.chat("o3", messages)
 
     def get_openai_response_o4_mini(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="o4-mini",
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("o4-mini", messages)
 
     def get_openai_response_gpt41(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            temperature=0.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="gpt-4.1",
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("gpt-4.1", messages)
 
     def get_openai_response_gpt41mini(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            temperature=0.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="gpt-4.1-mini",
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("gpt-4.1-mini", messages)
 
     def get_openai_response_gpt41nano(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            temperature=0.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="gpt-4.1-nano",
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("gpt-4.1-nano", messages)
 
     def get_openai_response_gpt5(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="gpt-5",
-            reasoning_effort="minimal",  # 応答にどれだけ「深く考えるか」を制御: ["minimal", "low", "medium", "high"]
-            verbosity="low",  # 応答の長さを制御: ["low", "medium", "high"]
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("gpt-5", messages)
 
     def get_openai_response_gpt5_mini(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="gpt-5-mini",
-            reasoning_effort="minimal",  # 応答にどれだけ「深く考えるか」を制御: ["minimal", "low", "medium", "high"]
-            verbosity="low",  # 応答の長さを制御: ["low", "medium", "high"]
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("gpt-5-mini", messages)
 
     def get_openai_response_gpt5_nano(self, messages):
-        response = self.client.chat.completions.create(
-            messages=messages,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model="gpt-5-nano",
-            reasoning_effort="minimal",  # 応答にどれだけ「深く考えるか」を制御: ["minimal", "low", "medium", "high"]
-            verbosity="low",  # 応答の長さを制御: ["low", "medium", "high"]
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.chat("gpt-5-nano", messages)
 
     def get_openai_response_gpt5_chat(self, messages):
-        response = self.client.chat.completions.create(
-            model="gpt-5-chat",
-            messages=messages,
-            temperature=0.0,
+        return self.chat("gpt-5-chat", messages)
+
+
+class AsyncAzureOpenAIService(_ResponseCacheMixin):
+    """
+    AzureOpenAIService の非同期版。各メソッドは await 可能で、
+    呼び出し中にイベントループをブロックしない。応答キャッシュは同期版と共有する。
+    """
+
+    def __init__(self, client=None, use_cache=None):
+        self.client = client or get_async_openai_client()
+        self._init_cache(use_cache)
+
+    async def get_emb_3_small(self, doc):
+        return (await self.get_emb_3_small_batch([doc]))[0]
+
+    async def get_emb_3_small_batch(self, docs, embed_batch=None):
+        """
+        AzureOpenAIService.get_emb_3_small_batch の非同期版（バッチは並列送信）。
+        embed_batch（入力のリスト -> ベクトルのリストを返すコルーチン関数）を渡すと、
+        各バッチをそれで送る（ゲートウェイが予算のもとで送る場合）。
+        埋め込みキャッシュの SQLite の読み書きは別スレッドで行い、イベントループを止めない。
+        """
+        texts, vectors, missing = await asyncio.to_thread(self._lookup_embeddings, docs)
+        batches = [[missing[i] for i in b] for b in plan_embedding_batches(missing)]
+        embed_batch = embed_batch or self.create_embeddings
+        results = await asyncio.gather(*[embed_batch(inputs) for inputs in batches])
+        fetched = {}
+        for inputs, embeddings in zip(batches, results):
+            fetched.update(zip(inputs, embeddings))
+        return await asyncio.to_thread(self._fill_embeddings, texts, vectors, fetched)
+
+    async def create_embeddings(self, inputs):
+        """キャッシュを参照せずに1回の呼び出しで埋め込み、入力と同じ順序でベクトルのリストを返す"""
+        response = await self.client.embeddings.create(
+            input=inputs, model=EMBEDDING_MODEL
+        )
+        vectors = [None] * len(inputs)
+        for item in response.data:
+            vectors[item.index] = item.embedding
+        return vectors
+
+    async def chat(self, model, messages, response_format=None):
+        """モデル名を指定してチャット応答を取得する（応答キャッシュ経由）"""
+        cached = await asyncio.to_thread(
+            self.get_cached_response, model, messages, response_format
+        )
+        if cached is not None:
+            return cached
+        return await self.create_chat(model, messages, response_format)
+
+    async def create_chat(self, model, messages, response_format=None):
+        """
+        キャッシュを参照せずに呼び出し、応答をキャッシュへ格納する
+        （キャッシュの SQLite への書き込みは別スレッドで行い、イベントループを止めない）
+        """
+        response = await self.client.chat.completions.create(
+            messages=messages, **build_chat_params(model, response_format)
+        )
+        choice = response.choices[0]
+        answer = choice.message.content
+        await asyncio.to_thread(
+            self._store_response,
+            model,
+            messages,
+            answer,
+            choice.finish_reason,
+            response_format,
         )
-        answer = response.choices[0].message.content
         return answer
 
+    async def create_chat_stream(self, model, messages, response_format=None):
+        """
+        create_chat のストリーミング版。応答テキストの断片を順に yield し、
+        最後まで受け取ったら全文をキャッシュへ格納する（キャッシュは参照しない）
+        """
+        stream = await self.client.chat.completions.create(
+            messages=messages, stream=True, **build_chat_params(model, response_format)
+        )
+        parts = []
+        finish_reason = None
+        async for chunk in stream:
+            # Azure はコンテンツフィルタ結果のみのチャンク（choices が空）を送ることがある
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        await asyncio.to_thread(
+            self._store_response,
+            model,
+            messages,
+            "".join(parts),
+            finish_reason,
+            response_format,
+        )
+
+    async def complete(self, stage, messages):
+        """AzureOpenAIService.complete の非同期版"""
+        return await self.chat(
+            resolve_stage_model(stage), messages, response_format_for_stage(stage)
+        )
+
+    async def get_openai_response_o1(self, messages):
+        return await self.chat("o1", messages)
+
+    async def get_openai_response_o1_mini(self, messages):
+        return await self.chat("o1-mini", messages)
+
+    async def get_openai_response_o3_mini(self, messages):
+        return await self.chat("o3-mini", messages)
+
+    async def get_openai_response_o3(self, messages):
+        return await self.chat("o3", messages)
+
+    async def get_openai_response_o4_mini(self, messages):
+        return await self.chat("o4-mini", messages)
+
+    async def get_openai_response_gpt41(self, messages):
+        return await self.chat("gpt-4.1", messages)
+
+    async def get_openai_response_gpt41mini(self, messages):
+        return await self.chat("gpt-4.1-mini", messages)
+
+    async def get_openai_response_gpt41nano(self, messages):
+        return await self.chat("gpt-4.1-nano", messages)
+
+    async def get_openai_response_gpt5(self, messages):
+        return await self.chat("gpt-5", messages)
+
+    async def get_openai_response_gpt5_mini(self, messages):
+        return await self.chat("gpt-5-mini", messages)
+
+    async def get_openai_response_gpt5_nano(self, messages):
+        return await self.chat("gpt-5-nano", messages)
+
+    async def get_openai_response_gpt5_chat(self, messages):
+        return await self.chat("gpt-5-chat", messages)
+
 
 def test():
     """
-    テスト用関数。クラスの各関数の接続テストを行う。
+    テスト用関数。登録済みの各モデルと埋め込みの接続テストを行う。
+    実環境のクォータを使わずに確認する場合は benchmarks/fake_openai_server.py を起動し、
+    OPENAI_API_BASE をそのURLに向けて実行する。
     """
-    service = AzureOpenAIService()
+    from azure_.model_registry import MODEL_REGISTRY
+
+    service = AzureOpenAIService(use_cache=False)
     messages = [
         {"role": "user", "content": "こんにちは、今日の天気はどうですか？"},
     ]
-    max_tokens = 1000
+    for model in MODEL_REGISTRY:
+        try:
+            answer = service.chat(model, messages)
+            print(f"[{model}] Response:", answer)
+        except Exception as e:
+            print(f"[{model}] Error:", e)
     try:
-        answer, input_tokens, output_tokens = service.get_openai_response_o3_mini(
-            messages, max_tokens
-        )
-        print("Response:", answer)
-        print("Input Tokens:", input_tokens)
-        print("Output Tokens:", output_tokens)
+        embedding = service.get_emb_3_small(messages[0]["content"])
+        print(f"[{EMBEDDING_MODEL}] Dimensions:", len(embedding))
     except Exception as e:
-        print("Error:", e)
+        print(f"[{EMBEDDING_MODEL}] Error:", e)
 
 
 if __name__ == "__main__":
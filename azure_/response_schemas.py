@@ -0,0 +1,200 @@
+import json
+import re
+from typing import Any, Dict, Optional
+
+# =========================
+# 構造化出力（response_format: json_schema）のスキーマ
+# =========================
+# Structured Outputs はルートがオブジェクトである必要があるため、
+# 配列を返す段階は {"items": [...]} / {"groups": [...]} で包む。
+# strict モードでは全プロパティを required にし、null 許容は型の union で表す。
+
+MATCHING_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "knowledge_id": {"type": "string"},
+                    "clause_number": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["knowledge_id", "clause_number"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["items"],
+    "additionalProperties": False,
+}
+
+REVIEW_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "clause_number": {"type": "string"},
+                    "concern": {"type": ["string", "null"]},
+                    "amendment_clause": {"type": ["string", "null"]},
+                    "knowledge_ids": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": [
+                    "clause_number",
+                    "concern",
+                    "amendment_clause",
+                    "knowledge_ids",
+                ],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["items"],
+    "additionalProperties": False,
+}
+
+SUMMARY_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "concern": {"type": "string"},
+        "amendment_clause": {"type": "string"},
+    },
+    "required": ["concern", "amendment_clause"],
+    "additionalProperties": False,
+}
+
+SUMMARY_BATCH_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "clause_number": {"type": "string"},
+                    "concern": {"type": "string"},
+                    "amendment_clause": {"type": "string"},
+                },
+                "required": ["clause_number", "concern", "amendment_clause"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["items"],
+    "additionalProperties": False,
+}
+
+CLAUSE_MERGE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "groups": {
+            "type": "array",
+            "items": {"type": "array", "items": {"type": "integer"}},
+        }
+    },
+    "required": ["groups"],
+    "additionalProperties": False,
+}
+
+RESPONSE_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "matching": MATCHING_SCHEMA,
+    "review": REVIEW_SCHEMA,
+    "summary": SUMMARY_SCHEMA,
+    "summary_batch": SUMMARY_BATCH_SCHEMA,
+    "clause_merge": CLAUSE_MERGE_SCHEMA,
+}
+
+# パイプライン段階 -> スキーマ名（JSON修復は審査結果の形に直す）
+STAGE_SCHEMAS: Dict[str, str] = {
+    "matching": "matching",
+    "review": "review",
+    "summary": "summary",
+    "summary_batch": "summary_batch",
+    "json_repair": "review",
+    "clause_merge": "clause_merge",
+}
+
+# 配列を包んでいるキー
+_WRAPPER_KEYS = {
+    "matching": "items",
+    "review": "items",
+    "summary_batch": "items",
+    "clause_merge": "groups",
+}
+
+
+def response_format_for(schema_name: str) -> Dict[str, Any]:
+    """chat.completions.create の response_format 引数を返す"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{schema_name}_response",
+            "strict": True,
+            "schema": RESPONSE_SCHEMAS[schema_name],
+        },
+    }
+
+
+def response_format_for_stage(stage: Optional[str]) -> Optional[Dict[str, Any]]:
+    """パイプライン段階に対応する response_format（スキーマがない段階は None）"""
+    schema_name = STAGE_SCHEMAS.get(stage)
+    return response_format_for(schema_name) if schema_name else None
+
+
+def parse_structured_response(raw: str, schema_name: str) -> Any:
+    """
+    構造化出力の応答をパースし、包みを外した値を返す。
+    構造化出力に対応しないモデルの自由形式の応答（素の配列、前後の説明・フェンス付き）も受け付ける。
+    パースできない場合は例外。
+    """
+    wrapper = _WRAPPER_KEYS.get(schema_name)
+    try:
+        parsed = json.loads(raw)
+    except (TypeError, ValueError):
+        # フェンスや前後説明を誤って付けた場合の救済
+        pattern = r"(\[.*\])" if wrapper else r"(\{.*\})"
+        m = re.search(pattern, raw or "", flags=re.DOTALL)
+        if not m:
+            raise
+        parsed = json.loads(m.group(1))
+    if wrapper and isinstance(parsed, dict) and wrapper in parsed:
+        return parsed[wrapper]
+    return parsed
+
+
+def schema_name_of(response_format: Optional[Dict[str, Any]]) -> Optional[str]:
+    """response_format_for が返した response_format のスキーマ名（json_schema でなければ None）"""
+    if not response_format or response_format.get("type") != "json_schema":
+        return None
+    name = response_format["json_schema"]["name"]
+    return name[: -len("_response")] if name.endswith("_response") else name
+
+
+def _conforms(value: Any, schema: Dict[str, Any]) -> bool:
+    """型（object / array）と必須プロパティだけを確かめる（値の型の union までは見ない）"""
+    kind = schema.get("type")
+    if kind == "object":
+        return isinstance(value, dict) and all(
+            key in value for key in schema.get("required", [])
+        )
+    if kind == "array":
+        return isinstance(value, list) and all(
+            _conforms(v, schema.get("items", {})) for v in value
+        )
+    return True
+
+
+def is_valid_structured_response(raw: str, schema_name: str) -> bool:
+    """応答が parse_structured_response でパースでき、スキーマの形（包みを外した値）に合うか"""
+    try:
+        parsed = parse_structured_response(raw, schema_name)
+    except Exception:
+        return False
+    schema = RESPONSE_SCHEMAS[schema_name]
+    wrapper = _WRAPPER_KEYS.get(schema_name)
+    if wrapper:
+        schema = schema["properties"][wrapper]
+    return _conforms(parsed, schema)
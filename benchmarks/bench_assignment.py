@@ -0,0 +1,130 @@
+"""
+条項 × ナレッジの割当行列（api/assignment_matrix.py）のマイクロベンチマーク。
+
+K 件のナレッジ・C 条項の合成マッチング結果について、従来のリストと二重ループによる実装と
+割当行列による実装で次の処理時間を比較し、結果が一致することを確かめる。
+  - _apply_step2: マッチング結果を各条項の knowledge_id リストに付与（重複排除）
+  - 審査の振り分け: ナレッジごとに該当条項と該当ナレッジを抽出
+LLM・外部サービスは使わない。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_assignment --knowledge 5000 --clauses 300
+"""
+
+import argparse
+import random
+import time
+
+from api.assignment_matrix import AssignmentMatrix
+from api.match_cl_and_kn_async import _apply_step2, _dedup
+
+
+def _apply_step2_lists(clauses, response):
+    """従来の _apply_step2（リストへの追記と重複排除）"""
+    idx_by_num = {c["clause_number"]: i for i, c in enumerate(clauses)}
+    for c in clauses:
+        if "knowledge_id" not in c or c["knowledge_id"] is None:
+            c["knowledge_id"] = []
+    for item in response:
+        k_id = item["knowledge_id"]
+        for num in item.get("clause_number", []):
+            i = idx_by_num.get(num)
+            if i is not None:
+                clauses[i]["knowledge_id"].append(k_id)
+    for c in clauses:
+        c["knowledge_id"] = _dedup(c["knowledge_id"])
+    return clauses
+
+
+def _fan_out_lists(clauses, knowledge_all):
+    """従来の審査の振り分け（ナレッジごとに全条項・全ナレッジを走査）"""
+    all_knowledge_ids = set()
+    for c in clauses:
+        all_knowledge_ids.update(c.get("knowledge_id", []))
+    result = {}
+    for kid in all_knowledge_ids:
+        target_clauses = [c for c in clauses if kid in c.get("knowledge_id", [])]
+        target_knowledge = [k for k in knowledge_all if k.get("id") == kid]
+        result[kid] = ([c["clause_number"] for c in target_clauses], target_knowledge)
+    return result
+
+
+def _fan_out_matrix(clauses, knowledge_all):
+    """割当行列による審査の振り分け（examination_api と同じ処理）"""
+    assignment = AssignmentMatrix.from_clauses(clauses)
+    knowledge_by_id = {}
+    for k in knowledge_all:
+        knowledge_by_id.setdefault(k.get("id"), []).append(k)
+    result = {}
+    for kid in assignment.active_knowledge_ids():
+        rows = assignment.clause_rows(kid)
+        result[kid] = (
+            [clauses[i]["clause_number"] for i in rows],
+            knowledge_by_id.get(kid, []),
+        )
+    return result
+
+
+def _timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=5000, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=300, help="条項数")
+    parser.add_argument(
+        "--per-knowledge", type=int, default=6, help="ナレッジあたりの割当条項数の上限"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最良値）")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    clauses = [
+        {"clause_number": str(i + 1), "clause": f"第{i + 1}条"}
+        for i in range(args.clauses)
+    ]
+    knowledge_all = [{"id": f"knowledge-{i:05d}"} for i in range(args.knowledge)]
+    # 重複した条項番号を含む応答（複数タイルの結果を集約した状態を模す）
+    response = [
+        {
+            "knowledge_id": k["id"],
+            "clause_number": [
+                str(rng.randint(1, args.clauses))
+                for _ in range(rng.randint(0, args.per_knowledge))
+            ],
+        }
+        for k in knowledge_all
+    ]
+
+    t_old, old = _timed(
+        lambda: _apply_step2_lists([dict(c) for c in clauses], response), args.repeat
+    )
+    t_new, new = _timed(
+        lambda: _apply_step2([dict(c) for c in clauses], response), args.repeat
+    )
+    assert [set(c["knowledge_id"]) for c in old] == [
+        set(c["knowledge_id"]) for c in new
+    ]
+    pairs = sum(len(c["knowledge_id"]) for c in new)
+    print(f"knowledge={args.knowledge} clauses={args.clauses} 割当={pairs}")
+    print(
+        f"  _apply_step2   リスト: {t_old * 1000:8.1f}ms  割当行列: {t_new * 1000:8.1f}ms"
+    )
+
+    f_old, fan_old = _timed(lambda: _fan_out_lists(new, knowledge_all), args.repeat)
+    f_new, fan_new = _timed(lambda: _fan_out_matrix(new, knowledge_all), args.repeat)
+    assert fan_old == fan_new
+    print(
+        f"  審査の振り分け リスト: {f_old * 1000:8.1f}ms  割当行列: {f_new * 1000:8.1f}ms"
+        f"  (x{f_old / f_new:.0f})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+非同期LLM呼び出しのベンチマーク。
+
+ローカルに固定レイテンシの疑似 Azure OpenAI エンドポイントを立て、N 条項分の要約・審査について
+  - 直列: 同期クライアントで1条項1呼び出しを1件ずつ
+  - summarize_clause の並列: 1条項1呼び出しをゲートウェイの同時実行ウィンドウ内で並列に
+  - run_batch_summaries: 複数条項の要約を1回の呼び出しにまとめ（summarize_clauses）、呼び出し単位で並列に
+  - review_clauses の並列: 1条項ずつの審査（run_batch_reviews、応答はストリーミング）を並列に
+のウォールタイムと LLM 呼び出し回数を比較する。
+並列の目安は、初期ウィンドウ（LLM_MAX_CONCURRENCY、既定 8）のまま推移した場合の
+ceil(呼び出し回数 / ウィンドウ) × latency。ウィンドウは成功が続くと広がる（AIMD）ため、これより短くなりうる。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_async_llm --n 32 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+
+from benchmarks.fake_openai_server import FakeAzureOpenAIServer
+
+
+def start_fake_endpoint(latency: float) -> FakeAzureOpenAIServer:
+    """固定レイテンシで応答する疑似エンドポイントを起動し、環境変数を向ける"""
+    server = FakeAzureOpenAIServer(latency_mean=latency).start()
+    server.configure_env(lift_quota=True)
+    # 同一プロンプトの繰り返しを応答キャッシュで返さないようにする
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=32, help="要約・審査する条項数")
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="1リクエストの遅延秒"
+    )
+    args = parser.parse_args()
+
+    server = start_fake_endpoint(args.latency)
+
+    # 環境変数を設定してからサービスを読み込む
+    from azure_.model_registry import resolve_stage_model
+    from azure_.openai_service import AzureOpenAIService
+    from api.async_llm_service import (
+        SUMMARY_SYSTEM_PROMPT,
+        is_review_error,
+        run_batch_reviews,
+        run_batch_summaries,
+        summarize_clause,
+    )
+    from api.llm_gateway import get_llm_gateway
+
+    gateway = get_llm_gateway()
+    window = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    items = [
+        {
+            "clause_number": str(i),
+            "concerns": [f"指摘{i}-a", f"指摘{i}-b"],
+            "amendments": [f"修正{i}-x", f"修正{i}-y"],
+        }
+        for i in range(args.n)
+    ]
+    reviews = [
+        {
+            "clauses": [
+                {"clause_number": str(i), "clause": f"第{i}条 本契約の条項{i}"}
+            ],
+            "knowledge": [{"id": f"knowledge-{i}", "content": f"審査観点{i}"}],
+        }
+        for i in range(args.n)
+    ]
+
+    def serial():
+        service = AzureOpenAIService()
+        for item in items:
+            prompt = (
+                f"【条項番号】{item['clause_number']}\n"
+                f"【指摘事項一覧】{json.dumps(item['concerns'], ensure_ascii=False)}\n"
+                f"【修正文案一覧】{json.dumps(item['amendments'], ensure_ascii=False)}\n"
+            )
+            service.complete(
+                "summary",
+                [
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+            )
+        return 0
+
+    async def fan_out_summaries():
+        results = await asyncio.gather(
+            *(
+                summarize_clause(
+                    item["clause_number"], item["concerns"], item["amendments"]
+                )
+                for item in items
+            )
+        )
+        return sum(r["concern"].startswith("要約エラー") for r in results)
+
+    async def batch_summaries():
+        results = await run_batch_summaries(items)
+        return sum(r["concern"].startswith("要約エラー") for r in results)
+
+    async def fan_out_reviews():
+        results = await run_batch_reviews(reviews)
+        return sum(is_review_error(item) for r in results for item in r)
+
+    print(f"N={args.n} latency={args.latency:.2f}s 初期ウィンドウ={window}")
+    for label, stage, run in (
+        ("直列（同期クライアント）", "summary", serial),
+        (
+            "summarize_clause の並列",
+            "summary",
+            lambda: gateway.run(fan_out_summaries()),
+        ),
+        (
+            "run_batch_summaries",
+            "summary",
+            lambda: gateway.run(batch_summaries()),
+        ),
+        ("review_clauses の並列", "review", lambda: gateway.run(fan_out_reviews())),
+    ):
+        before = server.stats()
+        start = time.perf_counter()
+        errors = run()
+        elapsed = time.perf_counter() - start
+        calls = server.stats().get("chat", 0) - before.get("chat", 0)
+        if label.startswith("直列"):
+            estimate = calls * args.latency
+        else:
+            estimate = math.ceil(calls / window) * args.latency
+        model_window = (
+            gateway.stats().get(resolve_stage_model(stage), {}).get("window", "-")
+        )
+        print(
+            f"  {label:<20}: {elapsed:7.2f}s  呼び出し={calls:3d}回  errors={errors}  "
+            f"目安={estimate:5.2f}s  終了時のウィンドウ={model_window}"
+        )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
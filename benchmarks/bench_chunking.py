@@ -0,0 +1,68 @@
+"""
+マッチングの条項チャンク分割（api/match_tiling.py）の比較。
+
+長い合成契約の条項を、次の3通りで分割したときのチャンクごとの推定トークン数と、
+チャンクを並列に投げたときの所要時間の目安（最大チャンクのトークン数 ÷ 処理速度）を表示する。
+  - 文字数で先頭から詰める（従来の _chunk_if_needed、18,000文字）
+  - 推定トークン数で先頭から詰める（partition_by_tokens）
+  - 推定トークン数で均等に分ける（balanced_partition）
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_chunking --clauses 300 --budget 6000
+"""
+
+import argparse
+import json
+import random
+
+from api.match_tiling import balanced_partition, item_tokens, partition_by_tokens
+from benchmarks.synthetic_contract import make_clauses
+
+
+def _chunk_by_chars(clauses, max_chars=18000):
+    chunks, current, size = [], [], 0
+    for c in clauses:
+        block = len(json.dumps(c, ensure_ascii=False))
+        if size + block > max_chars and current:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(c)
+        size += block
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clauses", type=int, default=300, help="条項数")
+    parser.add_argument(
+        "--budget", type=int, default=6000, help="チャンクのトークン予算"
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=2000, help="入力トークンの処理速度"
+    )
+    args = parser.parse_args()
+
+    # 条文の長さにばらつきを持たせる（定型条項の繰り返し＋長い別紙的な条項）
+    rng = random.Random(0)
+    clauses = make_clauses(args.clauses)
+    for c in clauses:
+        c["clause"] += "なお、" * rng.choice([0, 0, 5, 20, 80])
+
+    for label, chunks in (
+        ("文字数・先頭から", _chunk_by_chars(clauses)),
+        ("トークン・先頭から", partition_by_tokens(clauses, args.budget)),
+        ("トークン・均等", balanced_partition(clauses, args.budget)),
+    ):
+        sizes = [sum(item_tokens(c) for c in chunk) for chunk in chunks]
+        assert [c for chunk in chunks for c in chunk] == clauses
+        print(
+            f"{label:<12} chunks={len(chunks):>2} "
+            f"max={max(sizes):>6} min={min(sizes):>6} "
+            f"並列所要≒{max(sizes) / args.tokens_per_second:5.2f}s  {sizes}"
+        )
+
+
+if __name__ == "__main__":
+    main()
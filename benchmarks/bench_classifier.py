@@ -0,0 +1,111 @@
+"""
+マッチング分類器（api/match_classifier.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、
+  1. 合成契約（シード違い）を --history 件マッチングして判定履歴を貯め、
+  2. 履歴の一部を取り置いた精度・速度の評価（python -m api.match_classifier report 相当）を表示し、
+  3. 履歴全体で学習したモデルを使って新しい契約をマッチングし、
+     分類器なしと比べた LLM 呼び出し・入力トークン数と、割当の一致率を表示する。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_classifier --history 10 --knowledge 100 --clauses 40
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=10, help="履歴を貯める契約数")
+    parser.add_argument("--knowledge", type=int, default=100, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=40, help="契約の条項数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency_mean=0.3, per_input_char=0.00005)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.environ["MATCH_CACHE_PATH"] = os.path.join(workdir, "match.sqlite3")
+    os.environ["MATCH_CLASSIFIER_PATH"] = os.path.join(workdir, "classifier.joblib")
+    os.chdir(workdir)
+
+    import joblib
+
+    from api.match_cache import get_match_cache
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+    from api.match_classifier import (
+        _load_history,
+        classifier_settings,
+        evaluate_classifier,
+        train_classifier,
+    )
+    from api.tokens import estimate_message_tokens
+
+    knowledge_all = make_knowledge(args.knowledge)
+
+    def run(clauses):
+        before = server.stats().get("chat", 0)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response, _, trace = matching_clause_and_knowledge(
+                knowledge_all, [dict(c) for c in clauses]
+            )
+        elapsed = time.perf_counter() - start
+        tokens = sum(estimate_message_tokens(p["messages"]) for p in trace["prompts"])
+        pairs = {
+            (item["knowledge_id"], num)
+            for item in response
+            for num in item["clause_number"]
+        }
+        calls = server.stats().get("chat", 0) - before
+        return elapsed, calls, tokens, pairs, trace
+
+    # 1) 履歴を貯める
+    os.environ["MATCH_CLASSIFIER_DISABLED"] = "1"
+    for seed in range(1, args.history + 1):
+        run(make_clauses(args.clauses, seed=seed))
+    history = _load_history()
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"履歴={args.history}契約 {len(history)}組"
+    )
+
+    # 2) 取り置き評価
+    settings = classifier_settings()
+    report = evaluate_classifier(history, 0.2, settings["accept"], settings["reject"])
+    print("  取り置き評価: " + ", ".join(f"{k}={v}" for k, v in report.items()))
+
+    # 3) 学習して新しい契約に適用（判定キャッシュは空にして分類器の効果だけを見る）
+    joblib.dump(train_classifier(history), settings["path"])
+    clauses = make_clauses(args.clauses, seed=1000)
+    results = {}
+    for label, disabled in (("分類器なし", "1"), ("分類器あり", "")):
+        get_match_cache().clear()
+        os.environ["MATCH_CLASSIFIER_DISABLED"] = disabled
+        results[label] = run(clauses)
+    truth = results["分類器なし"][3]
+    for label, (elapsed, calls, tokens, pairs, trace) in results.items():
+        stats = trace.get("classifier", {})
+        agree = len(pairs & truth) / len(pairs | truth) if pairs | truth else 1.0
+        print(
+            f"  {label}: {elapsed:5.2f}s 呼び出し={calls} 入力トークン≒{tokens:>7,} "
+            f"割当={len(pairs)} 一致率(Jaccard)={agree:.3f} "
+            f"分類器で確定={stats.get('accepted', 0)}+{stats.get('rejected', 0)}"
+        )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
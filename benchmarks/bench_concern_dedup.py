@@ -0,0 +1,129 @@
+"""
+指摘事項・修正文案の重複統合（api/concern_dedup.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、マッチング済みの同じ条項で examination_api_stream を
+ナレッジごとの審査・条項ごとの要約（REVIEW_PACKING_DISABLED=1, SUMMARY_BATCH_MAX_CLAUSES=1）で
+  - 統合なし: CONCERN_DEDUP_DISABLED=1（指摘事項・修正文案が2件以上あれば要約する）
+  - 統合あり: ほぼ同じ内容の指摘事項・修正文案を LLM を使わずに統合してから要約の要否を決める
+の順に実行し、要約の呼び出し回数・所要時間と、統合で省けた要約の呼び出し回数を表示する。
+統合なしの実行で得た条項ごとの審査結果（サンプルコーパス）に対して、統合にかかる時間も測る。
+既定では疑似サーバーの通常の審査結果（指摘はナレッジごとに異なる）で測る。
+--near-duplicate-concerns を付けると、疑似サーバーが対処方針（action_plan）の同じナレッジから
+表記・語尾だけが違う指摘を返す重複の多いデータになる（統合の動作確認用で、削減効果の見積もりには使わない）。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_concern_dedup --knowledge 80 --clauses 40 --latency lognormal --latency-mean 0.5
+    python -m benchmarks.bench_concern_dedup --near-duplicate-concerns
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _comparable(analyzed):
+    return [
+        (a["clause_number"], set(a["knowledge_ids"]), bool(a["concern"]))
+        for a in analyzed
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=80, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=40, help="契約の条項数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency="lognormal", latency_mean=0.5)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["REVIEW_CACHE_DISABLED"] = "1"
+    os.environ["TRACE_SINK"] = "none"
+    os.environ["REVIEW_PACKING_DISABLED"] = "1"
+    os.environ["SUMMARY_BATCH_MAX_CLAUSES"] = "1"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.chdir(workdir)
+
+    from api.concern_dedup import dedup_settings, merge_review_duplicates
+    from api.examination_api import examination_api_stream
+    from api.examination_pipeline import collect_review_results, needs_summary
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = [
+        {"clause_number": c["clause_number"], "clause": c["clause"]}
+        for c in make_clauses(args.clauses)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, clauses_augmented, _ = matching_clause_and_knowledge(knowledge_all, clauses)
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"latency={args.latency}(mean={args.latency_mean}s) "
+        f"指摘={'重複の多いデータ' if args.near_duplicate_concerns else '通常'}"
+    )
+
+    results = {}
+    reviews = defaultdict(list)
+    for label, disabled in (("統合なし", "1"), ("統合あり", "")):
+        os.environ["CONCERN_DEDUP_DISABLED"] = disabled
+        before = server.stats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for event in examination_api_stream(
+                contract_type="業務委託契約",
+                background_info="",
+                partys=["甲", "乙"],
+                title="業務委託契約書",
+                clauses=clauses_augmented,
+                knowledge_all=knowledge_all,
+            ):
+                if event["type"] == "review" and disabled:
+                    reviews[event["item"]["clause_number"]].append(event["item"])
+                elif event["type"] == "done":
+                    results[label] = event["analyzed_clauses"]
+        elapsed = time.perf_counter() - start
+        summaries = server.stats().get("chat:summary", 0) - before.get(
+            "chat:summary", 0
+        )
+        results[label + ":summaries"] = summaries
+        print(f"  {label:<6}: {elapsed:6.2f}s 要約={summaries}回")
+
+    avoided = results["統合なし:summaries"] - results["統合あり:summaries"]
+    total = results["統合なし:summaries"]
+    print(
+        f"  統合で省けた要約: {avoided}/{total}回"
+        f"（{avoided / total * 100 if total else 0:.0f}%）"
+    )
+    old, new = results["統合なし"], results["統合あり"]
+    print(f"  根拠ナレッジ・懸念の有無が一致: {_comparable(old) == _comparable(new)}")
+
+    # サンプルコーパス（統合なしの審査結果）に対する統合の所要時間
+    settings = dedup_settings()
+    corpus = [collect_review_results(items)[:2] for items in reviews.values()]
+    start = time.perf_counter()
+    merged = [merge_review_duplicates(c, a, settings) for c, a in corpus]
+    elapsed = time.perf_counter() - start
+    print(
+        f"  サンプルコーパス: 条項={len(corpus)} "
+        f"指摘事項={sum(len(c) for c, _ in corpus)}→{sum(len(c) for c, _ in merged)}件 "
+        f"要約が必要な条項={sum(needs_summary(c, a) for c, a in corpus)}→"
+        f"{sum(needs_summary(c, a) for c, a in merged)} "
+        f"統合の所要時間={elapsed * 1000:.2f}ms"
+    )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+埋め込みのバッチ化・キャッシュのベンチマーク。
+
+ローカルの疑似 embeddings エンドポイント（1リクエストあたり固定遅延＋入力1件あたりの遅延）に対し、
+入力 1 / 16 / 128 件で次の3通りのスループット（件/秒）を測る。
+  - 1件ずつ（従来の get_emb_3_small を件数分呼ぶ、キャッシュなし）
+  - バッチ（get_emb_3_small_batch、キャッシュ未ヒット）
+  - キャッシュ（同じ入力を再度 get_emb_3_small_batch）
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_embeddings --latency 0.15
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import FakeAzureOpenAIServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--latency", type=float, default=0.15, help="1リクエストの固定遅延秒"
+    )
+    parser.add_argument(
+        "--per-input", type=float, default=0.001, help="入力1件あたりの追加遅延秒"
+    )
+    args = parser.parse_args()
+
+    server = FakeAzureOpenAIServer(
+        latency_mean=args.latency, embedding_per_input=args.per_input
+    ).start()
+    server.configure_env()
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(
+        tempfile.mkdtemp(), "embedding_cache.sqlite3"
+    )
+
+    from azure_.openai_service import AzureOpenAIService
+
+    uncached = AzureOpenAIService(use_cache=False)
+    cached = AzureOpenAIService(use_cache=True)
+
+    print(f"latency={args.latency:.3f}s + {args.per_input * 1000:.1f}ms/input")
+    print(f"{'N':>5} {'1件ずつ':>12} {'バッチ':>12} {'キャッシュ':>12}  (件/秒)")
+    for n in (1, 16, 128):
+        texts = [
+            f"第{i}条（秘密保持）受領者は開示者の秘密情報を第三者に開示しない。{n}"
+            for i in range(n)
+        ]
+
+        start = time.perf_counter()
+        for t in texts:
+            uncached.get_emb_3_small(t)
+        single = n / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cached.get_emb_3_small_batch(texts)
+        batch = n / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cached.get_emb_3_small_batch(texts)
+        warm = n / (time.perf_counter() - start)
+
+        print(f"{n:>5} {single:>12.1f} {batch:>12.1f} {warm:>12.1f}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
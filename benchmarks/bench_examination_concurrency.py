@@ -0,0 +1,242 @@
+"""
+審査・要約の並列実行（examination_api）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、マッチング済みの同じ条項で
+  - 従来: ナレッジごとの審査（ストリーミング）を1件ずつ直列に呼び、全審査の後に条項ごとの要約を直列に呼ぶ
+  - 並列: examination_api（ゲートウェイの同時実行ウィンドウ内で審査・要約を並列に実行）
+を実行し、所要時間・LLM 呼び出し回数と、戻り値（summarized_clauses）が一致するかを表示する。
+不正JSON応答を注入すると（--invalid-json-rate）、修復段階を含めて一致するかを確かめられる。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_examination_concurrency --knowledge 40 --clauses 30 --latency lognormal --latency-mean 0.5
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _examination_serial(clauses, knowledge_all):
+    """従来の examination_api（審査・要約を1件ずつ直列に呼ぶ）"""
+    from api.assignment_matrix import AssignmentMatrix
+    from api.async_llm_service import REVIEW_SYSTEM_PROMPT, SUMMARY_SYSTEM_PROMPT
+    from api.json_stream import JsonArrayStreamParser
+    from azure_.openai_service import AzureOpenAIService
+    from azure_.response_schemas import parse_structured_response
+
+    service = AzureOpenAIService()
+    data_clauses = [
+        {
+            "clause_id": c.get("clause_id", ""),
+            "clause_number": c.get("clause_number", ""),
+            "clause": c.get("clause", ""),
+            "knowledge_id": c.get("knowledge_id", []),
+        }
+        for c in clauses
+    ]
+    assignment = AssignmentMatrix.from_clauses(data_clauses)
+    knowledge_by_id = defaultdict(list)
+    for k in knowledge_all:
+        knowledge_by_id[k.get("id")].append(k)
+
+    def review(target_clauses, knowledge):
+        prompt = (
+            "【審査対象データ】\n"
+            f"{json.dumps(target_clauses, ensure_ascii=False)}\n"
+            "【審査知見（knowledge）】\n"
+            f"{json.dumps(knowledge, ensure_ascii=False)}\n\n"
+            "審査は提供する審査知見以外を絶対に利用しないでください。"
+        )
+        messages = [
+            {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+        parser = JsonArrayStreamParser()
+        items = []
+        for delta in service.stream_complete("review", messages):
+            items.extend(parser.feed(delta))
+        if parser.done and not parser.malformed:
+            return items
+        emitted = {item.get("clause_number") for item in items}
+        try:
+            repaired = parse_structured_response(parser.text, "review")
+        except Exception as e:
+            repaired = _repair(parser.text, target_clauses, e)
+        return items + [i for i in repaired if i.get("clause_number") not in emitted]
+
+    def _repair(text, target_clauses, error):
+        try:
+            fix = service.complete(
+                "json_repair",
+                [
+                    {"role": "system", "content": "あなたはJSON整形の専門家です。"},
+                    {
+                        "role": "user",
+                        "content": "以下のテキストはJSON配列として不正な形式です。絶対に他のテキストや説明を含めず、厳格なJSON配列のみを出力してください。\n"
+                        "【期待するJSON配列の出力例】\n"
+                        "[\n"
+                        '  {"clause_number": "1", "concern": "懸念点例", "amendment_clause": "修正条文例", "knowledge_ids": ["id1", "id2"]},\n'
+                        '  {"clause_number": "2", "concern": "", "amendment_clause": "", "knowledge_ids": []}\n'
+                        "]\n"
+                        "【不正なJSONテキスト】\n"
+                        f"{text}",
+                    },
+                ],
+            )
+        except Exception:
+            fix = None
+        if fix is not None:
+            try:
+                return parse_structured_response(fix, "review")
+            except Exception as e:
+                error = e
+        return [
+            {
+                "clause_number": c["clause_number"],
+                "concern": f"LLM応答パースエラー: {error}",
+                "amendment_clause": "",
+                "knowledge_ids": [],
+            }
+            for c in target_clauses
+        ]
+
+    clause_results = defaultdict(list)
+    for kid in assignment.active_knowledge_ids():
+        target_clauses = [data_clauses[i] for i in assignment.clause_rows(kid)]
+        target_knowledge = knowledge_by_id.get(kid, [])
+        if not target_clauses or not target_knowledge:
+            continue
+        for item in review(target_clauses, target_knowledge):
+            clause_results[item["clause_number"]].append(item)
+
+    summarized = []
+    for clause in data_clauses:
+        num = clause["clause_number"]
+        results = clause_results.get(num, [])
+        concerns = [r["concern"] for r in results if r["concern"]]
+        amendments = [r["amendment_clause"] for r in results if r["amendment_clause"]]
+        knowledge_ids = [k for r in results for k in r.get("knowledge_ids", [])]
+        if len(concerns) > 1 or len(amendments) > 1:
+            try:
+                answer = service.complete(
+                    "summary",
+                    [
+                        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                        {
+                            "role": "user",
+                            "content": f"【条項番号】{num}\n"
+                            f"【指摘事項一覧】{json.dumps(concerns, ensure_ascii=False)}\n"
+                            f"【修正文案一覧】{json.dumps(amendments, ensure_ascii=False)}\n",
+                        },
+                    ],
+                )
+                result = parse_structured_response(answer, "summary")
+                concern = result.get("concern", "")
+                amendment = result.get("amendment_clause", "")
+            except Exception as e:
+                concern, amendment = "要約エラー: " + str(e), ""
+        else:
+            concern = concerns[0] if concerns else ""
+            amendment = amendments[0] if amendments else ""
+        summarized.append(
+            {
+                "clause_number": num,
+                "concern": concern,
+                "amendment_clause": amendment,
+                "knowledge_ids": list(set(knowledge_ids)),
+            }
+        )
+    return summarized
+
+
+def _comparable(analyzed):
+    return [
+        (
+            a["clause_number"],
+            a["concern"],
+            a["amendment_clause"],
+            set(a["knowledge_ids"]),
+        )
+        for a in analyzed
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=40, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=30, help="契約の条項数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency="lognormal", latency_mean=0.5)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["TRACE_SINK"] = "none"
+    # 従来の直列実行と同じ呼び出し単位で比べる
+    # （審査のパックは bench_review_packing、要約のバッチ化は bench_summary_batching、
+    # 指摘事項の重複統合は bench_concern_dedup で測る）
+    os.environ["REVIEW_PACKING_DISABLED"] = "1"
+    os.environ["SUMMARY_BATCH_MAX_CLAUSES"] = "1"
+    os.environ["CONCERN_DEDUP_DISABLED"] = "1"
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.chdir(workdir)
+
+    from api.examination_api import examination_api
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = [
+        {"clause_number": c["clause_number"], "clause": c["clause"]}
+        for c in make_clauses(args.clauses)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, clauses_augmented, _ = matching_clause_and_knowledge(knowledge_all, clauses)
+    pairs = sum(len(c["knowledge_id"]) for c in clauses_augmented)
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} 審査の組={pairs} "
+        f"latency={args.latency}(mean={args.latency_mean}s) "
+        f"invalid_json={args.invalid_json_rate}"
+    )
+
+    runs = {
+        "従来（直列）": lambda: _examination_serial(clauses_augmented, knowledge_all),
+        "並列": lambda: examination_api(
+            contract_type="業務委託契約",
+            background_info="",
+            partys=["甲", "乙"],
+            title="業務委託契約書",
+            clauses=clauses_augmented,
+            knowledge_all=knowledge_all,
+        ),
+    }
+    results = {}
+    for label, fn in runs.items():
+        before = server.stats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[label] = fn()
+        elapsed = time.perf_counter() - start
+        calls = {
+            k: v - before.get(k, 0)
+            for k, v in server.stats().items()
+            if v - before.get(k, 0)
+        }
+        print(f"  {label:<8}: {elapsed:6.2f}s {calls}")
+    old, new = results.values()
+    print(f"  summarized_clauses が一致: {_comparable(old) == _comparable(new)}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
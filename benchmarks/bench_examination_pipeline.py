@@ -0,0 +1,142 @@
+"""
+マッチング → 審査 → 要約のパイプライン実行（api/examination_pipeline.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、同じ契約・ナレッジで
+  - 段階ごと: matching_clause_and_knowledge の完了後に examination_api（審査・要約）を実行
+  - パイプライン: examination_pipeline_stream（割当が確定したナレッジから審査を開始）
+を実行し、エンドツーエンドの所要時間、最初の条項結果が届くまでの時間、
+LLM 呼び出し回数と、条項ごとの結果（指摘事項の行の集合・根拠ナレッジ）が一致するかを表示する。
+（審査のパックは割当の届き方で変わり、指摘事項の並びや修正条文のまとめ方が変わるため、それらは比較しない）
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_examination_pipeline --knowledge 200 --clauses 60 --latency lognormal --latency-mean 0.5
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _comparable(analyzed):
+    return [
+        (
+            a["clause_number"],
+            set(filter(None, (a["concern"] or "").split("\n"))),
+            set(a["knowledge_ids"]),
+        )
+        for a in analyzed
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=200, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=60, help="契約の条項数")
+    parser.add_argument(
+        "--tile-knowledge-tokens",
+        type=int,
+        default=1500,
+        help="マッチングの1タイルに載せるナレッジの推定トークン数（タイル数を増やす）",
+    )
+    add_server_arguments(parser)
+    parser.set_defaults(latency="lognormal", latency_mean=0.5)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    # LLM 応答はキャッシュせず、埋め込みだけキャッシュする（両方式で同じ条件にする）
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["REVIEW_CACHE_DISABLED"] = "1"
+    os.environ["MATCH_CLASSIFIER_DISABLED"] = "1"
+    os.environ["TRACE_SINK"] = "none"
+    # パックの切り方で指摘事項のまとまり方が変わるため、重複統合は比較から外す
+    os.environ["CONCERN_DEDUP_DISABLED"] = "1"
+    os.environ["MATCH_TILE_KNOWLEDGE_TOKENS"] = str(args.tile_knowledge_tokens)
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.chdir(workdir)
+
+    from api.examination_api import examination_api
+    from api.examination_pipeline import examination_pipeline_stream
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = [
+        {"clause_number": c["clause_number"], "clause": c["clause"]}
+        for c in make_clauses(args.clauses)
+    ]
+    exam_args = {
+        "contract_type": "業務委託契約",
+        "background_info": "",
+        "partys": ["甲", "乙"],
+        "title": "業務委託契約書",
+        "knowledge_all": knowledge_all,
+    }
+
+    def staged():
+        _, clauses_augmented, _ = matching_clause_and_knowledge(
+            knowledge_all, [dict(c) for c in clauses]
+        )
+        matched_at = time.perf_counter()
+        analyzed = examination_api(clauses=clauses_augmented, **exam_args)
+        return analyzed, matched_at, None
+
+    def pipelined():
+        matched_at = first_clause_at = None
+        analyzed = []
+        for event in examination_pipeline_stream(
+            clauses=[dict(c) for c in clauses], **exam_args
+        ):
+            if event["type"] == "matching":
+                matched_at = time.perf_counter()
+            elif event["type"] == "clause" and first_clause_at is None:
+                first_clause_at = time.perf_counter()
+            elif event["type"] == "done":
+                analyzed = event["analyzed_clauses"]
+        return analyzed, matched_at, first_clause_at
+
+    # 埋め込みのキャッシュを温める（両方式で同じ条件にする）
+    with contextlib.redirect_stdout(io.StringIO()):
+        matching_clause_and_knowledge(knowledge_all, [dict(c) for c in clauses])
+
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"latency={args.latency}(mean={args.latency_mean}s)"
+    )
+    results = {}
+    for label, fn in (("段階ごと", staged), ("パイプライン", pipelined)):
+        before = server.stats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyzed, matched_at, first_clause_at = fn()
+        elapsed = time.perf_counter() - start
+        calls = {
+            k: v - before.get(k, 0)
+            for k, v in server.stats().items()
+            if v - before.get(k, 0)
+        }
+        results[label] = analyzed
+        first = (
+            f" 最初の条項結果={first_clause_at - start:5.2f}s"
+            if first_clause_at
+            else ""
+        )
+        print(
+            f"  {label:<10}: 合計={elapsed:6.2f}s マッチング完了={matched_at - start:5.2f}s"
+            f"{first} {calls}"
+        )
+    old, new = results.values()
+    print(f"  条項ごとの結果が一致: {_comparable(old) == _comparable(new)}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+字句マッチ（api/lexical_matcher.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、同じ契約を MATCH_MODE=llm / lexical / hybrid でマッチングし、
+ウォールタイム・LLM呼び出し回数と、llm モードの割当（フォールバックを除く）を正解としたときの
+適合率・再現率を比較する。
+LLM応答キャッシュとマッチング判定キャッシュは使わない。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_lexical --knowledge 60 --clauses 15
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=60, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=15, help="契約の条項数")
+    parser.add_argument("--repeat", type=int, default=3, help="各モードの実行回数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency_mean=2.0, per_input_char=0.0005)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    # フォールバックの割当は評価から外す
+    os.environ["MATCH_FALLBACK_TOP_K"] = "0"
+    os.chdir(workdir)
+
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = make_clauses(args.clauses)
+
+    results = {}
+    for mode in ("llm", "lexical", "hybrid"):
+        os.environ["MATCH_MODE"] = mode
+        timings = []
+        for _ in range(args.repeat):
+            before = server.stats().get("chat", 0)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                response, _, trace = matching_clause_and_knowledge(
+                    knowledge_all, [dict(c) for c in clauses]
+                )
+            timings.append(time.perf_counter() - start)
+            calls = server.stats().get("chat", 0) - before
+        pairs = {
+            (item["knowledge_id"], num)
+            for item in response
+            for num in item["clause_number"]
+        }
+        results[mode] = (min(timings), calls, pairs, trace.get("lexical", {}))
+
+    truth = results["llm"][2]
+    print(f"knowledge={args.knowledge} clauses={args.clauses}")
+    for mode, (elapsed, calls, pairs, stats) in results.items():
+        hit = len(pairs & truth)
+        precision = hit / len(pairs) if pairs else 1.0
+        recall = hit / len(truth) if truth else 1.0
+        gate = (
+            f"  確定={stats['accepted']}+{stats['rejected']} 保留={stats['uncertain']} "
+            f"字句={stats['elapsed_ms']}ms"
+            if stats
+            else ""
+        )
+        print(
+            f"  {mode:<8} {elapsed * 1000:8.1f}ms  呼び出し={calls}  組={len(pairs):>4}  "
+            f"適合率={precision:.3f}  再現率={recall:.3f}{gate}"
+        )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
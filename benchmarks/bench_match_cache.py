@@ -0,0 +1,88 @@
+"""
+マッチング判定キャッシュ（api/match_cache.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、同じ契約を次の順にマッチングして、
+LLM呼び出し回数・推定入力トークン数・ウォールタイムを比較する。
+  1. 初回（キャッシュなし）
+  2. 条項を1つ書き換えて再実行
+  3. ナレッジを1件更新（KnowledgeAPI.save_knowledge 相当の無効化）して再実行
+  4. 変更なしで再実行
+LLM応答キャッシュは無効にし、マッチング判定キャッシュの効果だけを測る。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_match_cache --knowledge 200 --clauses 60
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=200, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=60, help="契約の条項数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency_mean=0.3, per_input_char=0.00005)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    # LLM応答キャッシュは TTL 0 で常にミスにする（埋め込みキャッシュとマッチング判定キャッシュは有効）
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.environ["MATCH_CACHE_PATH"] = os.path.join(workdir, "match.sqlite3")
+    os.chdir(workdir)
+
+    from api.match_cache import invalidate_knowledge
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+    from api.tokens import estimate_message_tokens
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = make_clauses(args.clauses)
+
+    def edit_clause():
+        target = clauses[len(clauses) // 2]
+        target["clause"] += "\nただし、書面による事前の合意がある場合はこの限りでない。"
+
+    def edit_knowledge():
+        knowledge_all[0]["target_clause"] += "（再委託を含む）"
+        invalidate_knowledge(knowledge_all[0]["id"])
+
+    print(f"knowledge={args.knowledge} clauses={args.clauses}")
+    for label, mutate in (
+        ("初回", None),
+        ("条項を1つ修正", edit_clause),
+        ("ナレッジを1件更新", edit_knowledge),
+        ("変更なし", None),
+    ):
+        if mutate:
+            mutate()
+        before = server.stats().get("chat", 0)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response, _, trace = matching_clause_and_knowledge(
+                knowledge_all, [dict(c) for c in clauses]
+            )
+        elapsed = time.perf_counter() - start
+        tokens = sum(estimate_message_tokens(p["messages"]) for p in trace["prompts"])
+        stats = trace["match_cache"]
+        pairs = sum(len(item["clause_number"]) for item in response)
+        print(
+            f"  {label:<10} {elapsed:6.2f}s  呼び出し={server.stats().get('chat', 0) - before:>3}  "
+            f"入力トークン≒{tokens:>8,}  判定済み={stats['cached']:>6}/{stats['pairs']:<6} "
+            f"割当={pairs}"
+        )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
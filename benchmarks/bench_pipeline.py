@@ -0,0 +1,143 @@
+"""
+審査パイプライン全体のエンドツーエンド・ベンチマーク（Azure のクォータを使わない）。
+
+疑似 Azure OpenAI サーバー（benchmarks/fake_openai_server.py）を起動し、合成した契約書 docx に対して
+  1. document_input.extract_text_from_document（条文分割＋LLMによる結合補正）
+  2. match_cl_and_kn.matching_clause_and_knowledge（条項↔ナレッジのマッチング）
+  3. examination_api.examination_api（審査・要約）
+を順に実行し、段階ごとのウォールタイムとLLM呼び出し回数（段階別・429・不正JSON）を表示する。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_pipeline --clauses 30 --knowledge 20 --latency lognormal --latency-mean 0.3
+    python -m benchmarks.bench_pipeline --rate-429 0.1 --invalid-json-rate 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import (
+    make_clauses,
+    make_knowledge,
+    write_contract_docx,
+)
+
+
+def _delta(before, after):
+    return {
+        k: after.get(k, 0) - before.get(k, 0)
+        for k in after
+        if after.get(k, 0) - before.get(k, 0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clauses", type=int, default=30, help="契約書の条項数")
+    parser.add_argument("--knowledge", type=int, default=20, help="ナレッジ件数")
+    parser.add_argument(
+        "--use-cache", action="store_true", help="LLM応答キャッシュを有効にする"
+    )
+    parser.add_argument(
+        "--respect-quota",
+        action="store_true",
+        help="既定のデプロイメントクォータ（TPM/RPM）で流量制御する",
+    )
+    add_server_arguments(parser)
+    parser.set_defaults(latency_mean=0.2)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=not args.respect_quota)
+    workdir = tempfile.mkdtemp()
+    if not args.use_cache:
+        os.environ["LLM_CACHE_DISABLED"] = "1"
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(workdir, "llm_cache.sqlite3"))
+    os.environ.setdefault(
+        "EMBEDDING_CACHE_PATH", os.path.join(workdir, "embedding_cache.sqlite3")
+    )
+    os.environ.setdefault(
+        "MATCH_CACHE_PATH", os.path.join(workdir, "match_cache.sqlite3")
+    )
+    os.environ.setdefault(
+        "REVIEW_CACHE_PATH", os.path.join(workdir, "review_cache.sqlite3")
+    )
+
+    # 環境変数を設定してから読み込む
+    from services.document_input import extract_text_from_document
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+    from api.examination_api import examination_api
+
+    knowledge_all = make_knowledge(args.knowledge)
+    docx_path = os.path.join(workdir, "contract.docx")
+    write_contract_docx(docx_path, make_clauses(args.clauses))
+    # match_cl_and_kn.json などの出力をリポジトリに書かないよう作業ディレクトリを移す
+    os.chdir(workdir)
+
+    timings = []
+
+    def stage(name, fn):
+        before = server.stats()
+        start = time.perf_counter()
+        # パイプライン内部の print を抑止
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        timings.append(
+            (name, time.perf_counter() - start, _delta(before, server.stats()))
+        )
+        return result
+
+    document = stage("document_input", lambda: extract_text_from_document(docx_path))
+    if "error" in document:
+        print(f"document_input: {document['error']}")
+        clauses = [
+            {"clause_number": c["clause_number"], "clause": c["clause"]}
+            for c in make_clauses(args.clauses)
+        ]
+    else:
+        clauses = [
+            {"clause_number": c["clause_number"], "clause": c["text"]}
+            for c in document["clauses"]
+        ]
+    _, clauses_augmented, match_trace = stage(
+        "matching", lambda: matching_clause_and_knowledge(knowledge_all, clauses)
+    )
+    analyzed = stage(
+        "examination",
+        lambda: examination_api(
+            contract_type="業務委託契約",
+            background_info="",
+            partys=["甲", "乙"],
+            title="業務委託契約書",
+            clauses=clauses_augmented,
+            knowledge_all=knowledge_all,
+        ),
+    )
+
+    print(
+        f"clauses={args.clauses} knowledge={args.knowledge} "
+        f"latency={args.latency}(mean={args.latency_mean}s) "
+        f"429={args.rate_429} invalid_json={args.invalid_json_rate}"
+    )
+    for name, elapsed, calls in timings:
+        print(f"  {name:<16} {elapsed:8.2f}s  {calls}")
+    print(f"  合計             {sum(t for _, t, _ in timings):8.2f}s")
+    print(
+        f"  条項数（結合後）={len(clauses)}  "
+        f"懸念あり={sum(1 for a in analyzed if a.get('concern'))}"
+    )
+    fan = match_trace["fan_out"]
+    print(
+        f"  審査の (条項, ナレッジ) 組: {fan['after']}"
+        f"（全条項フォールバックなら {fan['before']}、"
+        f"フォールバック {fan['fallback_knowledge']} 件 × 上位{fan['fallback_top_k']}条項）"
+    )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+マッチング前のナレッジ事前絞り込み（api/knowledge_prefilter.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、合成した500件のナレッジと契約条項で
+matching_clause_and_knowledge を絞り込みなし／ありで実行し、次を比較する。
+  - マッチングプロンプトの推定入力トークン数（全チャンク合計）
+  - ウォールタイム（絞り込みありは埋め込み取得を含む）
+  - 再現率: 絞り込みなしでLLMが割り当てた (ナレッジ, 条項) の組のうち、絞り込みありでも割り当てられた割合
+
+疑似サーバーはプロンプト1文字あたりの遅延（--per-input-char）で入力長に比例した処理時間を模す。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_prefilter --knowledge 500 --clauses 40
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _llm_pairs(trace):
+    from azure_.response_schemas import parse_structured_response
+
+    pairs = set()
+    for raw in trace["raw_responses"]:
+        for item in parse_structured_response(raw["raw"], "matching"):
+            for num in item.get("clause_number", []):
+                pairs.add((item["knowledge_id"], str(num)))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=500, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=40, help="契約の条項数")
+    parser.add_argument("--top-k", type=int, default=10, help="条項ごとの候補数")
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=0.2,
+        help="必ず候補に含める類似度（疑似埋め込みは実モデルより類似度が低く出る）",
+    )
+    add_server_arguments(parser)
+    parser.set_defaults(latency_mean=0.3, per_input_char=0.00005)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    # LLM応答キャッシュは TTL 0 で常にミスにし、埋め込みキャッシュだけを効かせる
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    # 同じ契約を3回マッチングするため、マッチング判定キャッシュも使わない
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.environ["MATCH_PREFILTER_TOP_K"] = str(args.top_k)
+    os.environ["MATCH_PREFILTER_MIN_SCORE"] = str(args.min_score)
+    os.chdir(workdir)
+
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+    from api.tokens import estimate_message_tokens
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = make_clauses(args.clauses)
+
+    results = {}
+    runs = (
+        ("絞り込みなし", "1"),
+        ("絞り込みあり", ""),
+        # 2回目は条文・target_clause の埋め込みがキャッシュ済み
+        ("絞り込みあり（埋め込みキャッシュ済み）", ""),
+    )
+    for label, disabled in runs:
+        os.environ["MATCH_PREFILTER_DISABLED"] = disabled
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, trace = matching_clause_and_knowledge(
+                knowledge_all, [dict(c) for c in clauses]
+            )
+        elapsed = time.perf_counter() - start
+        tokens = sum(estimate_message_tokens(p["messages"]) for p in trace["prompts"])
+        results[label] = (elapsed, tokens, _llm_pairs(trace), trace["prefilter"])
+
+    base_pairs = results["絞り込みなし"][2]
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"top_k={args.top_k} min_score={args.min_score}"
+    )
+    for label, (elapsed, tokens, pairs, stats) in results.items():
+        recall = len(pairs & base_pairs) / len(base_pairs) if base_pairs else 1.0
+        print(
+            f"  {label}: {elapsed:6.2f}s  入力トークン≒{tokens:>8,}  "
+            f"組={len(pairs):>5}  再現率={recall:.3f}  "
+            f"候補/チャンク={stats.get('candidates_per_chunk', '-')}  "
+            f"除外={len(stats['pruned_ids'])}"
+        )
+    full_tokens = results["絞り込みなし"][1]
+    print(f"  入力トークン削減率: {1 - results['絞り込みあり'][1] / full_tokens:.1%}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
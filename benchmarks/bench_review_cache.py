@@ -0,0 +1,130 @@
+"""
+審査結果の永続キャッシュ（api/review_cache.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、定型条項を共有する2つの契約（乱数シード違い）で examination_api_stream を
+  1. 契約A（キャッシュなしの状態から）
+  2. 契約B（契約Aの審査結果を再利用。文言が同じ条項だけヒットする）
+  3. 契約A（再審査。他のナレッジの指摘だけが返った条項のナレッジは保存していないため、その組だけ審査し直す）
+  4. ナレッジ1件を更新（KnowledgeAPI.save_knowledge と同じ無効化）してから契約A
+の順に実行し、審査の呼び出し回数・所要時間・審査結果キャッシュのヒット率を表示する。
+1 と 3・4 の条項ごとの結果（指摘事項の行の集合・根拠ナレッジ）が一致するかも確かめる。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_review_cache --knowledge 80 --clauses 40 --latency lognormal --latency-mean 0.5
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _comparable(analyzed):
+    return [
+        (
+            a["clause_number"],
+            set(filter(None, (a["concern"] or "").split("\n"))),
+            set(a["knowledge_ids"]),
+        )
+        for a in analyzed
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=80, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=40, help="契約の条項数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency="lognormal", latency_mean=0.5)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["TRACE_SINK"] = "none"
+    # キャッシュの結果と審査の結果で指摘事項のまとまり方が変わるため、重複統合は比較から外す
+    os.environ["CONCERN_DEDUP_DISABLED"] = "1"
+    os.environ["REVIEW_CACHE_PATH"] = os.path.join(workdir, "review.sqlite3")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.chdir(workdir)
+
+    from api.examination_api import examination_api_stream
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+    from api.review_cache import invalidate_knowledge_reviews
+
+    knowledge_all = make_knowledge(args.knowledge)
+    contracts = {}
+    for name, seed in (("A", 0), ("B", 1)):
+        clauses = [
+            {"clause_number": c["clause_number"], "clause": c["clause"]}
+            for c in make_clauses(args.clauses, seed=seed)
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, contracts[name], _ = matching_clause_and_knowledge(
+                knowledge_all, clauses
+            )
+    same = sum(
+        a["clause"] == b["clause"] for a, b in zip(contracts["A"], contracts["B"])
+    )
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"契約A・Bで文言が同じ条項={same} "
+        f"latency={args.latency}(mean={args.latency_mean}s)"
+    )
+
+    updated = contracts["A"][0]["knowledge_id"][0]
+
+    def examine(name):
+        done = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for event in examination_api_stream(
+                contract_type="業務委託契約",
+                background_info="",
+                partys=["甲", "乙"],
+                title="業務委託契約書",
+                clauses=contracts[name],
+                knowledge_all=knowledge_all,
+            ):
+                if event["type"] == "done":
+                    done = event
+        return done
+
+    results = {}
+    runs = [
+        ("1. 契約A（初回）", "A", None),
+        ("2. 契約B", "B", None),
+        ("3. 契約A（再審査）", "A", None),
+        (f"4. {updated} 更新後の契約A", "A", updated),
+    ]
+    for label, name, invalidate in runs:
+        if invalidate:
+            invalidate_knowledge_reviews(invalidate)
+        before = server.stats()
+        start = time.perf_counter()
+        done = examine(name)
+        elapsed = time.perf_counter() - start
+        reviews = server.stats().get("chat:review", 0) - before.get("chat:review", 0)
+        cache = done["review_cache"]
+        results[label] = done["analyzed_clauses"]
+        print(
+            f"  {label:<22}: {elapsed:6.2f}s 審査={reviews}回 "
+            f"キャッシュ={cache['hits']}/{cache['lookups']}組（ヒット率 {cache['hit_rate']:.0%}）"
+        )
+    first, _, again, after_update = results.values()
+    print(
+        f"  契約Aの結果が一致: 再審査={_comparable(first) == _comparable(again)} "
+        f"更新後={_comparable(first) == _comparable(after_update)}"
+    )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
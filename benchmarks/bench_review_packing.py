@@ -0,0 +1,115 @@
+"""
+審査呼び出しのパック（api/review_packing.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、マッチング済みの同じ条項で examination_api を
+  - ナレッジごと: REVIEW_PACKING_DISABLED=1（ナレッジ1件ごとに審査し、条項ごとに要約）
+  - パック: 割当条項の重なるナレッジを1回の審査にまとめる
+で実行し、所要時間、段階ごとの LLM 呼び出し回数（chat:review / chat:summary + chat:summary_batch）、
+審査プロンプトの合計文字数（chars:review）を表示する。
+疑似サーバーは各ナレッジの指摘を適用条項ごとに決定的に返すため、
+条項ごとの指摘事項（行の集合）と根拠ナレッジが両方式で一致するかも確かめる。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_review_packing --knowledge 80 --clauses 40 --latency lognormal --latency-mean 0.5
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _comparable(analyzed):
+    return [
+        (
+            a["clause_number"],
+            set(filter(None, (a["concern"] or "").split("\n"))),
+            set(a["knowledge_ids"]),
+        )
+        for a in analyzed
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=80, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=40, help="契約の条項数")
+    parser.add_argument(
+        "--pack-tokens", type=int, default=6000, help="1パックの推定トークン数の上限"
+    )
+    add_server_arguments(parser)
+    parser.set_defaults(latency="lognormal", latency_mean=0.5)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["REVIEW_CACHE_DISABLED"] = "1"
+    os.environ["TRACE_SINK"] = "none"
+    os.environ["REVIEW_PACK_TOKENS"] = str(args.pack_tokens)
+    # パックの切り方で指摘事項のまとまり方が変わるため、重複統合は比較から外す
+    os.environ["CONCERN_DEDUP_DISABLED"] = "1"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.chdir(workdir)
+
+    from api.examination_api import examination_api
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = [
+        {"clause_number": c["clause_number"], "clause": c["clause"]}
+        for c in make_clauses(args.clauses)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, clauses_augmented, _ = matching_clause_and_knowledge(knowledge_all, clauses)
+    pairs = sum(len(c["knowledge_id"]) for c in clauses_augmented)
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} 審査の組={pairs} "
+        f"latency={args.latency}(mean={args.latency_mean}s)"
+    )
+
+    results = {}
+    for label, disabled in (("ナレッジごと", "1"), ("パック", "")):
+        os.environ["REVIEW_PACKING_DISABLED"] = disabled
+        before = server.stats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[label] = examination_api(
+                contract_type="業務委託契約",
+                background_info="",
+                partys=["甲", "乙"],
+                title="業務委託契約書",
+                clauses=clauses_augmented,
+                knowledge_all=knowledge_all,
+            )
+        elapsed = time.perf_counter() - start
+        calls = {
+            k: server.stats().get(k, 0) - before.get(k, 0)
+            for k in (
+                "chat:review",
+                "chat:summary",
+                "chat:summary_batch",
+                "chars:review",
+            )
+        }
+        print(
+            f"  {label:<8}: {elapsed:6.2f}s 審査={calls['chat:review']}回 "
+            f"要約={calls['chat:summary'] + calls['chat:summary_batch']}回 審査プロンプト={calls['chars:review']}文字"
+        )
+    old, new = results.values()
+    print(
+        f"  条項ごとの指摘事項・根拠ナレッジが一致: {_comparable(old) == _comparable(new)}"
+    )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+条項要約のバッチ化（api/async_llm_service.summarize_clauses）のベンチマーク。
+
+疑似 Azure OpenAI サーバーに対し、マッチング済みの同じ条項で examination_api を
+  - 条項ごと: SUMMARY_BATCH_MAX_CLAUSES=1（要約が必要な条項ごとに1回ずつ呼び出す）
+  - バッチ: 複数条項の要約を SUMMARY_BATCH_TOKENS の範囲で1回の呼び出しにまとめる
+で実行し、所要時間、要約の呼び出し回数（chat:summary / chat:summary_batch）と
+要約プロンプトの合計文字数、戻り値（summarized_clauses）が一致するかを表示する。
+要約が多く発生するよう、審査はナレッジごとに実行する（REVIEW_PACKING_DISABLED=1）。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_summary_batching --knowledge 80 --clauses 40 --latency lognormal --latency-mean 0.5
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _comparable(analyzed):
+    return [
+        (
+            a["clause_number"],
+            a["concern"],
+            a["amendment_clause"],
+            set(a["knowledge_ids"]),
+        )
+        for a in analyzed
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=80, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=40, help="契約の条項数")
+    parser.add_argument(
+        "--batch-tokens", type=int, default=3000, help="1回の要約の推定トークン数の上限"
+    )
+    add_server_arguments(parser)
+    parser.set_defaults(latency="lognormal", latency_mean=0.5)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_TTL_DAYS"] = "0"
+    os.environ["MATCH_CACHE_DISABLED"] = "1"
+    os.environ["REVIEW_CACHE_DISABLED"] = "1"
+    os.environ["TRACE_SINK"] = "none"
+    os.environ["REVIEW_PACKING_DISABLED"] = "1"
+    os.environ["SUMMARY_BATCH_TOKENS"] = str(args.batch_tokens)
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding.sqlite3")
+    os.chdir(workdir)
+
+    from api.examination_api import examination_api
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+
+    knowledge_all = make_knowledge(args.knowledge)
+    clauses = [
+        {"clause_number": c["clause_number"], "clause": c["clause"]}
+        for c in make_clauses(args.clauses)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, clauses_augmented, _ = matching_clause_and_knowledge(knowledge_all, clauses)
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"latency={args.latency}(mean={args.latency_mean}s) "
+        f"invalid_json={args.invalid_json_rate}"
+    )
+
+    results = {}
+    for label, max_clauses in (("条項ごと", "1"), ("バッチ", "20")):
+        os.environ["SUMMARY_BATCH_MAX_CLAUSES"] = max_clauses
+        before = server.stats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[label] = examination_api(
+                contract_type="業務委託契約",
+                background_info="",
+                partys=["甲", "乙"],
+                title="業務委託契約書",
+                clauses=clauses_augmented,
+                knowledge_all=knowledge_all,
+            )
+        elapsed = time.perf_counter() - start
+        calls = {
+            k: server.stats().get(k, 0) - before.get(k, 0)
+            for k in (
+                "chat:summary",
+                "chat:summary_batch",
+                "chars:summary",
+                "chars:summary_batch",
+            )
+        }
+        print(
+            f"  {label:<6}: {elapsed:6.2f}s 要約={calls['chat:summary']}回 "
+            f"バッチ要約={calls['chat:summary_batch']}回 "
+            f"要約プロンプト={calls['chars:summary'] + calls['chars:summary_batch']}文字"
+        )
+    old, new = results.values()
+    print(f"  summarized_clauses が一致: {_comparable(old) == _comparable(new)}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+デバッグ用トレース出力（api/trace_sink.py）のベンチマーク。
+
+疑似 Azure OpenAI サーバーで1回マッチングしてトレースを作り、
+従来の match_cl_and_kn.json への同期書き出し（indent=2）と、トレースシンクへの emit
+（サンプリング率別。0.05 は既定値）について、マッチング処理側が待たされる時間と出力サイズを比較する。
+emit はキューに積むだけで、組み立て・JSON への変換・書き込みは書き込みスレッドで行う。
+
+実行方法（リポジトリルートで）:
+    python -m benchmarks.bench_trace_sink --knowledge 200 --clauses 60 --repeat 20
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import add_server_arguments, server_from_args
+from benchmarks.synthetic_contract import make_clauses, make_knowledge
+
+
+def _dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge", type=int, default=200, help="ナレッジ件数")
+    parser.add_argument("--clauses", type=int, default=60, help="契約の条項数")
+    parser.add_argument("--repeat", type=int, default=20, help="書き出し回数")
+    add_server_arguments(parser)
+    parser.set_defaults(latency_mean=0.01)
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    server.configure_env(lift_quota=True)
+    workdir = tempfile.mkdtemp()
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm.sqlite3")
+    os.environ["MATCH_CACHE_PATH"] = os.path.join(workdir, "match.sqlite3")
+    os.environ["TRACE_SINK"] = "none"
+    os.chdir(workdir)
+
+    from api.match_cl_and_kn import matching_clause_and_knowledge
+    from api.trace_sink import JsonlTraceSink, dedupe_message_contents
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        response, clauses_out, trace = matching_clause_and_knowledge(
+            make_knowledge(args.knowledge), make_clauses(args.clauses)
+        )
+    server.stop()
+    print(
+        f"knowledge={args.knowledge} clauses={args.clauses} "
+        f"プロンプト={len(trace['prompts'])}件 書き出し={args.repeat}回"
+    )
+
+    # 従来: 処理の最後に同期で JSON を書き出す
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        with open("match_cl_and_kn.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {"response": response, "clauses_out": clauses_out, "trace": trace},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    elapsed = (time.perf_counter() - start) / args.repeat
+    size = os.path.getsize("match_cl_and_kn.json")
+    print(
+        f"  同期 json.dump       : {elapsed * 1000:7.2f}ms/回  {size / 1024:8.1f}KiB/回"
+        "（毎回上書き）"
+    )
+
+    for rate in (1.0, 0.05, 0.0):
+        directory = os.path.join(workdir, f"traces-{rate}")
+        sink = JsonlTraceSink(directory, sample_rate=rate)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            sink.emit(
+                "matching",
+                lambda: {
+                    "response": response,
+                    "clauses_out": clauses_out,
+                    "trace": dedupe_message_contents(trace),
+                },
+            )
+        elapsed = (time.perf_counter() - start) / args.repeat
+        sink.flush()
+        sink.close()
+        stats = sink.stats()
+        size = _dir_size(directory) if os.path.isdir(directory) else 0
+        lines = 0
+        if size:
+            for entry in os.scandir(directory):
+                with gzip.open(entry.path, "rt", encoding="utf-8") as f:
+                    lines += sum(1 for _ in f)
+        print(
+            f"  sink rate={rate:<4}        : {elapsed * 1000:7.2f}ms/回  "
+            f"{size / 1024 / max(stats['written'], 1):8.1f}KiB/件  "
+            f"書き出し={stats['written']} 読み戻し={lines}行"
+        )
+
+
+if __name__ == "__main__":
+    main()
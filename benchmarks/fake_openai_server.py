@@ -0,0 +1,677 @@
+"""
+ローカルの疑似 Azure OpenAI サーバー（負荷試験・ベンチマーク用）。
+
+AzureOpenAI / AsyncAzureOpenAI クライアントが叩く次のエンドポイントを実装する。
+  - POST /openai/deployments/{deployment}/chat/completions（stream=True の SSE を含む）
+  - POST /openai/deployments/{deployment}/embeddings
+
+応答はプロンプトから決定的に作る（同じ入力には常に同じ応答）。
+  - matching     : knowledge.target_clause と条文の文字バイグラムの重なりが大きい条項を返す
+  - review       : 条項×ナレッジのハッシュで懸念あり/なしを決め、条項ごとのオブジェクトを返す
+  - summary      : 指摘事項・修正文案の重複を除いて連結する
+  - clause_merge : 本文が短い条項を直前の条項に結合するグループを返す
+  - json_repair  : 壊れたテキストから条項番号を拾い、正しい審査結果の形に直す
+  - embeddings   : 文字バイグラムのハッシュ特徴量（正規化済み）。似た文ほどコサイン類似度が高い
+
+障害注入:
+  - レイテンシ分布（fixed / uniform / exponential / lognormal）＋出力1文字あたりの遅延
+  - 一定割合の 429（Retry-After / retry-after-ms ヘッダ付き）
+  - 一定割合の不正JSON応答（プロンプトのハッシュで決まるため、同じプロンプトは常に不正）
+
+使い方:
+    # ベンチマークから
+    from benchmarks.fake_openai_server import FakeAzureOpenAIServer
+    server = FakeAzureOpenAIServer(latency="lognormal", latency_mean=0.8).start()
+    server.configure_env()  # OPENAI_API_BASE 等をこのサーバーに向ける（azure_ を import する前に呼ぶ）
+
+    # 単体起動して Streamlit アプリを向ける（OPENAI_API_BASE=http://127.0.0.1:8000）
+    python -m benchmarks.fake_openai_server --port 8000 --latency lognormal --rate-429 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+EMBEDDING_DIM = 1536
+LATENCY_KINDS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+def _digest(*parts: str) -> int:
+    """文字列から決定的な整数を作る"""
+    payload = "\x00".join(parts).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(payload).digest()[:8], "big")
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text or "")
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """文字バイグラムをハッシュで次元に割り当てた正規化ベクトル"""
+    vec = [0.0] * dim
+    for gram in _bigrams(text) or {text or " "}:
+        h = _digest(gram)
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _json_after(text: str, marker: str) -> Any:
+    """marker の直後に現れる最初のJSON値を取り出す（見つからなければ None）"""
+    pos = text.find(marker)
+    if pos < 0:
+        return None
+    rest = text[pos + len(marker) :]
+    start = min((i for i in (rest.find("["), rest.find("{")) if i >= 0), default=-1)
+    if start < 0:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(rest[start:])
+        return value
+    except ValueError:
+        return None
+
+
+# =========================
+# 段階ごとの疑似応答
+# =========================
+def _answer_matching(user: str) -> Dict[str, Any]:
+    knowledge = _json_after(user, "knowledge_all（審査知見の対象条項条件）:") or []
+    clauses = _json_after(user, "clauses（契約条項の本文）:") or []
+    clause_grams = [
+        (c["clause_number"], _bigrams(c.get("clause", ""))) for c in clauses
+    ]
+    items = []
+    for k in knowledge:
+        # 「〜を定める条項」等の定型部分は判定に使わない
+        target = _bigrams(
+            re.sub(r"(を|に関する)?(定める)?条項$", "", k.get("target_clause", ""))
+        )
+        scored = []
+        for num, grams in clause_grams:
+            overlap = len(target & grams) / (len(target) or 1)
+            if overlap >= 0.2:
+                scored.append((overlap, num))
+        scored.sort(key=lambda x: -x[0])
+        items.append(
+            {"knowledge_id": k["id"], "clause_number": [n for _, n in scored[:3]]}
+        )
+    return {"items": items}
+
+
+# near_duplicate_concerns=True のときの指摘の書き方（重複統合のベンチマーク用の重複の多いデータ）
+_CONCERN_STYLES = [
+    "- {}必要がある",
+    "・{}必要があります。",
+    "- {} 必要がある。",
+]
+
+
+def _review_item(
+    clause: Dict[str, Any],
+    knowledge: List[Dict[str, Any]],
+    near_duplicate_concerns: bool = False,
+):
+    num = str(clause.get("clause_number", ""))
+    hits = [
+        k
+        for k in knowledge
+        if _digest(clause.get("clause", ""), str(k.get("id", ""))) % 2 == 0
+    ]
+    if not hits:
+        return {
+            "clause_number": num,
+            "concern": None,
+            "amendment_clause": None,
+            "knowledge_ids": [],
+        }
+    if near_duplicate_concerns:
+        # 同じ対処方針のナレッジからは表記・語尾だけが違う指摘を返す
+        concerns = [
+            _CONCERN_STYLES[
+                _digest(num, str(k.get("id", ""))) % len(_CONCERN_STYLES)
+            ].format(k.get("action_plan") or k.get("knowledge_title") or k.get("id"))
+            for k in hits
+        ]
+    else:
+        concerns = [
+            f"- {k.get('knowledge_title') or k.get('review_points') or k.get('id')}の観点で確認が必要"
+            for k in hits
+        ]
+    return {
+        "clause_number": num,
+        "concern": "\n".join(concerns),
+        "amendment_clause": f"第{num}条（修正案）" + (clause.get("clause", "")[:40]),
+        "knowledge_ids": [str(k.get("id", "")) for k in hits],
+    }
+
+
+def _answer_review(user: str, near_duplicate_concerns: bool = False) -> Dict[str, Any]:
+    clauses = _json_after(user, "【審査対象データ】") or []
+    knowledge = _json_after(user, "【審査知見（knowledge）】") or []
+    # 複数ナレッジをまとめた審査では、各ナレッジを適用条項（applies_to_clause_numbers）にだけ使う
+    return {
+        "items": [
+            _review_item(
+                c,
+                [
+                    k
+                    for k in knowledge
+                    if "applies_to_clause_numbers" not in k
+                    or str(c.get("clause_number", "")) in k["applies_to_clause_numbers"]
+                ],
+                near_duplicate_concerns,
+            )
+            for c in clauses
+        ]
+    }
+
+
+def _answer_json_repair(user: str) -> Dict[str, Any]:
+    broken = user.split("【不正なJSONテキスト】", 1)[-1]
+    numbers = list(
+        dict.fromkeys(re.findall(r'"clause_number"\s*:\s*"([^"]*)"', broken))
+    )
+    return {
+        "items": [
+            {
+                "clause_number": n,
+                "concern": None,
+                "amendment_clause": None,
+                "knowledge_ids": [],
+            }
+            for n in numbers
+        ]
+    }
+
+
+def _summary_item(concerns: List[str], amendments: List[str]) -> Dict[str, Any]:
+    return {
+        "concern": "\n".join(dict.fromkeys(c for c in concerns if c)),
+        "amendment_clause": "\n".join(dict.fromkeys(a for a in amendments if a)),
+    }
+
+
+def _answer_summary(user: str) -> Dict[str, Any]:
+    return _summary_item(
+        _json_after(user, "【指摘事項一覧】") or [],
+        _json_after(user, "【修正文案一覧】") or [],
+    )
+
+
+def _answer_summary_batch(user: str) -> Dict[str, Any]:
+    return {
+        "items": [
+            {
+                "clause_number": str(item.get("clause_number", "")),
+                **_summary_item(item.get("concerns", []), item.get("amendments", [])),
+            }
+            for item in _json_after(user, "【要約対象】") or []
+        ]
+    }
+
+
+def _answer_clause_merge(user: str) -> Dict[str, Any]:
+    clauses = _json_after(user, "### 条文リスト:") or []
+    groups: List[List[int]] = []
+    for prev, cur in zip(clauses, clauses[1:]):
+        # 本文が極端に短い条項は「第X条に従い」等の引用で誤分割されたとみなす
+        body = cur.get("text", "").split("\n", 1)[-1]
+        if len(body) < 20:
+            if groups and groups[-1][-1] == prev["id"]:
+                groups[-1].append(cur["id"])
+            else:
+                groups.append([prev["id"], cur["id"]])
+    return {"groups": groups}
+
+
+def _detect_stage(payload: Dict[str, Any], user: str) -> Optional[str]:
+    fmt = payload.get("response_format") or {}
+    name = (fmt.get("json_schema") or {}).get("name", "")
+    if "【不正なJSONテキスト】" in user:
+        return "json_repair"
+    for stage in ("matching", "review", "summary", "summary_batch", "clause_merge"):
+        if name == f"{stage}_response":
+            return stage
+    # 構造化出力非対応モデル（response_format なし）はプロンプトで判定
+    if "clauses（契約条項の本文）" in user:
+        return "matching"
+    if "【審査対象データ】" in user:
+        return "review"
+    if "【要約対象】" in user:
+        return "summary_batch"
+    if "【指摘事項一覧】" in user:
+        return "summary"
+    if "### 条文リスト:" in user:
+        return "clause_merge"
+    return None
+
+
+_ANSWERS = {
+    "matching": _answer_matching,
+    "review": _answer_review,
+    "summary": _answer_summary,
+    "summary_batch": _answer_summary_batch,
+    "clause_merge": _answer_clause_merge,
+    "json_repair": _answer_json_repair,
+}
+# 構造化出力なしのときに返す素の配列のキー（実モデルの自由形式応答に合わせる）
+_UNWRAPPED = {
+    "matching": "items",
+    "review": "items",
+    "summary_batch": "items",
+    "clause_merge": "groups",
+}
+
+
+def fake_chat_answer(
+    payload: Dict[str, Any], near_duplicate_concerns: bool = False
+) -> str:
+    """
+    chat.completions のリクエストから決定的な応答テキストを作る。
+    near_duplicate_concerns=True では、審査の指摘を対処方針（action_plan）から表記・語尾だけを
+    変えて作る（重複統合のベンチマーク用。既定では指摘はナレッジごとに異なる）。
+    """
+    messages = payload.get("messages", [])
+    user = "\n".join(
+        m.get("content", "") for m in messages if m.get("role") != "system"
+    )
+    stage = _detect_stage(payload, user)
+    if stage is None:
+        return f"（疑似応答）{user[:50]}"
+    if stage == "review":
+        answer = _answer_review(user, near_duplicate_concerns)
+    else:
+        answer = _ANSWERS[stage](user)
+    if not payload.get("response_format") and stage in _UNWRAPPED:
+        answer = answer[_UNWRAPPED[stage]]
+    return json.dumps(answer, ensure_ascii=False)
+
+
+# =========================
+# サーバー本体
+# =========================
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeAzureOpenAIServer:
+    """
+    疑似 Azure OpenAI サーバー。
+    latency: レイテンシ分布（fixed / uniform / exponential / lognormal）
+    latency_mean: 1リクエストの平均遅延秒（ストリーミングでは最初のチャンクまで）
+    latency_spread: uniform は ±幅（秒）、lognormal は σ
+    per_input_char: プロンプト（messages の content）1文字あたりの追加遅延秒
+    per_output_char: 出力1文字あたりの追加遅延秒（ストリーミングではチャンクごとに分けて待つ）
+    embedding_per_input: embeddings の入力1件あたりの追加遅延秒
+    rate_429: 429 を返す確率
+    retry_after: 429 の Retry-After 秒
+    invalid_json_rate: 構造化出力の段階で不正なJSONを返す割合（プロンプト単位で決定的）
+    near_duplicate_concerns: 審査の指摘を表記・語尾だけが違う重複の多いものにする（fake_chat_answer）
+    seed: レイテンシ・429 の乱数シード
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: str = "fixed",
+        latency_mean: float = 0.0,
+        latency_spread: float = 0.5,
+        per_input_char: float = 0.0,
+        per_output_char: float = 0.0,
+        embedding_per_input: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: float = 1.0,
+        invalid_json_rate: float = 0.0,
+        near_duplicate_concerns: bool = False,
+        seed: int = 0,
+    ):
+        if latency not in LATENCY_KINDS:
+            raise ValueError(f"未対応のレイテンシ分布です: {latency}")
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.per_input_char = per_input_char
+        self.per_output_char = per_output_char
+        self.embedding_per_input = embedding_per_input
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.invalid_json_rate = invalid_json_rate
+        self.near_duplicate_concerns = near_duplicate_concerns
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._server = _Server((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAzureOpenAIServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-openai", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def configure_env(self, lift_quota: bool = False):
+        """
+        azure_.openai_service がこのサーバーに接続するよう環境変数を設定する。
+        lift_quota=True のときはデプロイメントの TPM/RPM 制限（api/rate_limiter.py）を実質無制限にする。
+        """
+        os.environ["OPENAI_API_BASE"] = self.url
+        os.environ["OPENAI_API_KEY"] = "fake"
+        os.environ["OPENAI_API_VERSION"] = "2024-10-21"
+        if lift_quota:
+            from api.rate_limiter import DEFAULT_DEPLOYMENT_LIMITS
+
+            os.environ.setdefault(
+                "LLM_DEPLOYMENT_LIMITS",
+                json.dumps(
+                    {
+                        name: {"rpm": 1000000, "tpm": 1000000000}
+                        for name in DEFAULT_DEPLOYMENT_LIMITS
+                    }
+                ),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def _sample_latency(self) -> float:
+        with self._lock:
+            if self.latency == "fixed":
+                return self.latency_mean
+            if self.latency == "uniform":
+                return max(
+                    0.0,
+                    self._rng.uniform(
+                        self.latency_mean - self.latency_spread,
+                        self.latency_mean + self.latency_spread,
+                    ),
+                )
+            if self.latency == "exponential":
+                return (
+                    self._rng.expovariate(1.0 / self.latency_mean)
+                    if self.latency_mean > 0
+                    else 0.0
+                )
+            # lognormal: 平均が latency_mean になるよう μ を調整
+            if self.latency_mean <= 0:
+                return 0.0
+            sigma = self.latency_spread
+            mu = math.log(self.latency_mean) - sigma * sigma / 2
+            return self._rng.lognormvariate(mu, sigma)
+
+    def _throttled(self) -> bool:
+        with self._lock:
+            return self.rate_429 > 0 and self._rng.random() < self.rate_429
+
+    def _is_invalid(self, payload: Dict[str, Any]) -> bool:
+        # ストリーミングの有無などのパラメータによらず、メッセージだけで決める
+        if self.invalid_json_rate <= 0:
+            return False
+        prompt = json.dumps(payload.get("messages", []), ensure_ascii=False)
+        return _digest(prompt) % 10000 < self.invalid_json_rate * 10000
+
+    def _make_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                path = self.path.split("?", 1)[0]
+                if server._throttled():
+                    server._count("429")
+                    self._send_json(
+                        429,
+                        {
+                            "error": {
+                                "code": "429",
+                                "message": "Rate limit is exceeded (fake).",
+                            }
+                        },
+                        {
+                            "Retry-After": str(math.ceil(server.retry_after)),
+                            "retry-after-ms": str(int(server.retry_after * 1000)),
+                        },
+                    )
+                    return
+                if path.endswith("/chat/completions"):
+                    self._chat(json.loads(body), body)
+                elif path.endswith("/embeddings"):
+                    self._embeddings(json.loads(body))
+                else:
+                    self._send_json(404, {"error": {"code": "404", "message": path}})
+
+            def _chat(self, payload, body):
+                server._count("chat")
+                answer = fake_chat_answer(payload, server.near_duplicate_concerns)
+                # 段階ごとの呼び出し回数とプロンプトの文字数（chat:<段階>, chars:<段階>）
+                messages = payload.get("messages", [])
+                user = "\n".join(
+                    m.get("content", "") for m in messages if m.get("role") != "system"
+                )
+                stage = _detect_stage(payload, user) or "other"
+                server._count(f"chat:{stage}")
+                server._count(
+                    f"chars:{stage}", sum(len(m.get("content") or "") for m in messages)
+                )
+                finish_reason = "stop"
+                if server._is_invalid(payload) and answer.startswith(("{", "[")):
+                    # 途中で切れた応答（長い出力の打ち切り等）を模す
+                    server._count("invalid_json")
+                    answer = answer[: max(1, len(answer) // 2)]
+                    finish_reason = "length"
+                prompt_chars = sum(
+                    len(m.get("content") or "") for m in payload.get("messages", [])
+                )
+                time.sleep(
+                    server._sample_latency() + server.per_input_char * prompt_chars
+                )
+                model = payload.get("model", "")
+                usage = {
+                    "prompt_tokens": len(body) // 4,
+                    "completion_tokens": len(answer),
+                    "total_tokens": len(body) // 4 + len(answer),
+                }
+                if payload.get("stream"):
+                    self._stream(model, answer, finish_reason)
+                    return
+                time.sleep(server.per_output_char * len(answer))
+                self._send_json(
+                    200,
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "finish_reason": finish_reason,
+                                "message": {"role": "assistant", "content": answer},
+                            }
+                        ],
+                        "usage": usage,
+                    },
+                )
+
+            def _stream(self, model, answer, finish_reason="stop", chunk_chars=16):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                pieces = [
+                    answer[i : i + chunk_chars]
+                    for i in range(0, len(answer), chunk_chars)
+                ]
+                for n, piece in enumerate(pieces):
+                    time.sleep(server.per_output_char * len(piece))
+                    chunk = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {"content": piece},
+                                # 最後のチャンクで終了理由を送る
+                                "finish_reason": (
+                                    finish_reason if n == len(pieces) - 1 else None
+                                ),
+                            }
+                        ],
+                    }
+                    self.wfile.write(
+                        f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode(
+                            "utf-8"
+                        )
+                    )
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _embeddings(self, payload):
+                server._count("embeddings")
+                inputs = payload["input"]
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                time.sleep(
+                    server._sample_latency() + server.embedding_per_input * len(inputs)
+                )
+                self._send_json(
+                    200,
+                    {
+                        "object": "list",
+                        "model": payload.get("model", ""),
+                        "data": [
+                            {
+                                "object": "embedding",
+                                "index": i,
+                                "embedding": fake_embedding(t),
+                            }
+                            for i, t in enumerate(inputs)
+                        ],
+                        "usage": {
+                            "prompt_tokens": len(inputs),
+                            "total_tokens": len(inputs),
+                        },
+                    },
+                )
+
+            def _send_json(self, status, obj, headers=None):
+                data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return _Handler
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """ベンチマーク共通の疑似サーバー設定の引数を追加する"""
+    parser.add_argument("--latency", choices=LATENCY_KINDS, default="fixed")
+    parser.add_argument(
+        "--latency-mean", type=float, default=0.5, help="1リクエストの平均遅延秒"
+    )
+    parser.add_argument(
+        "--latency-spread",
+        type=float,
+        default=0.5,
+        help="uniform は ±幅（秒）、lognormal は σ",
+    )
+    parser.add_argument(
+        "--per-input-char",
+        type=float,
+        default=0.0,
+        help="プロンプト1文字あたりの遅延秒",
+    )
+    parser.add_argument(
+        "--per-output-char", type=float, default=0.0, help="出力1文字あたりの遅延秒"
+    )
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429 を返す確率")
+    parser.add_argument(
+        "--retry-after", type=float, default=1.0, help="429 の Retry-After 秒"
+    )
+    parser.add_argument(
+        "--invalid-json-rate", type=float, default=0.0, help="不正JSON応答の割合"
+    )
+    parser.add_argument(
+        "--near-duplicate-concerns",
+        action="store_true",
+        help="審査の指摘を表記・語尾だけが違う重複の多いものにする（重複統合の確認用）",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def server_from_args(args, **overrides) -> FakeAzureOpenAIServer:
+    kwargs = dict(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_spread=args.latency_spread,
+        per_input_char=args.per_input_char,
+        per_output_char=args.per_output_char,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        invalid_json_rate=args.invalid_json_rate,
+        near_duplicate_concerns=args.near_duplicate_concerns,
+        seed=args.seed,
+    )
+    kwargs.update(overrides)
+    return FakeAzureOpenAIServer(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, host=args.host, port=args.port).start()
+    print(f"fake Azure OpenAI: {server.url}  (OPENAI_API_BASE に設定してください)")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats())
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+ベンチマーク用の合成データ（契約書の条項・審査ナレッジ）。
+乱数シードが同じなら常に同じデータを返す。
+"""
+
+import random
+from typing import Any, Dict, List
+
+# (条項見出し, 本文テンプレート, ナレッジの対象条項条件)
+TOPICS = [
+    (
+        "目的",
+        "本契約は、甲が乙に対し{subject}を委託し、乙がこれを受託することに関する基本的事項を定めることを目的とする。",
+        "契約の目的・委託業務の範囲を定める条項",
+    ),
+    (
+        "定義",
+        "本契約において「秘密情報」とは、開示当事者が受領当事者に開示した{subject}に関する技術上又は営業上の一切の情報をいう。",
+        "用語の定義を定める条項",
+    ),
+    (
+        "秘密保持",
+        "受領当事者は、秘密情報を厳に秘密として保持し、開示当事者の事前の書面による承諾なく第三者に開示又は漏えいしてはならない。",
+        "秘密情報の保持・第三者への開示制限を定める条項",
+    ),
+    (
+        "損害賠償",
+        "甲又は乙は、本契約に違反して相手方に損害を与えた場合、{limit}を上限として当該損害を賠償する責任を負う。",
+        "損害賠償責任とその上限を定める条項",
+    ),
+    (
+        "契約期間",
+        "本契約の有効期間は、締結日から{years}年間とし、期間満了の3か月前までに書面による申出がない限り同一条件で自動更新する。",
+        "契約の有効期間・自動更新を定める条項",
+    ),
+    (
+        "解除",
+        "甲又は乙は、相手方が本契約に違反し、相当の期間を定めて催告したにもかかわらず是正されない場合、本契約を解除することができる。",
+        "契約の解除事由・催告解除を定める条項",
+    ),
+    (
+        "反社会的勢力の排除",
+        "甲及び乙は、自己又はその役員が暴力団その他の反社会的勢力に該当しないことを表明し、将来にわたっても該当しないことを確約する。",
+        "反社会的勢力の排除・表明保証を定める条項",
+    ),
+    (
+        "支払条件",
+        "甲は、乙の請求に基づき、委託料を毎月末日締め翌月末日限り乙の指定する銀行口座に振り込む方法により支払う。",
+        "委託料・代金の支払条件を定める条項",
+    ),
+    (
+        "知的財産権",
+        "本業務の遂行により生じた成果物に関する著作権その他の知的財産権は、委託料の完済をもって乙から甲に移転する。",
+        "成果物の知的財産権の帰属を定める条項",
+    ),
+    (
+        "再委託",
+        "乙は、甲の事前の書面による承諾を得た場合に限り、本業務の全部又は一部を第三者に再委託することができる。",
+        "再委託の可否・条件を定める条項",
+    ),
+    (
+        "不可抗力",
+        "天災地変、戦争、感染症の流行その他当事者の責に帰すことのできない事由により本契約の履行が遅延した場合、当該当事者は責任を負わない。",
+        "不可抗力による免責を定める条項",
+    ),
+    (
+        "権利義務の譲渡禁止",
+        "甲及び乙は、相手方の事前の書面による承諾なく、本契約上の地位又は本契約に基づく権利義務を第三者に譲渡してはならない。",
+        "契約上の地位・権利義務の譲渡禁止を定める条項",
+    ),
+    (
+        "個人情報の取扱い",
+        "乙は、本業務の遂行に際して取得した個人情報を、個人情報保護法その他の関係法令に従い適切に取り扱うものとする。",
+        "個人情報の取扱い・安全管理を定める条項",
+    ),
+    (
+        "準拠法",
+        "本契約の準拠法は日本法とする。",
+        "準拠法を定める条項",
+    ),
+    (
+        "合意管轄",
+        "本契約に関する一切の紛争については、{court}を第一審の専属的合意管轄裁判所とする。",
+        "紛争解決の管轄裁判所を定める条項",
+    ),
+]
+
+# ナレッジだけに現れる条項類型（他の契約類型向けの審査知見）。(条項見出し, 対象条項条件)
+KNOWLEDGE_ONLY_TOPICS = [
+    ("検収", "納入物の検査・検収の手続と期限を定める条項"),
+    ("契約不適合責任", "目的物の契約不適合（瑕疵）に対する責任と期間を定める条項"),
+    ("所有権の移転", "売買目的物の所有権の移転時期を定める条項"),
+    ("危険負担", "引渡し前後の滅失・毀損の危険負担を定める条項"),
+    ("製造物責任", "製造物の欠陥による第三者損害の責任分担を定める条項"),
+    ("ロイヤリティ", "ライセンス料・ロイヤリティの算定と報告を定める条項"),
+    ("サブライセンス", "再許諾（サブライセンス）の可否を定める条項"),
+    ("競業避止", "契約期間中及び終了後の競業避止義務を定める条項"),
+    ("独占販売権", "販売店に付与する独占的販売権の範囲を定める条項"),
+    ("最低購入数量", "最低購入数量・未達時の措置を定める条項"),
+    ("輸出管理", "外為法等の輸出管理規制の遵守を定める条項"),
+    ("保険", "当事者が付保すべき保険の種類と金額を定める条項"),
+    ("立入監査", "相手方事業所への立入り・監査の権利を定める条項"),
+    ("出向者の労務管理", "出向者の指揮命令・労務管理の帰属を定める条項"),
+    ("賃料改定", "賃料の改定の条件と手続を定める条項"),
+    ("原状回復", "賃貸物件の明渡し時の原状回復義務を定める条項"),
+    ("株式の譲渡制限", "株式の譲渡制限・先買権を定める条項"),
+    ("表明保証", "株式譲渡における売主の表明保証の範囲を定める条項"),
+    ("クロージング", "取引実行（クロージング）の前提条件を定める条項"),
+    ("貸付金の返済", "貸付金の返済方法・期限の利益喪失を定める条項"),
+]
+
+_SUBJECTS = [
+    "システム開発業務",
+    "保守運用業務",
+    "コンサルティング業務",
+    "データ分析業務",
+]
+_COURTS = ["東京地方裁判所", "大阪地方裁判所", "名古屋地方裁判所"]
+
+
+def make_clauses(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """n 条の条項（clause_number, clause）を作る。TOPICS を循環させ、文言を少しずつ変える"""
+    rng = random.Random(seed)
+    clauses = []
+    for i in range(n):
+        heading, template, _ = TOPICS[i % len(TOPICS)]
+        body = template.format(
+            subject=rng.choice(_SUBJECTS),
+            limit=f"直近{rng.randint(1, 12)}か月分の委託料",
+            years=rng.randint(1, 5),
+            court=rng.choice(_COURTS),
+        )
+        clauses.append(
+            {
+                "clause_number": str(i + 1),
+                "clause": f"第{i + 1}条（{heading}）\n{body}",
+            }
+        )
+    return clauses
+
+
+def make_knowledge(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    n 件の審査ナレッジ（KnowledgeAPI の保存形式に合わせる）。
+    make_clauses の条項類型に加え、契約書に現れない類型（KNOWLEDGE_ONLY_TOPICS）も循環させる。
+    """
+    rng = random.Random(seed)
+    topics = [(h, t) for h, _, t in TOPICS] + KNOWLEDGE_ONLY_TOPICS
+    knowledge = []
+    for i in range(n):
+        heading, target = topics[i % len(topics)]
+        knowledge.append(
+            {
+                "id": f"knowledge-{i + 1:05d}",
+                "knowledge_number": i + 1,
+                "version": 1,
+                "contract_type": "業務委託契約",
+                "target_clause": target,
+                "knowledge_title": f"{heading}の確認{i // len(topics) + 1}",
+                "review_points": f"{heading}について当社に不利な定めがないか確認する（観点{rng.randint(1, 99)}）",
+                "action_plan": f"{heading}の文言を当社標準に修正する",
+                "clause_sample": "",
+                "record_status": "latest",
+                "approval_status": "approved",
+            }
+        )
+    return knowledge
+
+
+def write_contract_docx(
+    path: str, clauses: List[Dict[str, Any]], title="業務委託契約書"
+):
+    """document_input.extract_text_from_document で読める docx を書き出す"""
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph(title)
+    doc.add_paragraph(
+        "株式会社甲（以下「甲」という。）と株式会社乙（以下「乙」という。）は、次のとおり契約を締結する。"
+    )
+    for c in clauses:
+        for line in c["clause"].split("\n"):
+            doc.add_paragraph(line)
+    doc.add_paragraph(
+        "以上の合意を証するため、本書2通を作成し、甲乙記名押印の上各1通を保有する。"
+    )
+    doc.save(path)
@@ -1,8 +1,7 @@
 import streamlit as st
 from api.contract_api import ContractAPI
 from api.knowledge_api import KnowledgeAPI
-from api.examination_api import examination_api
-from api.match_cl_and_kn import matching_clause_and_knowledge
+from api.examination_pipeline import examination_pipeline_stream
 from services.document_input import extract_text_from_document
 import tempfile
 import os
@@ -238,19 +237,81 @@ def main():
             ]
             title = st.session_state["exam_title"]
             clauses = collect_exam_clauses()
-            _, clauses_augmented, _ = matching_clause_and_knowledge(
-                st.session_state["knowledge_all"], clauses
-            )
-            with st.spinner("審査中...", show_time=True):
+            # マッチングで割当が確定したナレッジから審査を始める。
+            # 審査結果は届いた条項から順に表示し、全件そろったら本表示に切り替える
+            with st.status("マッチング・審査中...", expanded=True) as status:
+                placeholders = {}
+                partial_results = {}
+
+                def show_live_result(clause_number, concern, amendment, final):
+                    if clause_number not in placeholders:
+                        placeholders[clause_number] = st.empty()
+                    with placeholders[clause_number].container():
+                        label = "審査結果" if final else "審査中（暫定）"
+                        st.markdown(f"**{clause_number}** — {label}")
+                        if amendment:
+                            st.markdown(
+                                f"修正条文：{amendment}".replace("\n", "<br>"),
+                                unsafe_allow_html=True,
+                            )
+                        st.markdown(
+                            (concern or "懸念事項なし").replace("\n", "<br>"),
+                            unsafe_allow_html=True,
+                        )
+
                 try:
-                    analyzed_clauses = examination_api(
+                    analyzed_clauses = []
+                    review_cache = {}
+                    for event in examination_pipeline_stream(
                         contract_type=contract_type,
                         background_info=background_info,
                         partys=partys,
                         title=title,
-                        clauses=clauses_augmented,
+                        clauses=clauses,
                         knowledge_all=st.session_state["knowledge_all"],
-                    )
+                    ):
+                        if event["type"] == "matching":
+                            status.update(label="審査中...")
+                        elif event["type"] == "review":
+                            item = event["item"]
+                            if not (
+                                item.get("concern") or item.get("amendment_clause")
+                            ):
+                                continue
+                            num = item.get("clause_number")
+                            partial_results.setdefault(num, []).append(item)
+                            # 要約が届くまでは、パックごとの指摘事項・修正条文をすべて並べて表示する
+                            show_live_result(
+                                num,
+                                "\n".join(
+                                    r["concern"]
+                                    for r in partial_results[num]
+                                    if r.get("concern")
+                                ),
+                                "\n".join(
+                                    r["amendment_clause"]
+                                    for r in partial_results[num]
+                                    if r.get("amendment_clause")
+                                ),
+                                final=False,
+                            )
+                        elif event["type"] == "clause":
+                            analyzed = event["clause"]
+                            num = analyzed["clause_number"]
+                            if analyzed.get("concern") or num in placeholders:
+                                show_live_result(
+                                    num,
+                                    analyzed.get("concern"),
+                                    analyzed.get("amendment_clause"),
+                                    final=True,
+                                )
+                        elif event["type"] == "done":
+                            analyzed_clauses = event["analyzed_clauses"]
+                            review_cache = event.get("review_cache") or {}
+                    label = "審査完了"
+                    if review_cache.get("lookups"):
+                        label += f"（審査結果キャッシュ ヒット率 {review_cache['hit_rate']:.0%}）"
+                    status.update(label=label, state="complete")
                     if not analyzed_clauses:
                         st.info("審査結果がありません。")
                     else:
@@ -260,6 +321,7 @@ def main():
                         st.session_state["exam_page_status"] = "examination"
                         st.rerun()
                 except Exception as e:
+                    status.update(label="審査エラー", state="error")
                     st.error(f"審査処理でエラーが発生しました: {e}")
     if st.session_state["exam_page_status"] == "examination":
         st.success("審査結果を表示しました。")
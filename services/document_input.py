@@ -4,6 +4,7 @@ def extract_text_from_document(file_path: str) -> dict:
     from docx import Document
     from azure_.documentintelligence import get_document_intelligence_ocr
     from azure_.openai_service import AzureOpenAIService
+    from azure_.response_schemas import parse_structured_response
     import re
     import json
 
@@ -178,7 +179,7 @@ def extract_text_from_document(file_path: str) -> dict:
         {"role": "user", "content": prompt},
     ]
     try:
-        result = openai.get_openai_response_gpt41(messages)
+        result = openai.complete("clause_merge", messages)
         if isinstance(result, str):
             result = (
                 result.replace("```json", "")
@@ -207,7 +208,8 @@ def extract_text_from_document(file_path: str) -> dict:
     import copy
 
     clauses = copy.deepcopy(chunked["clauses"])
-    merge_groups = json.loads(result)
+    # 構造化出力では {"groups": [...]} で返るため包みを外す
+    merge_groups = parse_structured_response(result, "clause_merge")
     merged = []
     used_ids = set()
     for group in merge_groups: